@@ -0,0 +1,77 @@
+import os, time, argparse, tempfile
+
+# throughput of POST /notes/batch against the same work done as one POST / PUT / DELETE per note,
+# measured in-process through TestClient so only the app and the database are timed. Defaults to a
+# throwaway SQLite file; set DB_BACKEND / MONGO_URI / SQLALCHEMY_DATABASE_URL to bench a real server.
+_tmp = tempfile.mkdtemp()
+os.environ.setdefault("DB_BACKEND", "sql")
+os.environ.setdefault("SQLALCHEMY_DATABASE_URL", f"sqlite:///{_tmp}/bench.db")
+os.environ.setdefault("UPLOAD_DIR", os.path.join(_tmp, "uploads"))
+os.makedirs(os.environ["UPLOAD_DIR"], exist_ok=True)
+
+from fastapi.testclient import TestClient
+import app as notes_app
+
+def _login(c: TestClient, email: str) -> dict:
+    c.post("/auth/register", json={"email": email, "password": "bench-secret"})
+    tok = c.post("/auth/login", data={"username": email, "password": "bench-secret"}).json()["access_token"]
+    return {"Authorization": f"Bearer {tok}"}
+
+def _text(i: int, k: int) -> str:
+    return f"note {i} revision {k} " + "lorem ipsum dolor sit amet " * 8
+
+def _single(c, h, n):
+    ids, t = [], {}
+    start = time.perf_counter()
+    for i in range(n):
+        ids.append(c.post("/notes", json={"note_title": f"n{i}", "note_description": _text(i, 0)}, headers=h).json()["uniqueID"])
+    t["create"] = time.perf_counter() - start
+    start = time.perf_counter()
+    for i, uid in enumerate(ids):
+        c.put(f"/notes/{uid}", json={"note_title": f"n{i}", "note_description": _text(i, 1)}, headers=h).raise_for_status()
+    t["update"] = time.perf_counter() - start
+    start = time.perf_counter()
+    for uid in ids:
+        c.delete(f"/notes/{uid}", headers=h).raise_for_status()
+    t["delete"] = time.perf_counter() - start
+    return t
+
+def _batched(c, h, n, size):
+    def send(ops):
+        r = c.post("/notes/batch", json={"ops": ops}, headers=h)
+        r.raise_for_status()
+        bad = [x for x in r.json() if x["status"] >= 400]
+        assert not bad, bad[:3]
+        return r.json()
+
+    ids, t = [], {}
+    start = time.perf_counter()
+    for lo in range(0, n, size):
+        res = send([{"op": "create", "note_title": f"n{i}", "note_description": _text(i, 0)} for i in range(lo, min(n, lo + size))])
+        ids.extend(x["uniqueID"] for x in res)
+    t["create"] = time.perf_counter() - start
+    start = time.perf_counter()
+    for lo in range(0, n, size):
+        send([{"op": "update", "uniqueID": uid, "note_title": f"n{i}", "note_description": _text(i, 1)} for i, uid in enumerate(ids[lo:lo + size], lo)])
+    t["update"] = time.perf_counter() - start
+    start = time.perf_counter()
+    for lo in range(0, n, size):
+        send([{"op": "delete", "uniqueID": uid} for uid in ids[lo:lo + size]])
+    t["delete"] = time.perf_counter() - start
+    return t
+
+def main(n: int, size: int):
+    c = TestClient(notes_app.app)
+    h = _login(c, f"bench-{int(time.time())}@example.com")
+    print(f"{notes_app.DB_BACKEND} (async={notes_app.DB_ASYNC}), {n} notes, batches of {size}")
+    single, batched = _single(c, h, n), _batched(c, h, n, size)
+    for op in ("create", "update", "delete"):
+        a, b = n / single[op], n / batched[op]
+        print(f"  {op:>6}: single {a:8,.0f} ops/s  batch {b:8,.0f} ops/s  x{b / a:.1f}")
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--notes", type=int, default=1000)
+    ap.add_argument("--batch-size", type=int, default=200)
+    args = ap.parse_args()
+    main(args.notes, args.batch_size)
@@ -0,0 +1,68 @@
+import time, random, argparse
+from utils_b64 import b64e
+from utils_codec import encode, decode, decode_many, codec_of
+
+# storage size and encode/decode throughput of the note text codecs on synthetic corpora shaped
+# like real notes: short titles, prose, markdown checklists and pasted code/logs
+
+WORDS = ("the a to of and in for on with meeting notes project review todo update follow up client "
+         "deadline draft release bug fix api deploy design budget plan call email sync agenda idea "
+         "weekly sprint blocker owner status next steps decision risk estimate launch feedback").split()
+
+def _sentence(rng: random.Random) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 18))).capitalize() + "."
+
+def _prose(rng, paragraphs):
+    return "\n\n".join(" ".join(_sentence(rng) for _ in range(rng.randint(2, 6))) for _ in range(paragraphs))
+
+def _checklist(rng):
+    return "## " + _sentence(rng) + "\n" + "\n".join(f"- [{rng.choice(' x')}] {_sentence(rng)}" for _ in range(rng.randint(4, 20)))
+
+def _log(rng):
+    return "\n".join(f"2025-10-{rng.randint(1, 28):02d}T{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:00Z INFO "
+                     f"worker-{rng.randint(1, 8)} request_id={rng.getrandbits(48):012x} status=200 took={rng.randint(1, 900)}ms"
+                     for _ in range(rng.randint(10, 60)))
+
+CORPORA = {
+    "titles": lambda rng: " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 8))),
+    "short": lambda rng: _sentence(rng),
+    "prose": lambda rng: _prose(rng, rng.randint(1, 6)),
+    "checklist": _checklist,
+    "logs": _log,
+}
+
+def _bench(name, texts, enc, rounds):
+    t = time.perf_counter()
+    for _ in range(rounds):
+        stored = [enc(x) for x in texts]
+    t_enc = (time.perf_counter() - t) / rounds
+    t = time.perf_counter()
+    for _ in range(rounds):
+        decode_many(stored)
+    t_dec = (time.perf_counter() - t) / rounds
+    raw = sum(len(x.encode("utf-8")) for x in texts)
+    size = sum(len(s) for s in stored)
+    mb = raw / 1e6
+    tags = sorted({codec_of(s) for s in stored})
+    print(f"  {name:>7}: {size / raw:6.1%} of raw  enc {mb / t_enc:7.1f} MB/s  dec {mb / t_dec:7.1f} MB/s  tags {','.join(tags)}")
+
+def main(n: int, rounds: int, seed: int):
+    rng = random.Random(seed)
+    for corpus, gen in CORPORA.items():
+        texts = [gen(rng) for _ in range(n)]
+        for x in texts[:50]:
+            assert decode(encode(x)) == x and decode(encode(x, "lzma")) == x
+        avg = sum(len(x) for x in texts) / n
+        print(f"{corpus} ({n} notes, avg {avg:.0f} chars)")
+        _bench("base64", texts, b64e, rounds)
+        _bench("plain", texts, lambda x: encode(x, "plain"), rounds)
+        _bench("zlib", texts, lambda x: encode(x, "zlib"), rounds)
+        _bench("lzma", texts, lambda x: encode(x, "lzma"), rounds)
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--notes", type=int, default=2000)
+    ap.add_argument("--rounds", type=int, default=3)
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+    main(args.notes, args.rounds, args.seed)
@@ -0,0 +1,339 @@
+import os, sys, json, math, time, random, asyncio, argparse, platform, tempfile, subprocess
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Any, Callable, Dict, List, Optional
+
+# in-process load test of the real app, with no outside services: SQL runs on a throwaway SQLite
+# file and Mongo on mongomock / mongomock-motor (bench-only dependencies, not in requirements.txt).
+# Each backend runs in its own spawned process, since app.py picks its backend at import time.
+# Users are seeded through the public API (register, upload, POST /notes/batch), then every
+# endpoint is driven by --concurrency concurrent clients over httpx's ASGI transport, so only the
+# app and its database are timed. Results can be saved as a JSON baseline and compared later:
+#   python -m Scripts.BenchLoad --save base.json
+#   python -m Scripts.BenchLoad --compare base.json
+BENCH_PASSWORD = "bench-secret"
+PAGE = 50
+WORDS = ("alpha", "bravo", "charlie", "delta", "echo", "foxtrot", "golf", "hotel", "india", "juliet",
+         "kilo", "lima", "mike", "november", "oscar", "papa", "quebec", "romeo", "sierra", "tango")
+# smallest valid PNG header plus padding; the bytes differ per file so CAS storage keeps them apart
+_PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 24
+
+def _text(rng: random.Random, n: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(n))
+
+def _pct(xs: List[float], p: float) -> float:
+    return xs[min(len(xs) - 1, max(0, math.ceil(p / 100 * len(xs)) - 1))] if xs else 0.0
+
+def _summary(lat: List[float], statuses: Dict[int, int], errors: int, elapsed: float) -> Dict[str, Any]:
+    xs = sorted(lat)
+    ms = lambda v: round(v * 1000, 3)
+    return {
+        "requests": len(xs), "errors": errors, "seconds": round(elapsed, 3),
+        "rps": round(len(xs) / max(elapsed, 1e-9), 1),
+        "p50_ms": ms(_pct(xs, 50)), "p95_ms": ms(_pct(xs, 95)), "p99_ms": ms(_pct(xs, 99)), "max_ms": ms(xs[-1] if xs else 0.0),
+        "statuses": {str(k): v for k, v in sorted(statuses.items())},
+    }
+
+def _mongo_stand_in() -> None:
+    try:
+        import mongomock, mongomock_motor
+    except ImportError:
+        raise SystemExit("the mongo backend needs the bench-only packages: pip install mongomock mongomock-motor")
+    from pymongo import InsertOne, UpdateOne, ReplaceOne, DeleteOne
+    import motor.motor_asyncio
+    import databases.mongodb_connect as mc
+
+    def bulk_write(self, ops, ordered=True, **_):
+        # mongomock's own bulk_write rejects the ops of current pymongo releases; replay them one by one
+        matched = deleted = 0
+        for op in ops:
+            if isinstance(op, InsertOne):
+                self.insert_one(op._doc)
+            elif isinstance(op, UpdateOne):
+                matched += self.update_one(op._filter, op._doc, upsert=bool(op._upsert)).matched_count
+            elif isinstance(op, ReplaceOne):
+                matched += self.replace_one(op._filter, op._doc, upsert=bool(op._upsert)).matched_count
+            elif isinstance(op, DeleteOne):
+                deleted += self.delete_one(op._filter).deleted_count
+        return type("BulkResult", (), {"matched_count": matched, "deleted_count": deleted})()
+
+    mongomock.collection.Collection.bulk_write = bulk_write
+    client = mongomock.MongoClient()  # one store behind both the sync and the Motor client
+    mc.MongoClient = lambda uri, **_: client
+    motor.motor_asyncio.AsyncIOMotorClient = lambda uri, **_: mongomock_motor.AsyncMongoMockClient(mock_mongo_client=client)
+
+class Bench:
+    def __init__(self, client, opts: Dict[str, Any]):
+        self.c, self.opts = client, opts
+        self.rng = random.Random(opts["seed"])
+        self.users: List[Dict[str, Any]] = []
+        self.created: List[tuple] = []  # (user, uniqueID) made by the create scenarios, deleted last
+
+    async def _ok(self, r, *expect: int):
+        if r.status_code not in (expect or (200,)):
+            raise RuntimeError(f"{r.request.method} {r.request.url.path}: {r.status_code} {r.text[:200]}")
+        return r
+
+    async def _send_batch(self, h, ops):
+        limit = self.opts["batch_max"]
+        out = []
+        for lo in range(0, len(ops), limit):
+            r = await self._ok(await self.c.post("/notes/batch", json={"ops": ops[lo:lo + limit]}, headers=h))
+            bad = [x for x in r.json() if x["status"] >= 400]
+            if bad:
+                raise RuntimeError(f"seeding batch failed: {bad[:3]}")
+            out.extend(r.json())
+        return out
+
+    async def seed(self) -> None:
+        o, rng = self.opts, self.rng
+        for u in range(o["users"]):
+            email = f"bench{u}-{int(time.time())}@example.com"
+            await self._ok(await self.c.post("/auth/register", json={"email": email, "password": BENCH_PASSWORD}), 201)
+            tok = (await self._ok(await self.c.post("/auth/login", data={"username": email, "password": BENCH_PASSWORD}))).json()["access_token"]
+            h = {"Authorization": f"Bearer {tok}"}
+            media = []
+            if o["media"]:
+                files = [("files", (f"m{u}-{i}.png", _PNG + f"{email}/{i}".encode(), "image/png")) for i in range(o["media"])]
+                media = (await self._ok(await self.c.post("/media/upload", files=files, headers=h))).json()["saved"]
+            res = await self._send_batch(h, [{"op": "create", "note_title": _text(rng, 4), "note_description": _text(rng, o["words"]), "media": media} for _ in range(o["notes"])])
+            ids = [x["uniqueID"] for x in res]
+            for _ in range(o["history"]):
+                await self._send_batch(h, [{"op": "update", "uniqueID": i, "note_title": _text(rng, 4), "note_description": _text(rng, o["words"])} for i in ids])
+            self.users.append({"email": email, "h": h, "ids": ids, "rev": {i: o["history"] for i in ids}})
+        print(f"  seeded {o['users']} users x {o['notes']} notes, {o['history']} edits and {o['media']} media each", flush=True)
+
+    def pick(self):
+        u = self.rng.choice(self.users)
+        return u, self.rng.choice(u["ids"])
+
+    # scenario name -> (label, builder); a builder returns (method, url, kwargs, accepted statuses).
+    # Reads come first so that the write scenarios cannot change what they measure.
+    def scenarios(self) -> Dict[str, tuple]:
+        rng, o = self.rng, self.opts
+
+        def get(url, **kw):
+            return "GET", url, kw, (200,)
+
+        def lst():
+            u = rng.choice(self.users)
+            return get("/notes", params={"limit": PAGE}, headers=u["h"])
+
+        def lst_history():
+            u = rng.choice(self.users)
+            return get("/notes", params={"limit": 20, "include_history": "true"}, headers=u["h"])
+
+        def lst_304():
+            u = rng.choice(self.users)
+            return "GET", "/notes", {"params": {"limit": PAGE}, "headers": {**u["h"], "If-None-Match": u["list_etag"]}}, (304,)
+
+        def note():
+            u, i = self.pick()
+            return get(f"/notes/{i}", headers=u["h"])
+
+        def note_304():
+            u, i = self.pick()
+            return "GET", f"/notes/{i}", {"headers": {**u["h"], "If-None-Match": u["etags"][i]}}, (304,)
+
+        def version():
+            u, i = self.pick()
+            return get(f"/notes/{i}/versions/{rng.randint(0, u['rev'][i])}", headers=u["h"])
+
+        def diff():
+            u, i = self.pick()
+            return get(f"/notes/{i}/diff", params={"from": 0, "to": u["rev"][i], "mode": rng.choice(("unified", "words"))}, headers=u["h"])
+
+        def search():
+            u = rng.choice(self.users)
+            return get("/notes/search", params={"q": " ".join(rng.sample(WORDS, 2)), "limit": 20}, headers=u["h"])
+
+        def export():
+            u = rng.choice(self.users)
+            return get("/notes/export", headers=u["h"])
+
+        def edit():
+            u, i = self.pick()
+            return "PUT", f"/notes/{i}", {"json": {"note_title": _text(rng, 4), "note_description": _text(rng, o["words"])}, "headers": u["h"]}, (200, 409)
+
+        def create():
+            u = rng.choice(self.users)
+            return "POST", "/notes", {"json": {"note_title": _text(rng, 4), "note_description": _text(rng, o["words"])}, "headers": u["h"], "_keep": u}, (200,)
+
+        def create_media():
+            u = rng.choice(self.users)
+            data = {"note_title": _text(rng, 4), "note_description": _text(rng, o["words"])}
+            files = [("files", ("bench.png", _PNG + os.urandom(16), "image/png"))]
+            return "POST", "/notes/with-media", {"data": data, "files": files, "headers": u["h"], "_keep": u}, (200,)
+
+        def batch():
+            u = rng.choice(self.users)
+            ops = [{"op": "update", "uniqueID": i, "note_title": _text(rng, 4), "note_description": _text(rng, o["words"])} for i in rng.sample(u["ids"], min(o["batch_ops"], len(u["ids"])))]
+            return "POST", "/notes/batch", {"json": {"ops": ops}, "headers": u["h"]}, (200,)
+
+        def delete():
+            if self.created:
+                u, i = self.created.pop()
+            else:
+                u = rng.choice([x for x in self.users if x["ids"]] or self.users)
+                i = u["ids"].pop() if u["ids"] else 0
+            return "DELETE", f"/notes/{i}", {"headers": u["h"]}, (204,)
+
+        out = {
+            "list": ("GET /notes", lst), "list_history": ("GET /notes?include_history", lst_history), "list_304": ("GET /notes (If-None-Match)", lst_304),
+            "get": ("GET /notes/{id}", note), "get_304": ("GET /notes/{id} (If-None-Match)", note_304),
+            "version": ("GET /notes/{id}/versions/{rev}", version), "diff": ("GET /notes/{id}/diff", diff),
+            "search": ("GET /notes/search", search), "export": ("GET /notes/export", export),
+            "edit": ("PUT /notes/{id}", edit), "create": ("POST /notes", create), "create_media": ("POST /notes/with-media", create_media),
+            "batch": (f"POST /notes/batch ({o['batch_ops']} updates)", batch), "delete": ("DELETE /notes/{id}", delete),
+        }
+        if o["backend"] == "mongo":
+            out.pop("search")  # mongomock has no $text
+        return out
+
+    async def prepare(self) -> None:
+        # current ETags for the revalidation scenarios, taken after seeding and before any write
+        for u in self.users:
+            u["list_etag"] = (await self._ok(await self.c.get("/notes", params={"limit": PAGE}, headers=u["h"]))).headers["etag"]
+            u["etags"] = {}
+            for i in u["ids"]:
+                u["etags"][i] = (await self._ok(await self.c.get(f"/notes/{i}", headers=u["h"]))).headers["etag"]
+
+    async def run(self, build: Callable, total: int, record: bool = True) -> Optional[Dict[str, Any]]:
+        lat: List[float] = []
+        statuses: Dict[int, int] = {}
+        errors = 0
+        left = total
+
+        async def worker():
+            nonlocal left, errors
+            while left > 0:
+                left -= 1
+                method, url, kw, ok = build()
+                keep = kw.pop("_keep", None)
+                start = time.perf_counter()
+                r = await self.c.request(method, url, **kw)
+                lat.append(time.perf_counter() - start)
+                statuses[r.status_code] = statuses.get(r.status_code, 0) + 1
+                if r.status_code not in ok:
+                    errors += 1
+                elif keep is not None:
+                    self.created.append((keep, r.json()["uniqueID"]))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(self.opts["concurrency"])))
+        elapsed = time.perf_counter() - start
+        return _summary(lat, statuses, errors, elapsed) if record else None
+
+async def _drive(app, opts: Dict[str, Any]) -> Dict[str, Any]:
+    import httpx
+    results: Dict[str, Any] = {}
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app, raise_app_exceptions=False), base_url="http://bench", timeout=None) as client:
+            b = Bench(client, opts)
+            await b.seed()
+            await b.prepare()
+            scenarios = b.scenarios()
+            names = [n for n in scenarios if not opts["only"] or n in opts["only"]]
+            for name in names:
+                label, build = scenarios[name]
+                total = max(1, opts["requests"] // 10) if name == "export" else opts["requests"]
+                if opts["warmup"] and name not in ("delete", "create", "create_media"):
+                    await b.run(build, opts["warmup"], record=False)
+                res = results[name] = dict(await b.run(build, total), endpoint=label)
+                print(f"  {label:<40} {res['rps']:>9,.1f} req/s  p50 {res['p50_ms']:>8.2f}  p95 {res['p95_ms']:>8.2f}  p99 {res['p99_ms']:>8.2f} ms"
+                      + (f"  {res['errors']} errors {res['statuses']}" if res["errors"] else ""), flush=True)
+    return results
+
+def _run_backend(backend: str, db_async: bool, opts: Dict[str, Any]) -> Dict[str, Any]:
+    # runs in a fresh process: the environment has to be in place before app.py is imported
+    tmp = tempfile.mkdtemp(prefix="benchload-")
+    os.environ.update(DB_BACKEND=backend, DB_ASYNC="1" if db_async else "0", UPLOAD_DIR=os.path.join(tmp, "uploads"),
+                      SQLALCHEMY_DATABASE_URL=f"sqlite:///{tmp}/bench.db")
+    os.environ.setdefault("BCRYPT_ROUNDS", "4")  # seeding logs every user in; the login cost is not what is measured
+    os.makedirs(os.environ["UPLOAD_DIR"], exist_ok=True)
+    if backend == "mongo":
+        _mongo_stand_in()
+    import app as notes_app
+    from utils import shutdown_hash_pool
+    from utils_batch import BATCH_MAX_OPS
+    print(f"{backend} (async={notes_app.DB_ASYNC})", flush=True)
+    try:
+        return asyncio.run(_drive(notes_app.app, dict(opts, backend=backend, batch_max=BATCH_MAX_OPS)))
+    finally:
+        shutdown_hash_pool()  # otherwise its workers keep this process from exiting
+
+def _git_rev() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(old: Dict[str, Any], new: Dict[str, Any], threshold: float) -> int:
+    # a regression is throughput down, or p95 up, by more than threshold percent
+    if old["meta"]["dataset"] != new["meta"]["dataset"]:
+        print(f"warning: the baseline was run with different settings: {old['meta']['dataset']}")
+    regressions = 0
+    for run, endpoints in new["results"].items():
+        base = old["results"].get(run)
+        if not base:
+            continue
+        print(f"{run} vs baseline ({old['meta'].get('git') or '?'}, {old['meta']['created']})")
+        for name, r in endpoints.items():
+            b = base.get(name)
+            if not b:
+                continue
+            d_rps = (r["rps"] - b["rps"]) / max(b["rps"], 1e-9) * 100
+            d_p95 = (r["p95_ms"] - b["p95_ms"]) / max(b["p95_ms"], 1e-9) * 100
+            bad = d_rps < -threshold or d_p95 > threshold
+            regressions += bad
+            print(f"  {r['endpoint']:<40} req/s {b['rps']:>9,.1f} -> {r['rps']:>9,.1f} ({d_rps:+6.1f}%)  p95 {b['p95_ms']:>8.2f} -> {r['p95_ms']:>8.2f} ms ({d_p95:+6.1f}%)"
+                  + ("  REGRESSION" if bad else ""))
+    print(f"{regressions} regression(s) beyond {threshold:g}%")
+    return regressions
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="in-process load benchmark of the notes API")
+    ap.add_argument("--backends", default="sql,mongo", help="comma separated: sql, mongo")
+    ap.add_argument("--db-async", default=os.getenv("DB_ASYNC", "1"), help="1 for the async data path, 0 for the threadpool one, or both")
+    ap.add_argument("--users", type=int, default=4)
+    ap.add_argument("--notes", type=int, default=200, help="notes per user")
+    ap.add_argument("--history", type=int, default=5, help="edits per seeded note")
+    ap.add_argument("--media", type=int, default=1, help="attachments per seeded note")
+    ap.add_argument("--words", type=int, default=60, help="words per description")
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--requests", type=int, default=500, help="requests per endpoint (a tenth of that for export)")
+    ap.add_argument("--warmup", type=int, default=20, help="unrecorded requests per read endpoint")
+    ap.add_argument("--batch-ops", type=int, default=20)
+    ap.add_argument("--only", default="", help="comma separated scenario names, e.g. list,get,edit")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--save", help="write the results to this JSON file")
+    ap.add_argument("--compare", help="baseline JSON to compare against; exits 1 on a regression")
+    ap.add_argument("--threshold", type=float, default=20.0, help="percent change that counts as a regression")
+    args = ap.parse_args(argv)
+
+    dataset = {k: getattr(args, k) for k in ("users", "notes", "history", "media", "words", "concurrency", "requests", "batch_ops", "seed")}
+    opts = dict(dataset, warmup=args.warmup, only=[x for x in args.only.split(",") if x])
+    modes = {"1": [True], "0": [False], "both": [True, False]}.get(args.db_async.lower(), [True])
+    runs = [(b.strip(), a) for b in args.backends.split(",") if b.strip() for a in modes]
+
+    results: Dict[str, Any] = {}
+    for backend, db_async in runs:
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+            results[f"{backend}-{'async' if db_async else 'sync'}"] = pool.submit(_run_backend, backend, db_async, opts).result()
+
+    report = {
+        "meta": {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "git": _git_rev(), "python": platform.python_version(),
+                 "platform": platform.platform(), "cpus": os.cpu_count(), "dataset": dataset},
+        "results": results,
+    }
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"saved {args.save}")
+    if args.compare:
+        with open(args.compare) as f:
+            return 1 if compare(json.load(f), report, args.threshold) else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
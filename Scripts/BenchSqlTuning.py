@@ -0,0 +1,201 @@
+import os, time, random, shutil, argparse, tempfile, threading
+from datetime import datetime, timezone
+from typing import Callable, Dict, List
+
+# before/after for the SQL indexes and the SQLite profile. One large SQLite database is seeded
+# directly (notes of all users interleaved, as they are when written over time) without the
+# indexes that upgrade_schema() adds, then copied: "before" is that copy with SQLite's default
+# settings, "indexes" gets upgrade_schema() only (what SQLITE_PROFILE=default runs) and "after" also the
+# opt-in SQLITE_PROFILE=tuned. All are driven through the
+# repository functions, so only the database side is timed. --db keeps the seeded file between runs.
+_tmp = tempfile.mkdtemp()
+os.environ.setdefault("SQLALCHEMY_DATABASE_URL", f"sqlite:///{_tmp}/unused.db")
+
+from sqlalchemy import create_engine, insert, text
+from sqlalchemy.orm import sessionmaker
+from databases.sql_connect import Base, pool_options, apply_sqlite_profile
+from databases.sql_migrations import upgrade_schema, _ADDED_INDEXES
+from models.sql_models import User, Note, NoteHistory, NoteMedia
+from repositories import sql_notes_repositories as repo
+from utils_codec import encode
+
+WORDS = ("alpha", "bravo", "charlie", "delta", "echo", "foxtrot", "golf", "hotel", "india", "juliet",
+         "kilo", "lima", "mike", "november", "oscar", "papa", "quebec", "romeo", "sierra", "tango")
+CHUNK = 20000
+
+def _texts(rng: random.Random, n: int, words: int) -> List[str]:
+    # a pool of pre-encoded texts: seeding speed does not depend on the codec
+    return [encode(" ".join(rng.choice(WORDS) for _ in range(words))) for _ in range(n)]
+
+def seed(path: str, users: int, notes: int, history: int, media: int, words: int) -> None:
+    rng = random.Random(1)
+    titles, bodies = _texts(rng, 256, 4), _texts(rng, 256, words)
+    eng = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(eng)
+    upgrade_schema(eng)  # the schema as the app leaves it, search table included; the new indexes go next
+    now = datetime.now(timezone.utc)
+    started = time.perf_counter()
+    with eng.begin() as c:
+        for _table, name, _cols in _ADDED_INDEXES:
+            c.execute(text(f"DROP INDEX IF EXISTS {name}"))
+        c.execute(insert(User), [{"id": u + 1, "email": f"user{u}@bench.local", "hashed_password": "-", "notes_version": 0} for u in range(users)])
+        rows: Dict[str, List[dict]] = {"notes": [], "history": [], "media": []}
+
+        def flush(force: bool = False):
+            for table, model in (("notes", Note), ("history", NoteHistory), ("media", NoteMedia)):
+                if rows[table] and (force or len(rows[table]) >= CHUNK):
+                    c.execute(insert(model), rows[table])
+                    rows[table] = []
+
+        nid = 0
+        for _ in range(notes):
+            for u in range(users):
+                nid += 1
+                rows["notes"].append({"id": nid, "owner_id": u + 1, "note_title": rng.choice(titles), "note_description": rng.choice(bodies), "note_created": now, "rev": history})
+                rows["history"].extend({"note_id": nid, "rev": r, "kind": "full", "note_title": rng.choice(titles), "note_description": rng.choice(bodies), "archived_at": now} for r in range(history))
+                rows["media"].extend({"note_id": nid, "url": f"/uploads/images/{nid}-{m}.png", "mime_type": "image/png", "size_bytes": 1024, "original_name": f"{m}.png"} for m in range(media))
+                flush()
+        flush(force=True)
+    eng.dispose()
+    print(f"seeded {users * notes:,} notes, {users * notes * history:,} history rows, {users * notes * media:,} media rows in {time.perf_counter() - started:.1f}s")
+
+def _engine(path: str, indexed: bool, profile: str):
+    url = f"sqlite:///{path}"
+    eng = create_engine(url, connect_args={"check_same_thread": False}, **pool_options(url))
+    apply_sqlite_profile(eng, profile)
+    if indexed:
+        upgrade_schema(eng)
+    return eng
+
+def _stats(lat: List[float], elapsed: float, errors: int = 0) -> Dict[str, float]:
+    xs = sorted(lat) or [0.0]
+    return {"ops": len(lat) / max(elapsed, 1e-9), "p50": xs[len(xs) // 2] * 1000, "p95": xs[min(len(xs) - 1, int(len(xs) * 0.95))] * 1000, "errors": errors}
+
+def _timed(n: int, fn: Callable[[int], None]) -> Dict[str, float]:
+    lat = []
+    start = time.perf_counter()
+    for i in range(n):
+        t = time.perf_counter()
+        fn(i)
+        lat.append(time.perf_counter() - t)
+    return _stats(lat, time.perf_counter() - start)
+
+def run(eng, args, seed_: int) -> Dict[str, Dict[str, float]]:
+    Session = sessionmaker(bind=eng, autoflush=False)
+    rng = random.Random(seed_)
+    total = args.users * args.notes
+    email = lambda: f"user{rng.randrange(args.users)}@bench.local"
+    out = {}
+
+    def page(with_history: bool):
+        def op(_):
+            with Session() as db:
+                repo.get_notes_page(db, email(), limit=50, after=rng.randrange(total), with_history=with_history)
+        return op
+
+    def version(_):
+        with Session() as db:
+            n = repo.find_note(db, rng.randrange(1, total + 1))
+            if n is not None:
+                repo.get_version(db, n, rng.randrange(max(1, n.rev)))
+
+    deleted = iter(rng.sample(range(1, total + 1), args.deletes))
+
+    def delete(_):
+        with Session() as db:
+            n = repo.find_note(db, next(deleted))
+            if n is not None:
+                repo.delete_note(db, n)
+
+    for _ in range(20):
+        page(False)(0)  # warm the page cache
+    out["list page (50)"] = _timed(args.ops, page(False))
+    out["list page + history (50)"] = _timed(args.ops, page(True))
+    out["get version"] = _timed(args.ops, version)
+    out["delete note"] = _timed(args.deletes, delete)
+    out.update(_mixed(Session, args, rng, total))
+    return out
+
+def _mixed(Session, args, rng: random.Random, total: int) -> Dict[str, Dict[str, float]]:
+    # --readers threads list pages while one thread keeps editing: readers wait on the writer in
+    # rollback-journal mode, not in WAL
+    stop = threading.Event()
+    reads: List[float] = []
+    writes: List[float] = []
+    errors = {"read": 0, "write": 0}
+
+    def reader(seed_: int):
+        r = random.Random(seed_)
+        while not stop.is_set():
+            t = time.perf_counter()
+            try:
+                with Session() as db:
+                    repo.get_notes_page(db, f"user{r.randrange(args.users)}@bench.local", limit=50, after=r.randrange(total))
+                reads.append(time.perf_counter() - t)
+            except Exception:
+                errors["read"] += 1
+
+    def writer():
+        r = random.Random(7)
+        while not stop.is_set():
+            t = time.perf_counter()
+            try:
+                with Session() as db:
+                    n = repo.find_note(db, r.randrange(1, total + 1))
+                    if n is not None:
+                        repo.edit_note(db, n, "-", "edited", "edited " + " ".join(r.choice(WORDS) for _ in range(args.words)))
+                writes.append(time.perf_counter() - t)
+            except Exception:
+                errors["write"] += 1
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(args.readers)] + [threading.Thread(target=writer)]
+    start = time.perf_counter()
+    for th in threads:
+        th.start()
+    time.sleep(args.mixed_seconds)
+    stop.set()
+    for th in threads:
+        th.join()
+    elapsed = time.perf_counter() - start
+    return {f"reads during writes ({args.readers} readers)": _stats(reads, elapsed, errors["read"]),
+            "writes during reads": _stats(writes, elapsed, errors["write"])}
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--db", help="seeded database to reuse (created when missing)")
+    ap.add_argument("--users", type=int, default=50)
+    ap.add_argument("--notes", type=int, default=1000, help="notes per user")
+    ap.add_argument("--history", type=int, default=8, help="history rows per note")
+    ap.add_argument("--media", type=int, default=1, help="media rows per note")
+    ap.add_argument("--words", type=int, default=60)
+    ap.add_argument("--ops", type=int, default=300, help="operations per read workload")
+    ap.add_argument("--deletes", type=int, default=100)
+    ap.add_argument("--readers", type=int, default=4)
+    ap.add_argument("--mixed-seconds", type=float, default=5.0)
+    args = ap.parse_args()
+
+    base = args.db or os.path.join(_tmp, "seed.db")
+    if not os.path.exists(base):
+        seed(base, args.users, args.notes, args.history, args.media, args.words)
+    results = {}
+    variants = (("before", False, "default"), ("indexes", True, "default"), ("after", True, "tuned"))
+    for label, indexed, profile in variants:
+        path = os.path.join(_tmp, f"{label}.db")
+        shutil.copyfile(base, path)
+        eng = _engine(path, indexed, profile)
+        with eng.connect() as c:
+            mode = c.exec_driver_sql("PRAGMA journal_mode").scalar()
+        print(f"{label}: journal_mode={mode}, indexes={'added' if indexed else 'none'}", flush=True)
+        results[label] = run(eng, args, seed_=3)
+        eng.dispose()
+
+    labels = [v[0] for v in variants]
+    print(f"\n{'ops/s (p95 ms)':<32}" + "".join(f"{label:>22}" for label in labels) + f"{'speedup':>9}")
+    for name in results["before"]:
+        cells = "".join(f"{results[l][name]['ops']:>12,.1f} ({results[l][name]['p95']:>6.2f})" for l in labels)
+        speedup = results["after"][name]["ops"] / max(results["before"][name]["ops"], 1e-9)
+        errs = "   errors " + " / ".join(str(results[l][name]["errors"]) for l in labels) if any(results[l][name]["errors"] for l in labels) else ""
+        print(f"{name:<32}{cells}{speedup:>8.1f}x{errs}")
+
+if __name__ == "__main__":
+    main()
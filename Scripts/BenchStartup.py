@@ -0,0 +1,106 @@
+import os, sys, json, time, asyncio, argparse, platform, tempfile, statistics
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Dict, List, Optional
+
+# cold start of one app worker: every trial is a fresh spawned process that imports app.py, runs
+# the lifespan startup, then sends the first requests a new worker gets (readiness probe,
+# register, login, list) over httpx's ASGI transport, and shuts down. Variants:
+#   lazy       DB_INIT_SCHEMA=1 STARTUP_WARM=0: schema checked on startup, pools and bcrypt on first use
+#   warm       DB_INIT_SCHEMA=1 STARTUP_WARM=1: the default
+#   warm-skip  DB_INIT_SCHEMA=0 STARTUP_WARM=1: schema left to a deploy step (Scripts.InitSchema)
+# SQL runs on a SQLite file (--sql-url for another database) whose schema an untimed first trial
+# creates, so every timed trial starts against an existing schema, as a scaled-out worker does.
+# Mongo runs on mongomock unless --mongo-uri is given (see Scripts.BenchLoad).
+#   python -m Scripts.BenchStartup [--backends sql,mongo] [--trials 5] [--save startup.json]
+VARIANTS = {"lazy": ("1", "0"), "warm": ("1", "1"), "warm-skip": ("0", "1")}
+PHASES = ("import", "startup", "ready", "register", "login", "list", "shutdown")
+
+async def _first_requests(app) -> Dict[str, float]:
+    import httpx
+    out: Dict[str, float] = {}
+
+    async def timed(name, send):
+        t = time.perf_counter()
+        r = await send()
+        out[name] = (time.perf_counter() - t) * 1000
+        if r.status_code >= 300:
+            raise RuntimeError(f"{name}: {r.status_code} {r.text[:200]}")
+        return r
+
+    t = time.perf_counter()
+    async with app.router.lifespan_context(app):
+        out["startup"] = (time.perf_counter() - t) * 1000
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as c:
+            email = f"bench{os.getpid()}-{time.time_ns()}@example.com"  # the SQL file outlives the trial
+            await timed("ready", lambda: c.get("/ready"))
+            await timed("register", lambda: c.post("/auth/register", json={"email": email, "password": "bench-secret"}))
+            r = await timed("login", lambda: c.post("/auth/login", data={"username": email, "password": "bench-secret"}))
+            h = {"Authorization": f"Bearer {r.json()['access_token']}"}
+            await timed("list", lambda: c.get("/notes", headers=h))
+        t = time.perf_counter()
+    out["shutdown"] = (time.perf_counter() - t) * 1000
+    return out
+
+def _trial(backend: str, env: Dict[str, str], stand_in: bool) -> Dict[str, float]:
+    # runs in a fresh process, so the import is as cold as a new worker's
+    os.environ.update(env)
+    os.makedirs(env["UPLOAD_DIR"], exist_ok=True)
+    t = time.perf_counter()
+    import app as notes_app
+    imported = (time.perf_counter() - t) * 1000
+    if stand_in:
+        # after the import, so the stand-in's own imports are not counted; app.py no longer connects on import
+        from Scripts.BenchLoad import _mongo_stand_in
+        _mongo_stand_in()
+    from utils import shutdown_hash_pool
+    try:
+        return dict(asyncio.run(_first_requests(notes_app.app)), **{"import": imported})
+    finally:
+        shutdown_hash_pool()
+
+def _run(backend: str, env: Dict[str, str], stand_in: bool) -> Dict[str, float]:
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+        return pool.submit(_trial, backend, env, stand_in).result()
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="cold start benchmark of one app worker")
+    ap.add_argument("--backends", default="sql,mongo", help="comma separated: sql, mongo")
+    ap.add_argument("--variants", default=",".join(VARIANTS), help="comma separated: " + ", ".join(VARIANTS))
+    ap.add_argument("--trials", type=int, default=5, help="fresh processes per variant; medians are reported")
+    ap.add_argument("--sql-url", help="SQLALCHEMY_DATABASE_URL to start against (default: a throwaway SQLite file)")
+    ap.add_argument("--mongo-uri", help="a real MongoDB to start against (default: mongomock)")
+    ap.add_argument("--save", help="write the results to this JSON file")
+    args = ap.parse_args(argv)
+
+    tmp = tempfile.mkdtemp(prefix="benchstartup-")
+    base = {"UPLOAD_DIR": os.path.join(tmp, "uploads"), "BCRYPT_ROUNDS": os.getenv("BCRYPT_ROUNDS", "4"),
+            "SQLALCHEMY_DATABASE_URL": args.sql_url or f"sqlite:///{tmp}/bench.db"}
+    if args.mongo_uri:
+        base["MONGO_URI"] = args.mongo_uri
+    variants = [v for v in args.variants.split(",") if v in VARIANTS]
+    results: Dict[str, Dict[str, Dict[str, float]]] = {}
+    for backend in [b.strip() for b in args.backends.split(",") if b.strip()]:
+        stand_in = backend == "mongo" and not args.mongo_uri
+        _run(backend, dict(base, DB_BACKEND=backend), stand_in)  # creates the schema; untimed
+        print(f"{backend} (async={os.getenv('DB_ASYNC', '1')}), median of {args.trials} trials, ms")
+        print(f"  {'variant':<10}" + "".join(f"{p:>10}" for p in PHASES) + f"{'to ready':>10}")
+        for name in variants:
+            init, warm = VARIANTS[name]
+            env = dict(base, DB_BACKEND=backend, DB_INIT_SCHEMA=init, STARTUP_WARM=warm)
+            runs = [_run(backend, env, stand_in) for _ in range(args.trials)]
+            med = {p: round(statistics.median(r[p] for r in runs), 2) for p in PHASES}
+            med["to ready"] = round(statistics.median(r["import"] + r["startup"] for r in runs), 2)
+            results.setdefault(backend, {})[name] = med
+            print(f"  {name:<10}" + "".join(f"{med[p]:>10.1f}" for p in PHASES) + f"{med['to ready']:>10.1f}", flush=True)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"meta": {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+                                "platform": platform.platform(), "cpus": os.cpu_count(), "trials": args.trials},
+                       "results": results}, f, indent=2)
+        print(f"saved {args.save}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
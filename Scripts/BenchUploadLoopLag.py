@@ -0,0 +1,62 @@
+import os, io, time, asyncio, argparse, tempfile, statistics
+from starlette.datastructures import UploadFile, Headers
+from utils_media import save_uploads, ensure_dir, CHUNK_BYTES, MAX_BYTES
+
+# event-loop lag while uploads are in flight: a ticker sleeps TICK seconds in a loop and records
+# how late it wakes up; blocking file I/O on the loop shows up directly as lag
+TICK = 0.001
+
+def _files(count: int, size: int):
+    return [
+        UploadFile(io.BytesIO(os.urandom(size)), filename=f"clip{i}.mp4", headers=Headers({"content-type": "video/mp4"}))
+        for i in range(count)
+    ]
+
+async def _save_inline(base_dir: str, files):
+    # the previous save_upload: sequential, with open()/write() called on the event loop
+    for f in files:
+        sub = os.path.join(base_dir, "videos")
+        ensure_dir(sub)
+        with open(os.path.join(sub, f"inline-{id(f)}.mp4"), "wb") as out:
+            while True:
+                chunk = await f.read(CHUNK_BYTES)
+                if not chunk:
+                    break
+                out.write(chunk)
+
+async def _ticker(stop: asyncio.Event, lags: list):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        t = loop.time()
+        await asyncio.sleep(TICK)
+        lags.append((loop.time() - t - TICK) * 1000)
+
+async def _measure(fn, base_dir: str, files):
+    stop, lags = asyncio.Event(), []
+    ticker = asyncio.create_task(_ticker(stop, lags))
+    await asyncio.sleep(0.05)
+    t = time.perf_counter()
+    await fn(base_dir, files)
+    elapsed = time.perf_counter() - t
+    stop.set(); await ticker
+    lags.sort()
+    return {
+        "elapsed_ms": elapsed * 1000,
+        "lag_p50_ms": statistics.median(lags),
+        "lag_p99_ms": lags[int(len(lags) * 0.99) - 1],
+        "lag_max_ms": lags[-1],
+    }
+
+async def main(count: int, size: int):
+    with tempfile.TemporaryDirectory() as d:
+        for name, fn in (("inline", _save_inline), ("threadpool", save_uploads)):
+            r = await _measure(fn, d, _files(count, size))
+            print(f"{name:>10}: total {r['elapsed_ms']:8.1f} ms | loop lag p50 {r['lag_p50_ms']:6.2f} ms"
+                  f"  p99 {r['lag_p99_ms']:7.2f} ms  max {r['lag_max_ms']:7.2f} ms")
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--files", type=int, default=8)
+    ap.add_argument("--size", type=int, default=MAX_BYTES - 1)
+    args = ap.parse_args()
+    asyncio.run(main(args.files, args.size))
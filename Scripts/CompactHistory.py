@@ -0,0 +1,57 @@
+import os, time, argparse
+from utils_retention import HISTORY_RETENTION, HISTORY_COMPACT_BATCH, HISTORY_COMPACT_RATE, parse_retention, compact_pass
+from utils_media import remove_blob_files
+
+DB_BACKEND = os.getenv("DB_BACKEND", "mongo").lower()
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "./uploads")
+
+# one pass of history compaction over every note of the DB_BACKEND database, under the
+# HISTORY_RETENTION policy, after purging tombstones older than TOMBSTONE_RETENTION and the media
+# blobs (MEDIA_STORAGE=cas) released while an upload held them; safe to run
+# while the app is serving (cron it, or set HISTORY_COMPACT_INTERVAL to have the app run it)
+#   python -m Scripts.CompactHistory [--dry-run] [--batch-size 100] [--rate 200] [--retention "24h=all,7d=1h,*=1d"]
+
+def _steps(tiers):
+    # (compaction step, tombstone purge, blob sweep) for compact_pass
+    if DB_BACKEND == "sql":
+        from databases.sql_connect import SessionLocal, engine
+        from databases.sql_migrations import upgrade_schema
+        from repositories.sql_notes_repositories import compact_history, purge_tombstones
+        from repositories.sql_media_repository import purge_blobs, blob_in_use
+        upgrade_schema(engine)
+
+        def step(after, limit, now, dry_run):
+            with SessionLocal() as db:
+                return compact_history(db, after, limit, now, dry_run, tiers)
+
+        def purge(cutoff):
+            with SessionLocal() as db:
+                return purge_tombstones(db, cutoff)
+
+        def sweep():
+            with SessionLocal() as db:
+                return remove_blob_files(UPLOAD_DIR, purge_blobs(db), lambda digest: blob_in_use(db, digest))
+        return step, purge, sweep
+    from repositories.notes_repository import compact_history, purge_tombstones
+    from repositories.media_repository import purge_blobs, blob_in_use
+    return ((lambda after, limit, now, dry_run: compact_history(after, limit, now, dry_run, tiers)), purge_tombstones,
+            lambda: remove_blob_files(UPLOAD_DIR, purge_blobs(), blob_in_use))
+
+def main():
+    ap = argparse.ArgumentParser(description="Drop archived note revisions the retention policy no longer keeps")
+    ap.add_argument("--dry-run", action="store_true", help="report what would be reclaimed, write nothing")
+    ap.add_argument("--batch-size", type=int, default=HISTORY_COMPACT_BATCH)
+    ap.add_argument("--rate", type=float, default=HISTORY_COMPACT_RATE, help="notes per second at most (0 = unlimited)")
+    ap.add_argument("--retention", default=HISTORY_RETENTION)
+    args = ap.parse_args()
+
+    started = time.perf_counter()
+    step, purge, sweep = _steps(parse_retention(args.retention))
+    r = compact_pass(step, args.batch_size, args.rate, args.dry_run, purge=purge, sweep=sweep)
+    verb = "would reclaim" if args.dry_run else "reclaimed"
+    print(f"{DB_BACKEND}: {r['notes']} notes read, {r['compacted']} compacted, {verb} {r['revisions']} revisions "
+          f"and {r['bytes']:,} bytes of stored text, {r['conflicts']} skipped on concurrent writes, "
+          f"{r['tombstones']} expired tombstones purged, {r['blobs']} released media blobs removed, {time.perf_counter() - started:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,22 @@
+import os, time
+
+DB_BACKEND = os.getenv("DB_BACKEND", "mongo").lower()
+
+# creates the missing tables (SQL) or indexes (Mongo) of the DB_BACKEND database and brings an
+# older SQL schema up to date; idempotent. Run it once per deploy and start the app with
+# DB_INIT_SCHEMA=0, so starting workers skip the step
+#   python -m Scripts.InitSchema
+
+def main():
+    started = time.perf_counter()
+    if DB_BACKEND == "sql":
+        from databases.sql_connect import engine
+        from databases.sql_migrations import init_schema
+        init_schema(engine)
+    else:
+        from databases.mongodb_connect import ensure_indexes
+        ensure_indexes()
+    print(f"{DB_BACKEND}: schema up to date in {time.perf_counter() - started:.2f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import os
+from pymongo import MongoClient, UpdateOne, ASCENDING
+from utils_codec import decode
+from utils_history import materialize, encode_chain, number_revisions
+from repositories.history_repository import HISTORY_BUCKET_SIZE
+
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
+DB_NAME = os.getenv("DB_NAME", "notes_db")
+
+def migrate():
+    cli = MongoClient(MONGO_URI)
+    notes = cli[DB_NAME]["notes"]
+    buckets = cli[DB_NAME]["note_history"]
+    buckets.create_index([("uniqueID", ASCENDING), ("bucket_seq", ASCENDING)], unique=True)
+    count = 0
+    for doc in notes.find({"note_history": {"$exists": True}}):
+        uid = doc["uniqueID"]
+        legacy = doc.get("note_history", [])
+        rev = doc.get("rev", len(legacy))
+        if legacy:
+            bucketed = []
+            for b in buckets.find({"uniqueID": uid}).sort("bucket_seq", -1):
+                bucketed.extend(sorted(b["revisions"], key=lambda e: e["rev"], reverse=True))
+            if any("kind" not in h for h in legacy):
+                # snapshot-style entries: re-encode as deltas against the version that followed them
+                title, desc = decode(doc.get("note_title")), decode(doc.get("note_description"))
+                versions = materialize(title, desc, bucketed + legacy, rev)
+                above = versions[len(bucketed) - 1] if bucketed else {"note_title": title, "note_description": desc}
+                legacy = encode_chain(above["note_title"], above["note_description"], versions[len(bucketed):])
+            else:
+                legacy = [dict(h, rev=r) for h, r in zip(legacy, number_revisions(bucketed + legacy, rev)[len(bucketed):])]
+
+            grouped = {}
+            for h in reversed(legacy):  # oldest first inside a bucket
+                grouped.setdefault(h["rev"] // HISTORY_BUCKET_SIZE, []).append(h)
+            # $addToSet keeps a re-run after a crash from duplicating revisions
+            newest = lambda revs: {"last_rev": revs[-1]["rev"], **({"last_at": revs[-1]["archived_at"]} if revs[-1].get("archived_at") else {})}
+            buckets.bulk_write([
+                UpdateOne(
+                    {"uniqueID": uid, "bucket_seq": seq},
+                    {"$addToSet": {"revisions": {"$each": revs}},
+                     "$min": {"first_rev": revs[0]["rev"]}, "$max": newest(revs)},
+                    upsert=True,
+                )
+                for seq, revs in grouped.items()
+            ])
+        notes.update_one({"_id": doc["_id"]}, {"$set": {"rev": rev}, "$unset": {"note_history": ""}})
+        count += 1
+    print(f"Moved history of {count} documents into bucketed note_history.")
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,29 @@
+from databases.sql_connect import SessionLocal, engine
+from databases.sql_migrations import upgrade_schema
+from models.sql_models import Note, NoteHistory
+from utils_codec import decode
+from utils_history import materialize, encode_chain
+
+def migrate():
+    upgrade_schema(engine)  # adds notes.rev / note_history.rev / note_history.kind if missing
+    with SessionLocal() as db:
+        note_ids = [nid for (nid,) in db.query(NoteHistory.note_id).filter(NoteHistory.rev.is_(None)).distinct()]
+        changed = 0
+        for nid in note_ids:
+            n = db.get(Note, nid)
+            rows = db.query(NoteHistory).filter(NoteHistory.note_id == nid).order_by(NoteHistory.id.desc()).all()
+            title, desc = decode(n.note_title), decode(n.note_description)
+            entries = [{"rev": h.rev, "kind": h.kind, "note_title": h.note_title, "note_description": h.note_description,
+                        "archived_at": h.archived_at} for h in rows]
+            versions = materialize(title, desc, entries, n.rev)
+            for h, e in zip(rows, encode_chain(title, desc, versions)):
+                h.rev, h.kind = e["rev"], e["kind"]
+                h.note_title, h.note_description = e["note_title"], e["note_description"]
+            changed += 1
+            if changed % 500 == 0:
+                db.commit()
+        db.commit()
+    print(f"Migrated history of {changed} notes to delta encoding.")
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,70 @@
+import os
+from pymongo import MongoClient, UpdateOne
+from utils_codec import recode
+from Scripts.migration import Migration, run
+
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
+DB_NAME = os.getenv("DB_NAME", "notes_db")
+
+# brings note text (and any history still embedded in the note) into the tagged codec format:
+# legacy Base64 is re-encoded, never-encoded raw text is encoded, values that decode as tagged are
+# left alone. Run it before deploying the tagged codec, with --legacy: raw text that happens to
+# start with "p:" is then kept whole.
+#   python -m Scripts.MigrateTextCodec_mongo [--legacy] [--workers 4] [--batch-size 1000] [--dry-run] [--restart]
+
+_FIELDS = ("note_title", "note_description")
+
+class NotesTextCodec(Migration):
+    name = "notes_text_codec_mongo"
+
+    def __init__(self, legacy: bool = False):
+        self.legacy = legacy
+
+    @classmethod
+    def add_arguments(cls, ap):
+        ap.add_argument("--legacy", action="store_true",
+                        help="first run before the tagged codec is deployed: values that look tagged are raw text too "
+                             "(never on a database the codec has written to: it would tag plain values twice)")
+
+    def open(self):
+        self.client = MongoClient(MONGO_URI)
+        self.notes = self.client[DB_NAME]["notes"]
+
+    def close(self):
+        self.client.close()
+
+    def key_bounds(self):
+        lo = self.notes.find_one({}, sort=[("uniqueID", 1)], projection={"uniqueID": 1})
+        hi = self.notes.find_one({}, sort=[("uniqueID", -1)], projection={"uniqueID": 1})
+        return (lo["uniqueID"], hi["uniqueID"]) if lo else None
+
+    def fetch(self, after, upto, limit):
+        cur = self.notes.find({"uniqueID": {"$gt": after, "$lte": upto}}, projection={"uniqueID": 1, "note_history": 1, **{f: 1 for f in _FIELDS}})
+        return list(cur.sort("uniqueID", 1).limit(limit))
+
+    def key(self, doc):
+        return doc["uniqueID"]
+
+    def transform(self, doc):
+        changes = {}
+        for f in _FIELDS:
+            v = recode(doc.get(f), self.legacy)
+            if v is not None:
+                changes[f] = v
+        history, hist_changed = [], False
+        for h in doc.get("note_history", []):
+            h = dict(h)
+            for f in _FIELDS:
+                v = recode(h.get(f), self.legacy)
+                if v is not None:
+                    h[f] = v; hist_changed = True
+            history.append(h)
+        if hist_changed:
+            changes["note_history"] = history
+        return UpdateOne({"_id": doc["_id"]}, {"$set": changes}) if changes else None
+
+    def write(self, changes):
+        self.notes.bulk_write(changes, ordered=False)
+
+if __name__ == "__main__":
+    run(NotesTextCodec)
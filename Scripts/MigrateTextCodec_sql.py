@@ -0,0 +1,74 @@
+from sqlalchemy import func, update
+from databases.sql_connect import SessionLocal, engine
+from models.sql_models import Note, NoteHistory
+from utils_codec import recode
+from Scripts.migration import Migration, run
+
+# brings note text and history rows into the tagged codec format: legacy Base64 is re-encoded,
+# never-encoded raw text is encoded, values that decode as tagged are left alone. Run it before
+# deploying the tagged codec, with --legacy: raw text that happens to start with "p:" is then kept whole.
+#   python -m Scripts.MigrateTextCodec_sql [--legacy] [--workers 4] [--batch-size 1000] [--dry-run] [--restart]
+# (the flags apply to both tables, which are migrated one after the other)
+
+class _TextCodec(Migration):
+    model = Note
+
+    def __init__(self, legacy: bool = False):
+        self.legacy = legacy
+
+    @classmethod
+    def add_arguments(cls, ap):
+        ap.add_argument("--legacy", action="store_true",
+                        help="first run before the tagged codec is deployed: values that look tagged are raw text too "
+                             "(never on a database the codec has written to: it would tag plain values twice)")
+
+    def open(self):
+        engine.dispose(close=False)  # a forked worker must not reuse the parent's pooled connections
+        self.db = SessionLocal()
+
+    def close(self):
+        self.db.close()
+
+    def key_bounds(self):
+        lo, hi = self.db.query(func.min(self.model.id), func.max(self.model.id)).one()
+        return (lo, hi) if lo is not None else None
+
+    def fetch(self, after, upto, limit):
+        m = self.model
+        q = self.db.query(m.id, m.note_title, m.note_description).filter(m.id > after, m.id <= upto)
+        return q.order_by(m.id).limit(limit).all()
+
+    def key(self, row):
+        return row.id
+
+    def transform(self, row):
+        title, description = recode(row.note_title, self.legacy), recode(row.note_description, self.legacy)
+        if title is None and description is None:
+            return None
+        change = {"id": row.id}
+        if title is not None:
+            change["note_title"] = title
+        if description is not None:
+            change["note_description"] = description
+        return change
+
+    def write(self, changes):
+        # ORM bulk UPDATE by primary key, grouped by the set of columns each row changes
+        groups = {}
+        for c in changes:
+            groups.setdefault(tuple(sorted(c)), []).append(c)
+        for rows in groups.values():
+            self.db.execute(update(self.model), rows)
+        self.db.commit()
+
+class NotesTextCodec(_TextCodec):
+    name = "notes_text_codec_sql"
+    model = Note
+
+class HistoryTextCodec(_TextCodec):
+    name = "note_history_text_codec_sql"
+    model = NoteHistory
+
+if __name__ == "__main__":
+    run(NotesTextCodec)
+    run(HistoryTextCodec)
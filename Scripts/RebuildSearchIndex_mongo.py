@@ -0,0 +1,49 @@
+import os
+from pymongo import MongoClient, ReplaceOne
+from databases.mongodb_connect import ensure_indexes
+from repositories.search_repository import _index_doc
+from utils_codec import decode_many
+from Scripts.migration import Migration, run
+
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
+DB_NAME = os.getenv("DB_NAME", "notes_db")
+
+# refills the note_search side collection from notes; search returns partial results until it finishes
+#   python -m Scripts.RebuildSearchIndex_mongo [--workers 4] [--batch-size 1000] [--dry-run] [--restart]
+
+class NotesSearchIndex(Migration):
+    name = "notes_search_index_mongo"
+
+    def open(self):
+        self.client = MongoClient(MONGO_URI)
+        self.notes = self.client[DB_NAME]["notes"]
+        self.index = self.client[DB_NAME]["note_search"]
+
+    def close(self):
+        self.client.close()
+
+    def prepare(self):
+        self.index.delete_many({})
+
+    def key_bounds(self):
+        lo = self.notes.find_one({}, sort=[("uniqueID", 1)], projection={"uniqueID": 1})
+        hi = self.notes.find_one({}, sort=[("uniqueID", -1)], projection={"uniqueID": 1})
+        return (lo["uniqueID"], hi["uniqueID"]) if lo else None
+
+    def fetch(self, after, upto, limit):
+        cur = self.notes.find({"uniqueID": {"$gt": after, "$lte": upto}}, projection={"uniqueID": 1, "owner_key": 1, "note_title": 1, "note_description": 1})
+        return list(cur.sort("uniqueID", 1).limit(limit))
+
+    def key(self, doc):
+        return doc["uniqueID"]
+
+    def transform(self, doc):
+        title, description = decode_many([doc.get("note_title"), doc.get("note_description")])
+        return ReplaceOne({"_id": doc["uniqueID"]}, _index_doc(doc["uniqueID"], doc.get("owner_key"), title, description), upsert=True)
+
+    def write(self, changes):
+        self.index.bulk_write(changes, ordered=False)
+
+if __name__ == "__main__":
+    ensure_indexes()  # creates the text index if it is missing
+    run(NotesSearchIndex)
@@ -0,0 +1,50 @@
+from sqlalchemy import func, text
+from databases.sql_connect import SessionLocal, engine
+from databases.sql_migrations import upgrade_schema
+from models.sql_models import Note
+from repositories.sql_search_repository import search_supported
+from utils_codec import decode_many
+from Scripts.migration import Migration, run
+
+# refills notes_fts (SQLite FTS5) from the notes table; search returns partial results until it finishes
+#   python -m Scripts.RebuildSearchIndex_sql [--batch-size 1000] [--dry-run] [--restart]
+
+class NotesSearchIndex(Migration):
+    name = "notes_search_index_sql"
+
+    def open(self):
+        engine.dispose(close=False)
+        self.db = SessionLocal()
+
+    def close(self):
+        self.db.close()
+
+    def prepare(self):
+        self.db.execute(text("DELETE FROM notes_fts"))
+        self.db.commit()
+
+    def key_bounds(self):
+        lo, hi = self.db.query(func.min(Note.id), func.max(Note.id)).one()
+        return (lo, hi) if lo is not None else None
+
+    def fetch(self, after, upto, limit):
+        q = self.db.query(Note.id, Note.owner_id, Note.note_title, Note.note_description).filter(Note.id > after, Note.id <= upto)
+        return q.order_by(Note.id).limit(limit).all()
+
+    def key(self, row):
+        return row.id
+
+    def transform(self, row):
+        title, description = decode_many([row.note_title, row.note_description])
+        return {"id": row.id, "t": title, "d": description, "o": row.owner_id}
+
+    def write(self, changes):
+        self.db.execute(text("INSERT OR REPLACE INTO notes_fts(rowid, note_title, note_description, owner_id) VALUES (:id, :t, :d, :o)"), changes)
+        self.db.commit()
+
+if __name__ == "__main__":
+    upgrade_schema(engine)
+    with SessionLocal() as db:
+        if not search_supported(db):
+            raise SystemExit("Search index needs SQLite (FTS5).")
+    run(NotesSearchIndex)
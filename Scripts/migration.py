@@ -0,0 +1,163 @@
+import os, json, time, argparse
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+# shared runner for the Migrate* scripts. Rows are read in keyset batches over an integer key
+# (WHERE key > last ORDER BY key LIMIT n) and each batch is written with one bulk write / commit,
+# after which the batch's last key is checkpointed. The key range is split between worker
+# processes up front; an interrupted run picks up every range where its checkpoint left off.
+
+MIGRATION_STATE_DIR = os.getenv("MIGRATION_STATE_DIR", "./.migrations")
+MIGRATION_WORKERS = int(os.getenv("MIGRATION_WORKERS", "1"))
+PROGRESS_EVERY = 5.0  # seconds between progress lines per worker
+
+class Migration:
+    # subclasses set name and implement the hooks; open() runs inside the worker process, so
+    # connections are made there and never shared across a fork
+    name = "migration"
+    batch_size = 1000
+
+    @classmethod
+    def add_arguments(cls, ap: argparse.ArgumentParser) -> None:
+        # extra flags; their values are passed to the constructor as keyword arguments
+        pass
+
+    def open(self) -> None:
+        pass
+
+    def prepare(self) -> None:
+        # runs once when a run starts from scratch (not on resume, not on a dry run)
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def key_bounds(self) -> Optional[Tuple[int, int]]:
+        raise NotImplementedError
+
+    def fetch(self, after: int, upto: int, limit: int) -> List[Any]:
+        # rows with after < key <= upto, ordered by key
+        raise NotImplementedError
+
+    def key(self, row: Any) -> int:
+        raise NotImplementedError
+
+    def transform(self, row: Any) -> Optional[Any]:
+        # the change to write for this row, or None when it needs none
+        raise NotImplementedError
+
+    def write(self, changes: List[Any]) -> None:
+        raise NotImplementedError
+
+def _state_path(name: str, part: str) -> str:
+    return os.path.join(MIGRATION_STATE_DIR, f"{name}.{part}.json")
+
+def _load(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def _save(path: str, data: Dict[str, Any]) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+def _discard(name: str, workers: int) -> None:
+    for part in ["plan"] + [f"w{i}" for i in range(workers)]:
+        try: os.remove(_state_path(name, part))
+        except FileNotFoundError: pass
+
+def _split(lo: int, hi: int, parts: int) -> List[List[int]]:
+    step = max(1, -(-(hi - lo + 1) // max(1, parts)))
+    return [[start, min(hi, start + step - 1)] for start in range(lo, hi + 1, step)]
+
+def _run_range(cls, opts: Dict[str, Any], index: int, lo: int, hi: int, batch_size: int, dry_run: bool) -> Dict[str, Any]:
+    m = cls(**opts)
+    ckpt = _state_path(m.name, f"w{index}")
+    state = _load(ckpt) or {"last": lo - 1, "seen": 0, "changed": 0}
+    started = reported = time.perf_counter()
+    seen_at_start = state["seen"]
+    m.open()
+    try:
+        while state["last"] < hi:
+            rows = m.fetch(state["last"], hi, batch_size)
+            if not rows:
+                state["last"] = hi
+                break
+            changes = [c for c in map(m.transform, rows) if c is not None]
+            if changes and not dry_run:
+                m.write(changes)
+            state["last"] = m.key(rows[-1])
+            state["seen"] += len(rows)
+            state["changed"] += len(changes)
+            if not dry_run:
+                _save(ckpt, state)
+            now = time.perf_counter()
+            if now - reported >= PROGRESS_EVERY:
+                reported = now
+                done = (state["last"] - lo + 1) / (hi - lo + 1)
+                rate = (state["seen"] - seen_at_start) / (now - started)
+                print(f"[{m.name} w{index}] {done:6.1%} of keys {lo}..{hi}, {state['seen']} rows, {state['changed']} changed, {rate:,.0f} rows/s", flush=True)
+        if not dry_run:
+            _save(ckpt, state)
+    finally:
+        m.close()
+    return dict(state, read_now=state["seen"] - seen_at_start)
+
+def run(cls, argv: Optional[List[str]] = None, **opts) -> Dict[str, int]:
+    ap = argparse.ArgumentParser(description=f"{cls.name} migration")
+    ap.add_argument("--workers", type=int, default=MIGRATION_WORKERS, help="worker processes (fixed by the checkpoint on resume)")
+    ap.add_argument("--batch-size", type=int, default=cls.batch_size)
+    ap.add_argument("--dry-run", action="store_true", help="read and transform everything, write nothing")
+    ap.add_argument("--restart", action="store_true", help="ignore any checkpoint from an interrupted run")
+    shared = {a.dest for a in ap._actions}
+    cls.add_arguments(ap)
+    args = ap.parse_args(argv)
+    opts.update({k: v for k, v in vars(args).items() if k not in shared})
+
+    name = cls.name
+    plan_path = _state_path(name, "plan")
+    plan = _load(plan_path)
+    if plan is not None and args.restart:
+        _discard(name, len(plan["ranges"]))
+        plan = None
+    if plan is None:
+        m = cls(**opts)
+        m.open()
+        try:
+            if not args.dry_run:
+                m.prepare()
+            bounds = m.key_bounds()
+        finally:
+            m.close()
+        if bounds is None:
+            print(f"{name}: nothing to migrate.")
+            return {"seen": 0, "changed": 0}
+        plan = {"ranges": _split(bounds[0], bounds[1], args.workers)}
+        if not args.dry_run:
+            _save(plan_path, plan)
+    else:
+        print(f"{name}: resuming from checkpoint in {MIGRATION_STATE_DIR}")
+
+    ranges = plan["ranges"]
+    started = time.perf_counter()
+    jobs = [(cls, opts, i, lo, hi, args.batch_size, args.dry_run) for i, (lo, hi) in enumerate(ranges)]
+    if len(jobs) == 1:
+        states = [_run_range(*jobs[0])]
+    else:
+        with ProcessPoolExecutor(max_workers=len(jobs)) as pool:
+            states = list(pool.map(_run_range, *zip(*jobs)))
+    elapsed = time.perf_counter() - started
+
+    seen = sum(s["seen"] for s in states)
+    changed = sum(s["changed"] for s in states)
+    verb = "would change" if args.dry_run else "changed"
+    rate = sum(s["read_now"] for s in states) / max(elapsed, 1e-9)
+    print(f"{name}: {seen} rows read, {changed} {verb}, {elapsed:.1f}s ({rate:,.0f} rows/s)")
+    if not args.dry_run:
+        _discard(name, len(ranges))  # finished: the next run starts from scratch
+    return {"seen": seen, "changed": changed}
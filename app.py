@@ -1,62 +1,343 @@
-import os
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form
+import os, time, zlib, asyncio, inspect, logging
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form, Query, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
 from fastapi.security import OAuth2PasswordRequestForm
-from fastapi.staticfiles import StaticFiles
-from typing import List, Dict, Any
+from starlette.concurrency import run_in_threadpool, iterate_in_threadpool
+from pydantic import ValidationError
+from typing import List, Dict, Any, Optional
 from datetime import datetime, timezone
 
-from auth import JWT_SECRET, JWT_ALGO, ACCESS_TOKEN_EXPIRE_MINUTES, Token, get_current_email
-from utils import hash_password, verify_password, create_access_token
-from utils_b64 import b64e, b64d
-from utils_media import save_upload, MAX_BYTES, ALLOWED_MIME
+from auth import Token, get_current_email, issue_access_token, token_cache_stats
+from utils_codec import CodecError
+from utils import hash_password_async, verify_and_update_async, HashPoolBusy, warm_hash_pool, shutdown_hash_pool
+from utils_media import save_uploads, remove_blobs, remove_blob_files, MediaFiles, MAX_BYTES, ALLOWED_MIME
+from utils_pagination import encode_cursor, decode_cursor, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from utils_versions import note_key, diff_versions, version_cache_stats
+from utils_batch import BATCH_MAX_OPS
+from utils_export import ndjson_stream, read_ndjson, IMPORT_BATCH, IMPORT_MAX_ERRORS
+from utils_etag import note_etag, list_etag, none_match, if_match
+from utils_metrics import MetricsMiddleware, METRICS_ENABLED, phase, render_metrics
+from utils_retention import HISTORY_COMPACT_INTERVAL, start_compactor
+from repositories.user_cache import user_cache_stats
 
 from models.auth_models import RegisterIn, UserOut
-from models.notes import NoteCreate, NoteUpdate, NoteOut
+from models.notes import NoteCreate, NoteUpdate, NoteOut, NoteVersion, NoteDiff, NoteBatch, NoteBatchResult, NoteImport, NoteImportResult
 
 DB_BACKEND = os.getenv("DB_BACKEND", "mongo").lower()
 UPLOAD_DIR = os.getenv("UPLOAD_DIR", "./uploads")
+# DB_ASYNC=0 keeps the blocking drivers (run in the threadpool) for A/B comparison with Motor / AsyncSession
+DB_ASYNC = os.getenv("DB_ASYNC", "1").lower() in ("1", "true", "yes")
+# create missing tables / indexes on startup (idempotent). Set 0 when a deploy step runs
+# `python -m Scripts.InitSchema` once, so a fleet of starting workers doesn't all do it
+DB_INIT_SCHEMA = os.getenv("DB_INIT_SCHEMA", "1").lower() in ("1", "true", "yes")
+# open the database pool and start the bcrypt workers before serving, not on the first requests
+STARTUP_WARM = os.getenv("STARTUP_WARM", "1").lower() in ("1", "true", "yes")
+READY_TIMEOUT = float(os.getenv("READY_TIMEOUT", "2"))  # seconds GET /ready waits for the database
+log = logging.getLogger("notes.api")
 
-app = FastAPI(title=f"FastAPI Notes Secure ({DB_BACKEND.upper()})", version="1.2.0")
-app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # nothing touches the database at import time; init_schema, warm_db, ping_db, close_db,
+    # compact_step, purge_step and sweep_step are defined by the backend section below
+    started = time.perf_counter()
+    if STARTUP_WARM:
+        await warm_hash_pool()  # first, so the workers have started before the first login
+    if DB_INIT_SCHEMA:
+        await run_in_threadpool(init_schema)
+    if STARTUP_WARM:
+        await warm_db()
+    stop = start_compactor(compact_step, purge_step, sweep_step) if HISTORY_COMPACT_INTERVAL > 0 else None
+    app.state.startup_seconds = time.perf_counter() - started
+    app.state.ready = True
+    try:
+        yield
+    finally:
+        app.state.ready = False
+        if stop is not None:
+            stop.set()
+        shutdown_hash_pool()
+        await close_db()
+
+app = FastAPI(title=f"FastAPI Notes Secure ({DB_BACKEND.upper()})", version="1.2.0", lifespan=lifespan)
+app.mount("/uploads", MediaFiles(directory=UPLOAD_DIR), name="uploads")
+app.add_middleware(MetricsMiddleware)
+
+@app.exception_handler(HashPoolBusy)
+async def hash_pool_busy(request: Request, exc: HashPoolBusy):
+    return JSONResponse(status_code=503, content={"detail": "Too many concurrent logins, retry shortly"}, headers={"Retry-After": "1"})
+
+@app.exception_handler(CodecError)
+async def undecodable_note(request: Request, exc: CodecError):
+    # stored text from before Scripts.MigrateTextCodec_* ran, or corrupt; a stream that already
+    # started (GET /notes/export) cannot turn into this response and is cut off instead
+    log.error("%s %s: %s", request.method, request.url.path, exc)
+    return JSONResponse(status_code=500, content={"detail": "Stored note text cannot be decoded", "note_id": exc.note_id})
+
+if METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        # counters are per process: with several workers, scrape each one
+        caches = {"token": token_cache_stats(), "user": user_cache_stats(), **version_cache_stats()}
+        return PlainTextResponse(render_metrics(caches), media_type="text/plain; version=0.0.4")
+
+@app.get("/ready", include_in_schema=False)
+async def ready():
+    # readiness probe: 503 until startup has finished (and again once shutdown starts) or while the database is unreachable
+    if not getattr(app.state, "ready", False):
+        return JSONResponse(status_code=503, content={"status": "starting"})
+    try:
+        await asyncio.wait_for(ping_db(), READY_TIMEOUT)
+    except Exception:
+        return JSONResponse(status_code=503, content={"status": "database unreachable"})
+    return {"status": "ready", "startup_seconds": round(app.state.startup_seconds, 3)}
+
+def page_params(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = Query(None, description="cursor from X-Next-Cursor"),
+    before: Optional[str] = Query(None, description="cursor from X-Prev-Cursor"),
+) -> Dict[str, Optional[int]]:
+    try:
+        after_id, before_id = decode_cursor(after), decode_cursor(before)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return {"limit": limit, "after": after_id, "before": before_id}
+
+def as_of_param(as_of: Optional[datetime] = Query(None, description="ISO 8601 time; list the notes as they were then (no history)")) -> Optional[datetime]:
+    # a time without an offset is taken as UTC
+    if as_of is not None and as_of.tzinfo is None:
+        as_of = as_of.replace(tzinfo=timezone.utc)
+    return as_of
+
+def set_page_headers(response: Response, page: Dict[str, Any]) -> None:
+    if page["next_id"] is not None:
+        response.headers["X-Next-Cursor"] = encode_cursor(page["next_id"])
+    if page["prev_id"] is not None:
+        response.headers["X-Prev-Cursor"] = encode_cursor(page["prev_id"])
+
+def diff_params(
+    from_rev: int = Query(..., alias="from", ge=0),
+    to_rev: int = Query(..., alias="to", ge=0),
+    mode: str = Query("unified", pattern="^(unified|words)$"),
+) -> Dict[str, Any]:
+    return {"from_rev": from_rev, "to_rev": to_rev, "mode": mode}
+
+def search_params(
+    q: str = Query(..., min_length=1, max_length=256),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+) -> Dict[str, Any]:
+    return {"q": q, "limit": limit, "offset": offset}
+
+def set_search_headers(response: Response, res: Dict[str, Any]) -> None:
+    if res["next_offset"] is not None:
+        response.headers["X-Next-Offset"] = str(res["next_offset"])
+
+def note_tag(note: Dict[str, Any]) -> str:
+    return note_etag(note["uniqueID"], note.get("rev"), note.get("note_created"))
+
+# per-user responses: the same URL answers differently for each bearer token
+PRIVATE_HEADERS = {"Cache-Control": "private, no-cache", "Vary": "Authorization"}
+
+def set_private(response: Response) -> None:
+    # private: per-user data; no-cache: reuse only after revalidating with If-None-Match
+    response.headers.update(PRIVATE_HEADERS)
+
+def set_etag(response: Response, etag: str) -> None:
+    response.headers["ETag"] = etag
+    set_private(response)
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    if none_match(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag, **PRIVATE_HEADERS})
+    return None
+
+def check_if_match(request: Request, etag: str) -> None:
+    if not if_match(request.headers.get("if-match"), etag):
+        raise HTTPException(status_code=412, detail="Note has changed since it was read")
+
+def edit_conflict(request: Request) -> HTTPException:
+    # the rev compare-and-set lost to a concurrent edit; with If-Match that is a failed precondition
+    if request.headers.get("if-match") is not None:
+        return HTTPException(status_code=412, detail="Note has changed since it was read")
+    return HTTPException(status_code=409, detail="Note was modified concurrently, retry")
+
+def batch_ops(payload: NoteBatch) -> List[Dict[str, Any]]:
+    if len(payload.ops) > BATCH_MAX_OPS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_OPS} operations per batch")
+    return [op.model_dump() for op in payload.ops]
+
+def notes_out(items: List[Dict[str, Any]]) -> List[NoteOut]:
+    with phase("model"):
+        return [NoteOut(**r) for r in items]
+
+async def run_db(fn, *args, **kwargs):
+    # await async repositories directly; blocking ones go to the threadpool instead of the event loop
+    with phase(f"db.{fn.__name__}"):
+        if inspect.iscoroutinefunction(fn):
+            return await fn(*args, **kwargs)
+        return await run_in_threadpool(fn, *args, **kwargs)
+
+def db_chunks(fn, *args):
+    # same split for streamed reads: async generators run on the loop, blocking ones step in the threadpool
+    return fn(*args) if inspect.isasyncgenfunction(fn) else iterate_in_threadpool(fn(*args))
+
+def export_response(chunks, gzip: bool) -> StreamingResponse:
+    headers = {"Content-Disposition": 'attachment; filename="notes-export.ndjson"'}
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(ndjson_stream(chunks, gzip), media_type="application/x-ndjson", headers=headers)
+
+def _line_error(e: ValidationError) -> str:
+    return "; ".join(": ".join(filter(None, (".".join(map(str, err["loc"])), err["msg"]))) for err in e.errors()[:3])
+
+async def import_stream(request: Request, write) -> NoteImportResult:
+    # write(items) stores one batch and returns how many notes it added
+    gzip = request.headers.get("content-encoding", "").lower() == "gzip"
+    res = NoteImportResult(imported=0, failed=0)
+    batch: List[Dict[str, Any]] = []
+    try:
+        async for line_no, line in read_ndjson(request.stream(), gzip):
+            try:
+                batch.append(NoteImport.model_validate_json(line).model_dump())
+            except ValidationError as e:
+                res.failed += 1
+                if len(res.errors) < IMPORT_MAX_ERRORS:
+                    res.errors.append({"line": line_no, "error": _line_error(e)})
+                continue
+            if len(batch) >= IMPORT_BATCH:
+                res.imported += await write(batch)
+                batch = []
+        if batch:
+            res.imported += await write(batch)
+    except (ValueError, zlib.error) as e:
+        # batches written so far stay imported
+        raise HTTPException(status_code=400, detail=f"Unreadable import body after {res.imported} notes: {e}")
+    return res
 
 # ------------------ SQL BRANCH ------------------
 if DB_BACKEND == "sql":
-    from databases.sql_connect import SessionLocal, engine, Base
-    from models.sql_models import User, Note, NoteHistory, NoteMedia as SQLNoteMedia
-    from repositories.sql_users_repository import find_user_by_email as sql_find_user, create_user as sql_create_user
-    from repositories.sql_notes_repository import add_note as sql_add, get_all_notes as sql_all
+    from sqlalchemy import text
+    from databases.sql_connect import SessionLocal, AsyncSessionLocal, engine, get_async_engine, warm_pool, warm_async_pool
+    from databases.sql_migrations import init_schema as sql_init_schema
+    from repositories.sql_media_repository import hold_blob as sql_hold_blob, blob_in_use as sql_blob_in_use, purge_blobs as sql_purge_blobs
+    from repositories.sql_users_repository import find_user_by_email as sql_find_user, find_user_identity as sql_find_identity, create_user as sql_create_user, update_password_hash as sql_update_hash, get_notes_version as sql_notes_version
+    from repositories.sql_notes_repositories import add_note as sql_add, edit_note as sql_edit, find_note as sql_find_note, get_note as sql_get_note, delete_note as sql_delete, get_notes_page as sql_page, search_notes as sql_search, get_version as sql_version, apply_batch as sql_batch, export_query as sql_export_query, export_chunk as sql_export_chunk, iter_export as sql_iter_export, import_notes as sql_import, compact_history as sql_compact, get_notes_as_of as sql_as_of, purge_tombstones as sql_purge
+
+    def init_schema():
+        sql_init_schema(engine)
+
+    def compact_step(after, limit, now, dry_run):
+        # the background compactor runs on a thread of its own with the blocking session
+        with SessionLocal() as db:
+            return sql_compact(db, after, limit, now, dry_run)
+
+    def purge_step(cutoff):
+        with SessionLocal() as db:
+            return sql_purge(db, cutoff)
+
+    def sweep_step():
+        with SessionLocal() as db:
+            return remove_blob_files(UPLOAD_DIR, sql_purge_blobs(db), lambda digest: sql_blob_in_use(db, digest))
+
+    if DB_ASYNC:
+        async def warm_db():
+            await warm_async_pool()
+
+        async def ping_db():
+            async with get_async_engine().connect() as conn:
+                await conn.execute(text("SELECT 1"))
+
+        async def close_db():
+            await get_async_engine().dispose()
+            engine.dispose()  # the compactor's connections
+
+        async def get_sql_db():
+            async with AsyncSessionLocal() as db:
+                yield db
 
-    Base.metadata.create_all(bind=engine)
+        async def run_sql(db, fn, *args, **kwargs):
+            # repository functions are written against Session; run_sync drives them over the async driver
+            with phase(f"db.{fn.__name__}"):
+                return await db.run_sync(lambda session: fn(session, *args, **kwargs))
 
-    def get_sql_db():
-        db = SessionLocal()
-        try:
-            yield db
-        finally:
-            db.close()
+        async def in_session(fn, *args):
+            # a session of its own, for calls that run concurrently within one request (uploads)
+            async with AsyncSessionLocal() as db:
+                return await run_sql(db, fn, *args)
+
+        async def sql_export(owner_id: int, owner_email: str):
+            # a session of its own: the stream outlives the request's dependencies
+            async with AsyncSessionLocal() as db:
+                result = await db.stream(sql_export_query(owner_id))
+                async for notes in result.scalars().partitions():
+                    yield await run_sql(db, sql_export_chunk, notes, owner_email)
+    else:
+        async def warm_db():
+            await run_in_threadpool(warm_pool, engine)
+
+        def _ping():
+            with engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+
+        async def ping_db():
+            await run_in_threadpool(_ping)
+
+        async def close_db():
+            engine.dispose()
+
+        def get_sql_db():
+            db = SessionLocal()
+            try:
+                yield db
+            finally:
+                db.close()
+
+        async def run_sql(db, fn, *args, **kwargs):
+            with phase(f"db.{fn.__name__}"):
+                return await run_in_threadpool(fn, db, *args, **kwargs)
+
+        def sql_export(owner_id: int, owner_email: str):
+            with SessionLocal() as db:
+                yield from sql_iter_export(db, owner_id, owner_email)
+
+        async def in_session(fn, *args):
+            def call():
+                with SessionLocal() as db:
+                    return fn(db, *args)
+            with phase(f"db.{fn.__name__}"):
+                return await run_in_threadpool(call)
+
+    async def hold_blob(digest: str, url: str) -> None:
+        await in_session(sql_hold_blob, digest, url)
+
+    async def blob_in_use(digest: str) -> bool:
+        return await in_session(sql_blob_in_use, digest)
 
     @app.post("/auth/register", response_model=UserOut, status_code=201)
-    def register(payload: RegisterIn, db=Depends(get_sql_db)):
-        if sql_find_user(db, payload.email):
+    async def register(payload: RegisterIn, db=Depends(get_sql_db)):
+        if await run_sql(db, sql_find_user, payload.email):
             raise HTTPException(status_code=409, detail="Email already registered")
-        u = sql_create_user(db, payload.email, hash_password(payload.password))
+        u = await run_sql(db, sql_create_user, payload.email, await hash_password_async(payload.password))
         return UserOut(id=u.id, email=u.email)
 
     @app.post("/auth/login", response_model=Token)
-    def login(form: OAuth2PasswordRequestForm = Depends(), db=Depends(get_sql_db)):
-        u = sql_find_user(db, form.username)
-        if not u or not verify_password(form.password, u.hashed_password):
+    async def login(form: OAuth2PasswordRequestForm = Depends(), db=Depends(get_sql_db)):
+        u = await run_sql(db, sql_find_user, form.username)
+        if not u:
             raise HTTPException(status_code=401, detail="Invalid credentials")
-        token = create_access_token({"sub": u.email}, JWT_SECRET, JWT_ALGO, ACCESS_TOKEN_EXPIRE_MINUTES)
-        return Token(access_token=token)
+        ok, new_hash = await verify_and_update_async(form.password, u.hashed_password)
+        if not ok:
+            raise HTTPException(status_code=401, detail="Invalid credentials")
+        if new_hash:
+            await run_sql(db, sql_update_hash, u, new_hash)
+        return Token(access_token=issue_access_token(u.email))
 
     @app.post("/media/upload")
     async def upload_media(files: List[UploadFile] = File(...), current_email: str = Depends(get_current_email)):
-        os.makedirs(UPLOAD_DIR, exist_ok=True)
         results: List[Dict[str, Any]] = []
         errors: List[Dict[str, str]] = []
-        for f in files:
-            meta, err = await save_upload(UPLOAD_DIR, f)
+        for f, (meta, err) in zip(files, await save_uploads(UPLOAD_DIR, files, hold=hold_blob)):
             if err:
                 errors.append({"file": f.filename, "error": err})
                 continue
@@ -64,12 +345,12 @@ if DB_BACKEND == "sql":
         return {"saved": results, "errors": errors, "limit_bytes": MAX_BYTES, "allowed": sorted(list(ALLOWED_MIME))}
 
     @app.post("/notes", response_model=NoteOut)
-    def create_note(payload: NoteCreate, current_email: str = Depends(get_current_email), db=Depends(get_sql_db)):
+    async def create_note(payload: NoteCreate, current_email: str = Depends(get_current_email), db=Depends(get_sql_db)):
         # ensure user exists
-        u = sql_find_user(db, current_email)
+        u = await run_sql(db, sql_find_identity, current_email)
         if not u:
             raise HTTPException(status_code=401, detail="User not found")
-        created = sql_add(db, current_email, payload.note_title, payload.note_description, media=payload.media or [])
+        created = await run_sql(db, sql_add, u["id"], current_email, payload.note_title, payload.note_description, media=[m.model_dump() for m in payload.media])
         return NoteOut(**created)
 
     @app.post("/notes/with-media", response_model=NoteOut)
@@ -80,90 +361,184 @@ if DB_BACKEND == "sql":
         current_email: str = Depends(get_current_email),
         db=Depends(get_sql_db)
     ):
-        u = sql_find_user(db, current_email)
+        u = await run_sql(db, sql_find_identity, current_email)
         if not u:
             raise HTTPException(status_code=401, detail="User not found")
-        saved_media = []
-        os.makedirs(UPLOAD_DIR, exist_ok=True)
-        for f in files:
-            meta, err = await save_upload(UPLOAD_DIR, f)
-            if not err:
-                saved_media.append(meta)
-        created = sql_add(db, current_email, note_title, note_description, media=saved_media)
+        saved_media = [meta for meta, err in await save_uploads(UPLOAD_DIR, files, hold=hold_blob) if not err]
+        created = await run_sql(db, sql_add, u["id"], current_email, note_title, note_description, media=saved_media)
         return NoteOut(**created)
 
+    @app.post("/notes/batch", response_model=List[NoteBatchResult])
+    async def batch_notes(payload: NoteBatch, current_email: str = Depends(get_current_email), db=Depends(get_sql_db)):
+        ops = batch_ops(payload)
+        u = await run_sql(db, sql_find_identity, current_email)
+        if not u:
+            raise HTTPException(status_code=401, detail="User not found")
+        out = await run_sql(db, sql_batch, u["id"], ops)
+        await remove_blobs(UPLOAD_DIR, out["released"], blob_in_use)
+        return [NoteBatchResult(**r) for r in out["results"]]
+
     @app.get("/notes", response_model=List[NoteOut])
-    def list_notes(current_email: str = Depends(get_current_email), db=Depends(get_sql_db)):
-        return [NoteOut(**r) for r in sql_all(db, current_email)]
+    async def list_notes(request: Request, response: Response, page: Dict[str, Any] = Depends(page_params), include_history: bool = False, as_of: Optional[datetime] = Depends(as_of_param), current_email: str = Depends(get_current_email), db=Depends(get_sql_db)):
+        # the version is read before the page, so a write in between can only make the tag older
+        etag = list_etag(current_email, await run_sql(db, sql_notes_version, current_email), page["limit"], page["after"], page["before"], include_history, as_of)
+        if (cached := not_modified(request, etag)) is not None:
+            return cached
+        if as_of is not None:
+            res = await run_sql(db, sql_as_of, current_email, as_of, **page)
+        else:
+            res = await run_sql(db, sql_page, current_email, with_history=include_history, **page)
+        set_page_headers(response, res)
+        set_etag(response, etag)
+        return notes_out(res["items"])
 
-    @app.put("/notes/{unique_id}", response_model=NoteOut)
-    def edit_note(unique_id: int, payload: NoteUpdate, current_email: str = Depends(get_current_email), db=Depends(get_sql_db)):
-        n = db.query(Note).filter(Note.id == unique_id).first()
+    @app.get("/notes/search", response_model=List[NoteOut])
+    async def search_notes(response: Response, params: Dict[str, Any] = Depends(search_params), current_email: str = Depends(get_current_email), db=Depends(get_sql_db)):
+        if engine.dialect.name != "sqlite":
+            raise HTTPException(status_code=501, detail="Search needs the SQLite FTS5 index")
+        res = await run_sql(db, sql_search, current_email, **params)
+        set_search_headers(response, res)
+        return notes_out(res["items"])
+
+    @app.get("/notes/export")
+    async def export_notes(gzip: bool = False, current_email: str = Depends(get_current_email), db=Depends(get_sql_db)):
+        u = await run_sql(db, sql_find_identity, current_email)
+        if not u:
+            raise HTTPException(status_code=401, detail="User not found")
+        return export_response(db_chunks(sql_export, u["id"], current_email), gzip)
+
+    @app.post("/notes/import", response_model=NoteImportResult)
+    async def import_notes(request: Request, current_email: str = Depends(get_current_email), db=Depends(get_sql_db)):
+        u = await run_sql(db, sql_find_identity, current_email)
+        if not u:
+            raise HTTPException(status_code=401, detail="User not found")
+        return await import_stream(request, lambda items: run_sql(db, sql_import, u["id"], items))
+
+    async def owned_note(db, unique_id: int, current_email: str):
+        n = await run_sql(db, sql_find_note, unique_id)
         if not n:
             raise HTTPException(status_code=404, detail="Note not found")
-        owner = sql_find_user(db, current_email)
-        if not owner or n.owner_id != owner.id:
+        owner = await run_sql(db, sql_find_identity, current_email)
+        if not owner or n.owner_id != owner["id"]:
             raise HTTPException(status_code=403, detail="Not allowed")
+        return n
 
-        hist = NoteHistory(note_id=n.id, note_title=n.note_title, note_description=n.note_description)
-        db.add(hist)
+    async def note_version(db, n, rev: int) -> Dict[str, Any]:
+        v = await run_sql(db, sql_version, n, rev)
+        if v is None:
+            raise HTTPException(status_code=404, detail=f"Version {rev} not found")
+        return v
 
-        n.note_title = b64e(payload.note_title)
-        n.note_description = b64e(payload.note_description)
-        db.commit(); db.refresh(n)
+    async def save_edit(db, n, request: Request, response: Response, current_email: str, note_title: str, note_description: str) -> NoteOut:
+        check_if_match(request, note_etag(n.id, n.rev, n.note_created))
+        updated = await run_sql(db, sql_edit, n, current_email, note_title, note_description)
+        if updated is None:
+            raise edit_conflict(request)
+        set_etag(response, note_tag(updated))
+        return NoteOut(**updated)
+
+    @app.get("/notes/{unique_id}", response_model=NoteOut)
+    async def get_note(unique_id: int, request: Request, response: Response, include_history: bool = False, current_email: str = Depends(get_current_email), db=Depends(get_sql_db)):
+        n = await owned_note(db, unique_id, current_email)
+        etag = note_etag(n.id, n.rev, n.note_created)
+        if (cached := not_modified(request, etag)) is not None:
+            return cached
+        set_etag(response, etag)
+        return NoteOut(**await run_sql(db, sql_get_note, n, current_email, include_history))
+
+    @app.put("/notes/{unique_id}", response_model=NoteOut)
+    async def edit_note(unique_id: int, payload: NoteUpdate, request: Request, response: Response, current_email: str = Depends(get_current_email), db=Depends(get_sql_db)):
+        n = await owned_note(db, unique_id, current_email)
+        return await save_edit(db, n, request, response, current_email, payload.note_title, payload.note_description)
+
+    @app.get("/notes/{unique_id}/versions/{rev}", response_model=NoteVersion)
+    async def get_note_version(unique_id: int, rev: int, response: Response, current_email: str = Depends(get_current_email), db=Depends(get_sql_db)):
+        n = await owned_note(db, unique_id, current_email)
+        set_private(response)
+        return NoteVersion(uniqueID=unique_id, **await note_version(db, n, rev))
+
+    @app.get("/notes/{unique_id}/diff", response_model=NoteDiff)
+    async def diff_note(unique_id: int, params: Dict[str, Any] = Depends(diff_params), current_email: str = Depends(get_current_email), db=Depends(get_sql_db)):
+        n = await owned_note(db, unique_id, current_email)
+        a, b = await note_version(db, n, params["from_rev"]), await note_version(db, n, params["to_rev"])
+        return NoteDiff(**await run_in_threadpool(diff_versions, note_key(n.id, n.note_created, n.history_gen), a, b, params["mode"]))
 
-        return NoteOut(
-            uniqueID=n.id,
-            note_title=b64d(n.note_title),
-            note_description=b64d(n.note_description),
-            note_created=n.note_created,
-            owner_key=current_email,
-            note_history=[],  # can be expanded to return decoded history if desired
-            media=[{"url": m.url, "mime_type": m.mime_type, "size_bytes": m.size_bytes, "original_name": m.original_name}
-                   for m in db.query(SQLNoteMedia).filter(SQLNoteMedia.note_id == n.id).all()]
-        )
+    @app.post("/notes/{unique_id}/restore/{rev}", response_model=NoteOut)
+    async def restore_note(unique_id: int, rev: int, request: Request, response: Response, current_email: str = Depends(get_current_email), db=Depends(get_sql_db)):
+        # the old content comes back as a new revision; nothing is rewritten
+        n = await owned_note(db, unique_id, current_email)
+        v = await note_version(db, n, rev)
+        return await save_edit(db, n, request, response, current_email, v["note_title"], v["note_description"])
 
     @app.delete("/notes/{unique_id}", status_code=204)
-    def delete_note(unique_id: int, current_email: str = Depends(get_current_email), db=Depends(get_sql_db)):
-        n = db.query(Note).filter(Note.id == unique_id).first()
-        if not n:
-            raise HTTPException(status_code=404, detail="Note not found")
-        owner = sql_find_user(db, current_email)
-        if not owner or n.owner_id != owner.id:
-            raise HTTPException(status_code=403, detail="Not allowed")
-        db.delete(n); db.commit()
+    async def delete_note(unique_id: int, current_email: str = Depends(get_current_email), db=Depends(get_sql_db)):
+        n = await owned_note(db, unique_id, current_email)
+        await remove_blobs(UPLOAD_DIR, await run_sql(db, sql_delete, n), blob_in_use)
         return None
 
 else:
-    from databases.mongodb_connect import get_db
-    from repositories.users_repository import find_user_by_email as mg_find_user, create_user as mg_create_user
-    from repositories.notes_repository import add_note as mg_add, get_all_notes as mg_all
-    from pymongo import ReturnDocument
+    from databases.mongodb_connect import get_db, get_async_db, ensure_indexes as init_schema, close_clients
+    if DB_ASYNC:
+        from repositories.async_users_repository import find_user_by_email as mg_find_user, find_user_identity as mg_find_identity, create_user as mg_create_user, update_password_hash as mg_update_hash, get_notes_version as mg_notes_version
+        from repositories.async_notes_repository import add_note as mg_add, edit_note as mg_edit, delete_note as mg_delete, find_note as mg_find_note, get_note as mg_get_note, get_notes_page as mg_page, search_notes as mg_search, get_version as mg_version, apply_batch as mg_batch, iter_export as mg_export, import_notes as mg_import, get_notes_as_of as mg_as_of
+    else:
+        from repositories.users_repository import find_user_by_email as mg_find_user, find_user_identity as mg_find_identity, create_user as mg_create_user, update_password_hash as mg_update_hash, get_notes_version as mg_notes_version
+        from repositories.notes_repository import add_note as mg_add, edit_note as mg_edit, delete_note as mg_delete, find_note as mg_find_note, get_note as mg_get_note, get_notes_page as mg_page, search_notes as mg_search, get_version as mg_version, apply_batch as mg_batch, iter_export as mg_export, import_notes as mg_import, get_notes_as_of as mg_as_of
+
+    if DB_ASYNC:
+        from repositories.async_media_repository import hold_blob as mg_hold_blob, blob_in_use as mg_blob_in_use
+    else:
+        from repositories.media_repository import hold_blob as mg_hold_blob, blob_in_use as mg_blob_in_use
+    from repositories.notes_repository import compact_history as compact_step, purge_tombstones as purge_step
+    from repositories.media_repository import purge_blobs as mg_purge_blobs, blob_in_use as mg_blob_in_use_sync
+
+    def sweep_step():
+        return remove_blob_files(UPLOAD_DIR, mg_purge_blobs(), mg_blob_in_use_sync)
 
-    db = get_db()
+    async def hold_blob(digest: str, url: str) -> None:
+        await run_db(mg_hold_blob, digest, url)
+
+    async def blob_in_use(digest: str) -> bool:
+        return await run_db(mg_blob_in_use, digest)
+
+    if DB_ASYNC:
+        async def ping_db():
+            await get_async_db().command("ping")
+    else:
+        async def ping_db():
+            await run_in_threadpool(get_db().command, "ping")
+
+    async def warm_db():
+        # the first round trip connects; MONGO_MIN_POOL_SIZE keeps more connections open behind it
+        await ping_db()
+
+    async def close_db():
+        close_clients()
 
     @app.post("/auth/register", response_model=UserOut, status_code=201)
-    def register(payload: RegisterIn):
-        if mg_find_user(payload.email):
+    async def register(payload: RegisterIn):
+        if await run_db(mg_find_user, payload.email):
             raise HTTPException(status_code=409, detail="Email already registered")
-        u = mg_create_user(payload.email, hash_password(payload.password))
+        u = await run_db(mg_create_user, payload.email, await hash_password_async(payload.password))
         return UserOut(email=u["email"])
 
     @app.post("/auth/login", response_model=Token)
-    def login(form: OAuth2PasswordRequestForm = Depends()):
-        u = mg_find_user(form.username)
-        if not u or not verify_password(form.password, u["hashed_password"]):
+    async def login(form: OAuth2PasswordRequestForm = Depends()):
+        u = await run_db(mg_find_user, form.username)
+        if not u:
+            raise HTTPException(status_code=401, detail="Invalid credentials")
+        ok, new_hash = await verify_and_update_async(form.password, u["hashed_password"])
+        if not ok:
             raise HTTPException(status_code=401, detail="Invalid credentials")
-        token = create_access_token({"sub": u["email"]}, JWT_SECRET, JWT_ALGO, ACCESS_TOKEN_EXPIRE_MINUTES)
-        return Token(access_token=token)
+        if new_hash:
+            await run_db(mg_update_hash, u["email"], new_hash)
+        return Token(access_token=issue_access_token(u["email"]))
 
     @app.post("/media/upload")
     async def upload_media(files: List[UploadFile] = File(...), current_email: str = Depends(get_current_email)):
-        os.makedirs(UPLOAD_DIR, exist_ok=True)
         results: List[Dict[str, Any]] = []
         errors: List[Dict[str, str]] = []
-        for f in files:
-            meta, err = await save_upload(UPLOAD_DIR, f)
+        for f, (meta, err) in zip(files, await save_uploads(UPLOAD_DIR, files, hold=hold_blob)):
             if err:
                 errors.append({"file": f.filename, "error": err})
                 continue
@@ -171,10 +546,10 @@ else:
         return {"saved": results, "errors": errors, "limit_bytes": MAX_BYTES, "allowed": sorted(list(ALLOWED_MIME))}
 
     @app.post("/notes", response_model=NoteOut)
-    def create_note(payload: NoteCreate, current_email: str = Depends(get_current_email)):
-        if not mg_find_user(current_email):
+    async def create_note(payload: NoteCreate, current_email: str = Depends(get_current_email)):
+        if not await run_db(mg_find_identity, current_email):
             raise HTTPException(status_code=401, detail="User not found")
-        created = mg_add(current_email, payload.note_title, payload.note_description, media=payload.media or [])
+        created = await run_db(mg_add, current_email, payload.note_title, payload.note_description, media=[m.model_dump() for m in payload.media])
         return NoteOut(**created)
 
     @app.post("/notes/with-media", response_model=NoteOut)
@@ -184,63 +559,108 @@ else:
         files: List[UploadFile] = File(default=[]),
         current_email: str = Depends(get_current_email)
     ):
-        if not mg_find_user(current_email):
+        if not await run_db(mg_find_identity, current_email):
             raise HTTPException(status_code=401, detail="User not found")
-        saved_media = []
-        os.makedirs(UPLOAD_DIR, exist_ok=True)
-        for f in files:
-            meta, err = await save_upload(UPLOAD_DIR, f)
-            if not err:
-                saved_media.append(meta)
-        created = mg_add(current_email, note_title, note_description, media=saved_media)
+        saved_media = [meta for meta, err in await save_uploads(UPLOAD_DIR, files, hold=hold_blob) if not err]
+        created = await run_db(mg_add, current_email, note_title, note_description, media=saved_media)
         return NoteOut(**created)
 
+    @app.post("/notes/batch", response_model=List[NoteBatchResult])
+    async def batch_notes(payload: NoteBatch, current_email: str = Depends(get_current_email)):
+        ops = batch_ops(payload)
+        if not await run_db(mg_find_identity, current_email):
+            raise HTTPException(status_code=401, detail="User not found")
+        out = await run_db(mg_batch, current_email, ops)
+        await remove_blobs(UPLOAD_DIR, out["released"], blob_in_use)
+        return [NoteBatchResult(**r) for r in out["results"]]
+
     @app.get("/notes", response_model=List[NoteOut])
-    def list_notes(current_email: str = Depends(get_current_email)):
-        return [NoteOut(**r) for r in mg_all(current_email)]
+    async def list_notes(request: Request, response: Response, page: Dict[str, Any] = Depends(page_params), include_history: bool = False, as_of: Optional[datetime] = Depends(as_of_param), current_email: str = Depends(get_current_email)):
+        etag = list_etag(current_email, await run_db(mg_notes_version, current_email), page["limit"], page["after"], page["before"], include_history, as_of)
+        if (cached := not_modified(request, etag)) is not None:
+            return cached
+        if as_of is not None:
+            res = await run_db(mg_as_of, current_email, as_of, **page)
+        else:
+            res = await run_db(mg_page, current_email, with_history=include_history, **page)
+        set_page_headers(response, res)
+        set_etag(response, etag)
+        return notes_out(res["items"])
 
-    @app.put("/notes/{unique_id}", response_model=NoteOut)
-    def edit_note(unique_id: int, payload: NoteUpdate, current_email: str = Depends(get_current_email)):
-        notes = db["notes"]
-        current = notes.find_one({"uniqueID": unique_id})
+    @app.get("/notes/search", response_model=List[NoteOut])
+    async def search_notes(response: Response, params: Dict[str, Any] = Depends(search_params), current_email: str = Depends(get_current_email)):
+        res = await run_db(mg_search, current_email, **params)
+        set_search_headers(response, res)
+        return notes_out(res["items"])
+
+    @app.get("/notes/export")
+    async def export_notes(gzip: bool = False, current_email: str = Depends(get_current_email)):
+        return export_response(db_chunks(mg_export, current_email), gzip)
+
+    @app.post("/notes/import", response_model=NoteImportResult)
+    async def import_notes(request: Request, current_email: str = Depends(get_current_email)):
+        if not await run_db(mg_find_identity, current_email):
+            raise HTTPException(status_code=401, detail="User not found")
+        return await import_stream(request, lambda items: run_db(mg_import, current_email, items))
+
+    async def owned_note(unique_id: int, current_email: str) -> Dict[str, Any]:
+        current = await run_db(mg_find_note, unique_id)
         if not current:
             raise HTTPException(status_code=404, detail="Note not found")
         if current.get("owner_key") != current_email:
             raise HTTPException(status_code=403, detail="Not allowed")
+        return current
+
+    async def note_version(current: Dict[str, Any], rev: int) -> Dict[str, Any]:
+        v = await run_db(mg_version, current, rev)
+        if v is None:
+            raise HTTPException(status_code=404, detail=f"Version {rev} not found")
+        return v
 
-        prev_snapshot = {
-            "note_title": current.get("note_title"),          # already Base64 in DB
-            "note_description": current.get("note_description"),
-            "archived_at": datetime.now(timezone.utc),
-        }
-
-        updated = notes.find_one_and_update(
-            {"uniqueID": unique_id},
-            {
-                "$push": {"note_history": {"$each": [prev_snapshot], "$position": 0}},
-                "$set": {"note_title": b64e(payload.note_title), "note_description": b64e(payload.note_description)}
-            },
-            return_document=ReturnDocument.AFTER
-        )
-        updated.pop("_id", None)
-        updated["note_title"] = b64d(updated.get("note_title"))
-        updated["note_description"] = b64d(updated.get("note_description"))
-        decoded_hist = []
-        for h in updated.get("note_history", []):
-            decoded_hist.append({
-                "note_title": b64d(h.get("note_title","")),
-                "note_description": b64d(h.get("note_description","")),
-                "archived_at": h.get("archived_at")
-            })
-        updated["note_history"] = decoded_hist
+    async def save_edit(current: Dict[str, Any], request: Request, response: Response, note_title: str, note_description: str) -> NoteOut:
+        check_if_match(request, note_tag(current))
+        updated = await run_db(mg_edit, current, note_title, note_description)
+        if updated is None:
+            raise edit_conflict(request)
+        set_etag(response, note_tag(updated))
         return NoteOut(**updated)
 
+    @app.get("/notes/{unique_id}", response_model=NoteOut)
+    async def get_note(unique_id: int, request: Request, response: Response, include_history: bool = False, current_email: str = Depends(get_current_email)):
+        current = await owned_note(unique_id, current_email)
+        etag = note_tag(current)
+        if (cached := not_modified(request, etag)) is not None:
+            return cached
+        set_etag(response, etag)
+        return NoteOut(**await run_db(mg_get_note, current, include_history))
+
+    @app.put("/notes/{unique_id}", response_model=NoteOut)
+    async def edit_note(unique_id: int, payload: NoteUpdate, request: Request, response: Response, current_email: str = Depends(get_current_email)):
+        current = await owned_note(unique_id, current_email)
+        return await save_edit(current, request, response, payload.note_title, payload.note_description)
+
+    @app.get("/notes/{unique_id}/versions/{rev}", response_model=NoteVersion)
+    async def get_note_version(unique_id: int, rev: int, response: Response, current_email: str = Depends(get_current_email)):
+        current = await owned_note(unique_id, current_email)
+        set_private(response)
+        return NoteVersion(uniqueID=unique_id, **await note_version(current, rev))
+
+    @app.get("/notes/{unique_id}/diff", response_model=NoteDiff)
+    async def diff_note(unique_id: int, params: Dict[str, Any] = Depends(diff_params), current_email: str = Depends(get_current_email)):
+        current = await owned_note(unique_id, current_email)
+        a, b = await note_version(current, params["from_rev"]), await note_version(current, params["to_rev"])
+        key = note_key(unique_id, current.get("note_created"), current.get("history_gen"))
+        return NoteDiff(**await run_in_threadpool(diff_versions, key, a, b, params["mode"]))
+
+    @app.post("/notes/{unique_id}/restore/{rev}", response_model=NoteOut)
+    async def restore_note(unique_id: int, rev: int, request: Request, response: Response, current_email: str = Depends(get_current_email)):
+        # the old content comes back as a new revision; nothing is rewritten
+        current = await owned_note(unique_id, current_email)
+        v = await note_version(current, rev)
+        return await save_edit(current, request, response, v["note_title"], v["note_description"])
+
     @app.delete("/notes/{unique_id}", status_code=204)
-    def delete_note(unique_id: int, current_email: str = Depends(get_current_email)):
-        res = db["notes"].find_one({"uniqueID": unique_id})
-        if not res:
-            raise HTTPException(status_code=404, detail="Note not found")
-        if res.get("owner_key") != current_email:
-            raise HTTPException(status_code=403, detail="Not allowed")
-        db["notes"].delete_one({"uniqueID": unique_id})
+    async def delete_note(unique_id: int, current_email: str = Depends(get_current_email)):
+        await owned_note(unique_id, current_email)
+        await remove_blobs(UPLOAD_DIR, await run_db(mg_delete, unique_id), blob_in_use)
         return None
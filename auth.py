@@ -1,15 +1,22 @@
-import os
+import os, hashlib
+from typing import Dict
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
 from pydantic import BaseModel
+from utils import create_access_token
+from utils_cache import LRUCache
 
 JWT_SECRET = os.getenv("JWT_SECRET", "change_this_secret")
 JWT_ALGO = os.getenv("JWT_ALGO", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "60"))
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
+# sha256(token) -> verified subject, kept until the token's own exp
+_token_cache = LRUCache(TOKEN_CACHE_SIZE)
+
 class Token(BaseModel):
     access_token: str
     token_type: str = "bearer"
@@ -17,16 +24,39 @@ class Token(BaseModel):
 class TokenData(BaseModel):
     sub: str  # email
 
-def decode_token(token: str) -> TokenData:
+def issue_access_token(sub: str) -> str:
+    return create_access_token({"sub": sub}, JWT_SECRET, JWT_ALGO, ACCESS_TOKEN_EXPIRE_MINUTES)
+
+def _verified_sub(token: str) -> str:
+    key = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    sub = _token_cache.get(key)
+    if sub is not None:
+        return sub
     try:
         payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGO])
-        sub: str = payload.get("sub")
+        sub = payload.get("sub")
         if not sub:
             raise JWTError("Missing sub")
-        return TokenData(sub=sub)
     except JWTError as e:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token") from e
+    if payload.get("exp") is not None:
+        _token_cache.set(key, sub, expires_at=float(payload["exp"]))
+    return sub
+
+def decode_token(token: str) -> TokenData:
+    return TokenData(sub=_verified_sub(token))
+
+def invalidate_token_cache() -> None:
+    _token_cache.clear()
+
+def rotate_jwt_secret(secret: str) -> None:
+    # tokens verified under the old secret must be re-checked against the new one
+    global JWT_SECRET
+    JWT_SECRET = secret
+    invalidate_token_cache()
+
+def token_cache_stats() -> Dict[str, int]:
+    return _token_cache.stats()
 
 async def get_current_email(token: str = Depends(oauth2_scheme)) -> str:
-    td = decode_token(token)
-    return td.sub
+    return _verified_sub(token)
@@ -1,15 +1,52 @@
 import os
-from pymongo import MongoClient, ASCENDING
+from pymongo import MongoClient, IndexModel, ASCENDING, TEXT
 
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
 DB_NAME = os.getenv("DB_NAME", "notes_db")
+# connections each client opens up front and keeps open, per worker process; 0 connects on demand
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
 _client = None
+_async_client = None
+
+# (collection, indexes) the app expects; ensure_indexes() creates the missing ones
+INDEXES = [
+    ("notes", [IndexModel([("uniqueID", ASCENDING)], unique=True),
+               IndexModel([("owner_key", ASCENDING), ("uniqueID", ASCENDING)])]),
+    ("note_history", [IndexModel([("uniqueID", ASCENDING), ("bucket_seq", ASCENDING)], unique=True),
+                      IndexModel([("uniqueID", ASCENDING), ("last_at", ASCENDING)])]),  # GET /notes?as_of=
+    ("note_tombstones", [IndexModel([("uniqueID", ASCENDING)], unique=True),
+                         IndexModel([("owner_key", ASCENDING), ("uniqueID", ASCENDING)]),
+                         IndexModel([("deleted_at", ASCENDING)])]),
+    ("users", [IndexModel([("email", ASCENDING)], unique=True)]),
+    # owner_key prefix: every search is scoped to one user, so $text only scans that user's notes
+    ("note_search", [IndexModel([("owner_key", ASCENDING), ("note_title", TEXT), ("note_description", TEXT)],
+                                weights={"note_title": 10, "note_description": 1}, default_language="none", name="note_search_text")]),
+]
 
 def get_db():
+    # the client connects in the background; nothing is sent to the server until the first command
     global _client
     if _client is None:
-        _client = MongoClient(MONGO_URI)
-        db = _client[DB_NAME]
-        db["notes"].create_index([("uniqueID", ASCENDING)], unique=True)
-        db["users"].create_index([("email", ASCENDING)], unique=True)
+        _client = MongoClient(MONGO_URI, minPoolSize=MONGO_MIN_POOL_SIZE)
     return _client[DB_NAME]
+
+def ensure_indexes() -> None:
+    # idempotent: indexes that already exist are left alone; one round trip per collection
+    db = get_db()
+    for collection, indexes in INDEXES:
+        db[collection].create_indexes(indexes)
+
+def get_async_db():
+    # Motor client for the async data path; indexes are created through ensure_indexes()
+    global _async_client
+    if _async_client is None:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        _async_client = AsyncIOMotorClient(MONGO_URI, minPoolSize=MONGO_MIN_POOL_SIZE)
+    return _async_client[DB_NAME]
+
+def close_clients() -> None:
+    global _client, _async_client
+    for client in (_client, _async_client):
+        if client is not None:
+            client.close()
+    _client = _async_client = None
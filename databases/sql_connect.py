@@ -1,9 +1,107 @@
 import os
-from sqlalchemy import create_engine
+from contextlib import ExitStack, AsyncExitStack
+from typing import Any, Dict, List
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker, declarative_base
 
 SQLALCHEMY_DATABASE_URL = os.getenv("SQLALCHEMY_DATABASE_URL", "sqlite:///./notes.db")
-connect_args = {"check_same_thread": False} if SQLALCHEMY_DATABASE_URL.startswith("sqlite") else {}
-engine = create_engine(SQLALCHEMY_DATABASE_URL, echo=False, future=True, connect_args=connect_args)
+
+# connection pool, per engine (the sync and the async engine each have one)
+SQL_POOL_SIZE = int(os.getenv("SQL_POOL_SIZE", "5"))
+SQL_MAX_OVERFLOW = int(os.getenv("SQL_MAX_OVERFLOW", "10"))
+SQL_POOL_TIMEOUT = float(os.getenv("SQL_POOL_TIMEOUT", "30"))
+SQL_POOL_RECYCLE = int(os.getenv("SQL_POOL_RECYCLE", "1800"))  # seconds; -1 keeps connections forever
+# a cheap round trip on checkout that replaces connections the server dropped; off by default on SQLite
+SQL_POOL_PRE_PING = os.getenv("SQL_POOL_PRE_PING")
+
+# SQLite connection profile: "tuned" switches to WAL (readers no longer wait behind a writer) with
+# synchronous=NORMAL (no fsync per commit; a power loss can drop the last commits but never corrupts
+# the file), memory-mapped reads and a larger page cache. "default" keeps SQLite's own settings;
+# tuned is opt-in because synchronous=NORMAL trades the durability of the last commits for speed
+SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "default").lower()
+SQLITE_CACHE_KB = int(os.getenv("SQLITE_CACHE_KB", "65536"))
+SQLITE_MMAP_BYTES = int(os.getenv("SQLITE_MMAP_BYTES", str(256 * 1024 * 1024)))
+
+def _is_sqlite(url: str) -> bool:
+    return url.startswith("sqlite")
+
+def _in_memory(url: str) -> bool:
+    return ":memory:" in url or url.partition("://")[2] in ("", "/")
+
+def pool_options(url: str) -> Dict[str, Any]:
+    # in-memory SQLite keeps one connection per thread (or one shared one), so there is no pool to size
+    if _is_sqlite(url) and _in_memory(url):
+        return {}
+    pre_ping = not _is_sqlite(url) if SQL_POOL_PRE_PING is None else SQL_POOL_PRE_PING.lower() in ("1", "true", "yes")
+    return {"pool_size": SQL_POOL_SIZE, "max_overflow": SQL_MAX_OVERFLOW, "pool_timeout": SQL_POOL_TIMEOUT,
+            "pool_recycle": SQL_POOL_RECYCLE, "pool_pre_ping": pre_ping}
+
+def _warm_count(engine: Engine, n: int) -> int:
+    # in-memory SQLite has a single connection per thread (or one shared), so one is all there is
+    return max(1, n) if pool_options(str(engine.url)) else 1
+
+def warm_pool(engine: Engine, n: int = SQL_POOL_SIZE) -> None:
+    # opens n connections at once and hands them back to the pool, so the first requests don't connect
+    with ExitStack() as stack:
+        for _ in range(_warm_count(engine, n)):
+            stack.enter_context(engine.connect())
+
+async def warm_async_pool(n: int = SQL_POOL_SIZE) -> None:
+    async with AsyncExitStack() as stack:
+        for _ in range(_warm_count(get_async_engine().sync_engine, n)):
+            await stack.enter_async_context(get_async_engine().connect())
+
+def sqlite_pragmas(profile: str) -> List[str]:
+    if profile != "tuned":
+        return []
+    return [
+        "PRAGMA journal_mode=WAL",  # stored in the file; every later connection opens in WAL too
+        "PRAGMA synchronous=NORMAL",
+        f"PRAGMA cache_size=-{SQLITE_CACHE_KB}",  # negative: KiB rather than pages
+        f"PRAGMA mmap_size={SQLITE_MMAP_BYTES}",
+        "PRAGMA temp_store=MEMORY",
+    ]
+
+def apply_sqlite_profile(engine: Engine, profile: str = SQLITE_PROFILE) -> None:
+    # run on every new pooled connection; for an async engine pass engine.sync_engine
+    pragmas = sqlite_pragmas(profile)
+    if engine.dialect.name != "sqlite" or not pragmas:
+        return
+
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_conn, _record):
+        cur = dbapi_conn.cursor()
+        for pragma in pragmas:
+            cur.execute(pragma)
+        cur.close()
+
+connect_args = {"check_same_thread": False} if _is_sqlite(SQLALCHEMY_DATABASE_URL) else {}
+engine = create_engine(SQLALCHEMY_DATABASE_URL, echo=False, future=True, connect_args=connect_args, **pool_options(SQLALCHEMY_DATABASE_URL))
+apply_sqlite_profile(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, future=True)
 Base = declarative_base()
+
+_ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg", "mysql": "mysql+aiomysql"}
+
+def _async_url(url: str) -> str:
+    scheme, sep, rest = url.partition("://")
+    return f"{_ASYNC_DRIVERS.get(scheme, scheme)}{sep}{rest}"
+
+SQLALCHEMY_ASYNC_DATABASE_URL = os.getenv("SQLALCHEMY_ASYNC_DATABASE_URL", _async_url(SQLALCHEMY_DATABASE_URL))
+_async_engine = None
+_AsyncSessionLocal = None
+
+def get_async_engine():
+    # created on first use so the sync path never needs an async driver installed
+    global _async_engine, _AsyncSessionLocal
+    if _async_engine is None:
+        from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+        _async_engine = create_async_engine(SQLALCHEMY_ASYNC_DATABASE_URL, echo=False, connect_args=connect_args, **pool_options(SQLALCHEMY_ASYNC_DATABASE_URL))
+        apply_sqlite_profile(_async_engine.sync_engine)
+        _AsyncSessionLocal = async_sessionmaker(_async_engine, autoflush=False, expire_on_commit=False)
+    return _async_engine
+
+def AsyncSessionLocal():
+    get_async_engine()
+    return _AsyncSessionLocal()
@@ -0,0 +1,58 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+# columns added after the first release; create_all() only creates missing tables, so existing
+# databases get them through ALTER TABLE (plus an optional backfill run right after the add)
+_ADDED_COLUMNS = [
+    ("notes", "rev", "INTEGER NOT NULL DEFAULT 0",
+     "UPDATE notes SET rev = (SELECT COUNT(*) FROM note_history WHERE note_history.note_id = notes.id)"),
+    ("note_history", "rev", "INTEGER", None),
+    ("note_history", "kind", "VARCHAR(8) NOT NULL DEFAULT 'full'", None),
+    ("users", "notes_version", "INTEGER NOT NULL DEFAULT 0", None),
+    ("media_blobs", "hold_until", "TIMESTAMP", None),
+    ("notes", "history_gen", "INTEGER NOT NULL DEFAULT 0", None),
+]
+
+# indexes added after the first release, for the same reason: (table, name, columns)
+_ADDED_INDEXES = [
+    ("notes", "ix_notes_owner_id_id", "owner_id, id"),                   # a user's notes, keyset pages
+    ("note_history", "ix_note_history_note_id_id", "note_id, id"),       # hydration, versions, deletes
+    ("note_history", "ix_note_history_note_id_archived_at", "note_id, archived_at"),  # GET /notes?as_of=
+    ("note_media", "ix_note_media_note_id_id", "note_id, id"),           # hydration, deletes
+]
+
+# full-text index behind GET /notes/search; rowid is notes.id. SQLite only (FTS5)
+_SEARCH_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5("
+    "note_title, note_description, owner_id UNINDEXED, tokenize='unicode61 remove_diacritics 2')"
+)
+
+def upgrade_schema(engine: Engine) -> None:
+    insp = inspect(engine)
+    tables = set(insp.get_table_names())
+    with engine.begin() as conn:
+        for table, column, ddl, backfill in _ADDED_COLUMNS:
+            if table not in tables:
+                continue
+            if column in {c["name"] for c in insp.get_columns(table)}:
+                continue
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+            if backfill:
+                conn.execute(text(backfill))
+        added = 0
+        for table, name, columns in _ADDED_INDEXES:
+            if table not in tables or name in {ix["name"] for ix in insp.get_indexes(table)}:
+                continue
+            conn.execute(text(f"CREATE INDEX {name} ON {table} ({columns})"))
+            added += 1
+        if engine.dialect.name == "sqlite":
+            conn.execute(text(_SEARCH_DDL))
+            if added:
+                conn.execute(text("ANALYZE"))  # planner statistics, so the new indexes get picked
+
+def init_schema(engine: Engine) -> None:
+    # idempotent: creates the missing tables, then brings an older database up to date
+    from databases.sql_connect import Base
+    import models.sql_models  # registers the tables on Base
+    Base.metadata.create_all(bind=engine)
+    upgrade_schema(engine)
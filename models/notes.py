@@ -1,5 +1,5 @@
-from pydantic import BaseModel, Field
-from typing import List
+from pydantic import BaseModel, Field, model_validator
+from typing import Any, List, Dict, Union, Literal
 from datetime import datetime
 
 class NoteMedia(BaseModel):
@@ -9,6 +9,7 @@ class NoteMedia(BaseModel):
     original_name: str
 
 class NoteSnapshot(BaseModel):
+    rev: int | None = None
     note_title: str
     note_description: str
     archived_at: datetime
@@ -22,11 +23,68 @@ class NoteUpdate(BaseModel):
     note_title: str = Field(..., min_length=1)
     note_description: str = Field(..., min_length=1)
 
+class NoteImport(BaseModel):
+    # one line of GET /notes/export; uniqueID and rev are reassigned on import
+    note_title: str = Field(..., min_length=1)
+    note_description: str = Field(..., min_length=1)
+    note_created: datetime | None = None
+    note_history: List[NoteSnapshot] = []  # newest first
+    media: List[NoteMedia] = []
+
+class NoteImportResult(BaseModel):
+    imported: int
+    failed: int
+    errors: List[Dict[str, Any]] = []  # {"line": n, "error": ...}, at most IMPORT_MAX_ERRORS
+
 class NoteOut(BaseModel):
     uniqueID: int
     note_title: str
     note_description: str
     note_created: datetime
     owner_key: str
+    rev: int | None = None
     note_history: List[NoteSnapshot] = []
     media: List[NoteMedia] = []
+    deleted_at: datetime | None = None  # GET /notes?as_of= only: the note has been deleted since
+
+class NoteVersion(BaseModel):
+    uniqueID: int
+    rev: int
+    note_title: str
+    note_description: str
+
+class NoteDiff(BaseModel):
+    uniqueID: int
+    from_rev: int
+    to_rev: int
+    mode: str
+    # unified: diff text; words: [{"op": "equal" | "delete" | "insert", "text": ...}]
+    note_title: Union[str, List[Dict[str, str]]]
+    note_description: Union[str, List[Dict[str, str]]]
+
+class NoteBatchOp(BaseModel):
+    op: Literal["create", "update", "delete"]
+    uniqueID: int | None = None  # update / delete
+    note_title: str | None = Field(None, min_length=1)  # create / update
+    note_description: str | None = Field(None, min_length=1)  # create / update
+    media: List[NoteMedia] = []  # create
+    rev: int | None = None  # update / delete: only apply if the note is still at this rev (412 otherwise)
+
+    @model_validator(mode="after")
+    def _check_fields(self):
+        if self.op != "create" and self.uniqueID is None:
+            raise ValueError(f"{self.op} needs uniqueID")
+        if self.op != "delete" and (self.note_title is None or self.note_description is None):
+            raise ValueError(f"{self.op} needs note_title and note_description")
+        return self
+
+class NoteBatch(BaseModel):
+    ops: List[NoteBatchOp] = Field(..., min_length=1)
+
+class NoteBatchResult(BaseModel):
+    index: int
+    op: str
+    status: int  # what the single-note endpoint would have answered: 201, 200, 204, 403, 404, 409, 412
+    uniqueID: int | None = None
+    rev: int | None = None
+    detail: str | None = None
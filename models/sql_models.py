@@ -1,5 +1,5 @@
 from datetime import datetime, timezone
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index, JSON
 from sqlalchemy.orm import relationship, Mapped, mapped_column
 from databases.sql_connect import Base
 
@@ -8,25 +8,59 @@ class User(Base):
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     email: Mapped[str] = mapped_column(String(320), unique=True, index=True, nullable=False)
     hashed_password: Mapped[str] = mapped_column(String, nullable=False)
+    notes_version: Mapped[int] = mapped_column(Integer, default=0, server_default="0", nullable=False)  # bumped by every note write
     notes = relationship("Note", back_populates="owner", cascade="all, delete-orphan")
 
 class Note(Base):
     __tablename__ = "notes"
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)  # uniqueID
-    note_title: Mapped[str] = mapped_column(String(512), nullable=False)            # stored Base64
-    note_description: Mapped[str] = mapped_column(String, nullable=False)           # stored Base64
+    note_title: Mapped[str] = mapped_column(String(512), nullable=False)            # utils_codec value (p:/z:/x:)
+    note_description: Mapped[str] = mapped_column(String, nullable=False)           # utils_codec value (p:/z:/x:)
     note_created: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False)
+    rev: Mapped[int] = mapped_column(Integer, default=0, server_default="0", nullable=False)  # edits so far
+    history_gen: Mapped[int] = mapped_column(Integer, default=0, server_default="0", nullable=False)  # history compactions so far
 
     owner_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     owner = relationship("User", back_populates="notes")
+    media = relationship("NoteMedia", back_populates="note", cascade="all, delete-orphan", lazy="raise_on_sql")
+    history = relationship("NoteHistory", back_populates="note", cascade="all, delete-orphan", lazy="raise_on_sql")
+
+    __table_args__ = (Index("ix_notes_owner_id_id", "owner_id", "id"),)
 
 class NoteHistory(Base):
     __tablename__ = "note_history"
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     note_id: Mapped[int] = mapped_column(ForeignKey("notes.id", ondelete="CASCADE"), nullable=False)
-    note_title: Mapped[str] = mapped_column(String(512), nullable=False)            # Base64 snapshot
-    note_description: Mapped[str] = mapped_column(String, nullable=False)           # Base64 snapshot
+    rev: Mapped[int | None] = mapped_column(Integer, nullable=True)                 # version number this row archives
+    kind: Mapped[str] = mapped_column(String(8), default="full", server_default="full", nullable=False)  # full | delta
+    note_title: Mapped[str] = mapped_column(String, nullable=False)                 # utils_codec value: snapshot or JSON delta
+    note_description: Mapped[str] = mapped_column(String, nullable=False)           # utils_codec value: snapshot or JSON delta
     archived_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False)
+    note = relationship("Note", back_populates="history")
+
+    __table_args__ = (
+        Index("ix_note_history_note_id_id", "note_id", "id"),                    # a note's rows, newest first
+        Index("ix_note_history_note_id_archived_at", "note_id", "archived_at"),  # rows archived after a time
+    )
+
+class NoteTombstone(Base):
+    # a deleted note as GET /notes?as_of= needs it: the last version and the history rows (stored
+    # entries, newest first). SQLite can hand a deleted id out again, so note_id is not the key.
+    __tablename__ = "note_tombstones"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    note_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    owner_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    note_title: Mapped[str] = mapped_column(String, nullable=False)                 # utils_codec value (p:/z:/x:)
+    note_description: Mapped[str] = mapped_column(String, nullable=False)           # utils_codec value (p:/z:/x:)
+    note_created: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    rev: Mapped[int] = mapped_column(Integer, nullable=False)
+    deleted_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False)
+    note_history: Mapped[list] = mapped_column(JSON, nullable=False)               # archived_at as ISO text
+
+    __table_args__ = (
+        Index("ix_note_tombstones_owner_id_note_id", "owner_id", "note_id"),
+        Index("ix_note_tombstones_deleted_at", "deleted_at"),
+    )
 
 class NoteMedia(Base):
     __tablename__ = "note_media"
@@ -36,3 +70,15 @@ class NoteMedia(Base):
     mime_type: Mapped[str] = mapped_column(String(100), nullable=False)
     size_bytes: Mapped[int] = mapped_column(Integer, nullable=False)
     original_name: Mapped[str] = mapped_column(String, nullable=False)
+    note = relationship("Note", back_populates="media")
+
+    __table_args__ = (Index("ix_note_media_note_id_id", "note_id", "id"),)
+
+class MediaBlob(Base):
+    # content-addressed upload (MEDIA_STORAGE=cas); refs counts note_media rows pointing at it
+    __tablename__ = "media_blobs"
+    digest: Mapped[str] = mapped_column(String(64), primary_key=True)  # sha256 hex
+    url: Mapped[str] = mapped_column(String, nullable=False)
+    refs: Mapped[int] = mapped_column(Integer, default=0, server_default="0", nullable=False)
+    hold_until: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)  # set by uploads
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False)
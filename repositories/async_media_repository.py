@@ -0,0 +1,30 @@
+from typing import Dict, Any, List, Iterable
+from databases.mongodb_connect import get_async_db
+from utils_media import blob_refs, hold_until
+from repositories.media_repository import _ref_ops, _dead_filter
+
+def _col():
+    return get_async_db()["media_blobs"]
+
+async def hold_blob(digest: str, url: str) -> None:
+    await _col().update_one({"_id": digest}, {"$max": {"hold_until": hold_until()}, "$setOnInsert": {"url": url, "refs": 0}}, upsert=True)
+
+async def blob_in_use(digest: str) -> bool:
+    return await _col().count_documents({"_id": digest}, limit=1) > 0
+
+async def ref_media(media: Iterable[Dict[str, Any]]) -> None:
+    ops = _ref_ops(blob_refs(media), 1)
+    if ops:
+        await _col().bulk_write(ops, ordered=False)
+
+async def deref_media(media: Iterable[Dict[str, Any]]) -> List[str]:
+    refs = blob_refs(media)
+    if not refs:
+        return []
+    await _col().bulk_write(_ref_ops(refs, -1), ordered=False)
+    released = []
+    for digest in refs:
+        dead = await _col().find_one_and_delete(_dead_filter(digest))
+        if dead:
+            released.append(dead["url"])
+    return released
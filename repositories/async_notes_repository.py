@@ -0,0 +1,184 @@
+from datetime import datetime
+from typing import Dict, Any, List, Optional, AsyncIterator
+from pymongo import ReturnDocument
+from databases.mongodb_connect import get_async_db
+from utils_pagination import page_bounds
+from utils_search import search_terms
+from utils_versions import note_key, cached_version, store_version
+from utils_export import EXPORT_CHUNK
+from utils_history import utc
+from utils_retention import TOMBSTONES
+from repositories.notes_repository import _NO_HISTORY, _serialize, _decode_note, _decode_notes, _new_doc, _edit_ops, _page_query, _ranked, _legacy_history, _version_from, _needs_legacy, _targets, _plan_batch, _landed, _followups, _batch_media, _import_docs, _missed_deletes, _tombstone_ops, _as_of_queries, _as_of_rows, _as_of_items
+from repositories.history_repository import _append_ops, _append_many_ops, _flatten, _since_query, _after_query
+from repositories.counters_repository import async_note_ids
+from repositories.async_users_repository import bump_notes_version
+from repositories.async_media_repository import ref_media, deref_media
+from repositories.async_search_repository import index_note, unindex_note, index_changes, search_note_ids
+
+# Motor twin of notes_repository: same documents and semantics, awaited on the event loop
+
+def _col():
+    return get_async_db()["notes"]
+
+def _history_col():
+    return get_async_db()["note_history"]
+
+def _tombstones():
+    return get_async_db()["note_tombstones"]
+
+async def _get_histories(unique_ids: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+    if not unique_ids:
+        return {}
+    cur = _history_col().find({"uniqueID": {"$in": unique_ids}}).sort([("uniqueID", 1), ("bucket_seq", -1)])
+    return _flatten(await cur.to_list(length=None))
+
+async def add_note(owner_email: str, note_title: str, note_description: str, media: List[Dict[str, Any]] | None = None) -> Dict[str, Any]:
+    doc = _new_doc(await async_note_ids.next_id(), owner_email, note_title, note_description, media)
+    await _col().insert_one(doc)
+    await ref_media(doc["media"])
+    await index_note(doc["uniqueID"], owner_email, note_title, note_description)
+    await bump_notes_version(owner_email)
+    return _decode_note(_serialize(doc))
+
+async def find_note(unique_id: int) -> Optional[Dict[str, Any]]:
+    return await _col().find_one({"uniqueID": unique_id}, projection=_NO_HISTORY)
+
+async def get_note(current: Dict[str, Any], with_history: bool = False) -> Dict[str, Any]:
+    if not with_history:
+        return _decode_note(_serialize(current))
+    doc = await _col().find_one({"uniqueID": current["uniqueID"]}, projection={"batch_tags": 0}) or current
+    histories = await _get_histories([current["uniqueID"]])
+    return _decode_note(_serialize(doc), histories.get(current["uniqueID"], []))
+
+async def edit_note(current: Dict[str, Any], note_title: str, note_description: str) -> Optional[Dict[str, Any]]:
+    rev = current.get("rev")
+    if rev is None:
+        legacy = await _col().find_one({"uniqueID": current["uniqueID"]}, projection={"note_history": 1}) or {}
+        rev = len(legacy.get("note_history", []))
+    entry, flt, upd = _edit_ops(current, rev, note_title, note_description)
+    updated = await _col().find_one_and_update(flt, upd, return_document=ReturnDocument.AFTER)
+    if updated is None:
+        return None
+    bucket_flt, bucket_upd = _append_ops(current["uniqueID"], entry)
+    await _history_col().update_one(bucket_flt, bucket_upd, upsert=True)
+    await index_note(current["uniqueID"], current["owner_key"], note_title, note_description)
+    await bump_notes_version(current["owner_key"])
+    histories = await _get_histories([current["uniqueID"]])
+    return _decode_note(_serialize(updated), histories.get(current["uniqueID"], []))
+
+async def get_version(current: Dict[str, Any], rev: int) -> Optional[Dict[str, Any]]:
+    cur_rev, legacy = current.get("rev"), None
+    if cur_rev is None:
+        legacy = _legacy_history(await _col().find_one({"uniqueID": current["uniqueID"]}, projection={"note_history": 1}))
+        cur_rev = len(legacy)
+    if rev < 0 or rev > cur_rev:
+        return None
+    key = note_key(current["uniqueID"], current.get("note_created"), current.get("history_gen"))
+    hit = cached_version(key, rev)
+    if hit is not None:
+        return hit
+    bucketed = []
+    if rev != cur_rev:
+        buckets = await _history_col().find(_since_query(current["uniqueID"], rev)).sort("bucket_seq", -1).to_list(length=None)
+        bucketed = _flatten(buckets).get(current["uniqueID"], [])
+    if legacy is None and _needs_legacy(current, cur_rev, rev, bucketed):
+        legacy = _legacy_history(await _col().find_one({"uniqueID": current["uniqueID"]}, projection={"note_history": 1}))
+    found = _version_from(current, cur_rev, rev, bucketed, legacy)
+    return store_version(key, found) if found else None
+
+async def delete_note(unique_id: int) -> List[str]:
+    doc = await _col().find_one_and_delete({"uniqueID": unique_id}, projection=_NO_HISTORY if TOMBSTONES else {"media": 1, "owner_key": 1})
+    if not TOMBSTONES:
+        await _history_col().delete_many({"uniqueID": unique_id})
+    elif doc:
+        await _tombstones().bulk_write(_tombstone_ops([doc]))
+    await unindex_note(unique_id)
+    if not doc:
+        return []
+    await bump_notes_version(doc["owner_key"])
+    return await deref_media(doc.get("media", []))
+
+async def apply_batch(owner_email: str, ops: List[Dict[str, Any]]) -> Dict[str, Any]:
+    ids = _targets(ops)
+    docs = {d["uniqueID"]: d for d in await _col().find({"uniqueID": {"$in": ids}}, projection=_NO_HISTORY).to_list(length=None)} if ids else {}
+    legacy = [uid for uid, d in docs.items() if d.get("rev") is None]
+    legacy_revs = {}
+    if legacy:
+        cur = _col().find({"uniqueID": {"$in": legacy}}, projection={"uniqueID": 1, "note_history": 1})
+        legacy_revs = {d["uniqueID"]: len(_legacy_history(d)) for d in await cur.to_list(length=None)}
+    creates = sum(op["op"] == "create" for op in ops)
+    plan = _plan_batch(owner_email, ops, docs, legacy_revs, await async_note_ids.next_ids(creates) if creates else [])
+    if not plan["writes"]:
+        return {"results": plan["results"], "released": []}
+    res = await _col().bulk_write(plan["writes"], ordered=True)
+    if res.deleted_count < len(plan["deletes"]):
+        cur = _col().find({"uniqueID": {"$in": [uid for uid, _ in plan["deletes"]]}}, projection={"uniqueID": 1})
+        _missed_deletes(plan, [d["uniqueID"] for d in await cur.to_list(length=None)])
+    tags = None
+    if res.matched_count < len(plan["updates"]):
+        touched = list({u["uniqueID"] for u in plan["updates"]})
+        cur = _col().find({"uniqueID": {"$in": touched}}, projection={"uniqueID": 1, "batch_tags": 1})
+        tags = {d["uniqueID"]: d.get("batch_tags", []) for d in await cur.to_list(length=None)}
+    history, index, media, deleted = _followups(plan, _landed(plan, tags))
+    if history:
+        await _history_col().bulk_write(_append_many_ops(history), ordered=True)
+    if not TOMBSTONES and deleted:
+        await _history_col().delete_many({"uniqueID": {"$in": deleted}})
+    elif TOMBSTONES and plan["buried"]:
+        await _tombstones().bulk_write(_tombstone_ops(plan["buried"]))
+    await index_changes(index)
+    await ref_media(media)
+    await bump_notes_version(owner_email)
+    return {"results": plan["results"], "released": await deref_media(_batch_media(plan, res.deleted_count))}
+
+async def get_notes_page(owner_email: str, limit: Optional[int] = None, after: Optional[int] = None, before: Optional[int] = None, with_history: bool = False) -> Dict[str, Any]:
+    query, direction = _page_query(owner_email, after, before)
+    cur = _col().find(query, projection=None if with_history else _NO_HISTORY).sort("uniqueID", direction)
+    if limit is not None:
+        cur = cur.limit(limit + 1)
+    docs, next_id, prev_id = page_bounds(await cur.to_list(length=None), limit, after, before, key=lambda d: d["uniqueID"])
+    histories = await _get_histories([d["uniqueID"] for d in docs]) if with_history else None
+    return {"items": _decode_notes(docs, histories), "next_id": next_id, "prev_id": prev_id}
+
+async def get_notes_as_of(owner_email: str, as_of: datetime, limit: Optional[int] = None, after: Optional[int] = None, before: Optional[int] = None) -> Dict[str, Any]:
+    as_of = utc(as_of)
+    live_q, dead_q, direction = _as_of_queries(owner_email, as_of, after, before)
+    live, dead = _col().find(live_q, projection=_NO_HISTORY).sort("uniqueID", direction), _tombstones().find(dead_q).sort("uniqueID", direction)
+    if limit is not None:
+        live, dead = live.limit(limit + 1), dead.limit(limit + 1)
+    rows, next_id, prev_id = _as_of_rows(await live.to_list(length=None), await dead.to_list(length=None), limit, after, before)
+    histories = {}
+    if rows:
+        cur = _history_col().find(_after_query([d["uniqueID"] for d in rows], as_of)).sort([("uniqueID", 1), ("bucket_seq", -1)])
+        histories = _flatten(await cur.to_list(length=None))
+    return {"items": _as_of_items(rows, histories, as_of), "next_id": next_id, "prev_id": prev_id}
+
+async def search_notes(owner_email: str, q: str, limit: int, offset: int = 0) -> Dict[str, Any]:
+    terms = search_terms(q)
+    if not terms:
+        return {"items": [], "next_offset": None}
+    ids = await search_note_ids(owner_email, terms, limit + 1, offset)
+    more, ids = len(ids) > limit, ids[:limit]
+    docs = _ranked(await _col().find({"uniqueID": {"$in": ids}}, projection=_NO_HISTORY).to_list(length=None), ids) if ids else []
+    return {"items": _decode_notes(docs), "next_offset": offset + limit if more else None}
+
+async def iter_export(owner_email: str) -> AsyncIterator[List[Dict[str, Any]]]:
+    cur = _col().find({"owner_key": owner_email}, projection={"batch_tags": 0}, batch_size=EXPORT_CHUNK).sort("uniqueID", 1)
+    chunk: List[Dict[str, Any]] = []
+    async for doc in cur:
+        chunk.append(doc)
+        if len(chunk) == EXPORT_CHUNK:
+            yield _decode_notes(chunk, await _get_histories([d["uniqueID"] for d in chunk]))
+            chunk = []
+    if chunk:
+        yield _decode_notes(chunk, await _get_histories([d["uniqueID"] for d in chunk]))
+
+async def import_notes(owner_email: str, items: List[Dict[str, Any]]) -> int:
+    docs, history, index = _import_docs(owner_email, items, await async_note_ids.next_ids(len(items)))
+    await _col().insert_many(docs)
+    if history:
+        await _history_col().bulk_write(_append_many_ops(history), ordered=True)
+    await index_changes(index)
+    await ref_media([m for d in docs for m in d["media"]])
+    await bump_notes_version(owner_email)
+    return len(docs)
@@ -0,0 +1,21 @@
+from typing import Dict, List, Optional
+from databases.mongodb_connect import get_async_db
+from repositories.search_repository import _index_doc, _search_args, _change_ops
+
+def _col():
+    return get_async_db()["note_search"]
+
+async def index_note(unique_id: int, owner_email: str, note_title: str, note_description: str) -> None:
+    await _col().replace_one({"_id": unique_id}, _index_doc(unique_id, owner_email, note_title, note_description), upsert=True)
+
+async def unindex_note(unique_id: int) -> None:
+    await _col().delete_one({"_id": unique_id})
+
+async def index_changes(changes: Dict[int, Optional[tuple]]) -> None:
+    if changes:
+        await _col().bulk_write(_change_ops(changes), ordered=False)
+
+async def search_note_ids(owner_email: str, terms: List[str], limit: int, offset: int) -> List[int]:
+    flt, projection, sort = _search_args(owner_email, terms)
+    cur = _col().find(flt, projection).sort(sort).skip(offset).limit(limit)
+    return [d["_id"] for d in await cur.to_list(length=None)]
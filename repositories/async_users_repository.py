@@ -0,0 +1,33 @@
+from typing import Optional
+from databases.mongodb_connect import get_async_db
+from repositories import user_cache
+
+def users_col():
+    return get_async_db()["users"]
+
+async def find_user_by_email(email: str) -> Optional[dict]:
+    return await users_col().find_one({"email": email})
+
+async def find_user_identity(email: str) -> Optional[dict]:
+    ident = user_cache.get_identity(email)
+    if ident is None:
+        u = await users_col().find_one({"email": email}, projection={"_id": 1})
+        ident = user_cache.put_identity(email, str(u["_id"])) if u else None
+    return ident
+
+async def get_notes_version(email: str) -> Optional[int]:
+    u = await users_col().find_one({"email": email}, projection={"notes_version": 1})
+    return u.get("notes_version", 0) if u else None
+
+async def bump_notes_version(email: str) -> None:
+    await users_col().update_one({"email": email}, {"$inc": {"notes_version": 1}})
+
+async def create_user(email: str, hashed_password: str) -> dict:
+    doc = {"email": email, "hashed_password": hashed_password}
+    await users_col().insert_one(doc)
+    user_cache.invalidate(email)
+    doc.pop("_id", None)
+    return doc
+
+async def update_password_hash(email: str, hashed_password: str) -> None:
+    await users_col().update_one({"email": email}, {"$set": {"hashed_password": hashed_password}})
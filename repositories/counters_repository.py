@@ -0,0 +1,89 @@
+import os, asyncio, threading
+from typing import List
+from pymongo import ReturnDocument
+from pymongo.collection import Collection
+from databases.mongodb_connect import get_db, get_async_db
+
+# ids are reserved from the counters collection in blocks and handed out from memory, so an insert
+# needs no extra round trip; ids left unused when a process exits are simply skipped
+ID_BLOCK_SIZE = max(1, int(os.getenv("ID_BLOCK_SIZE", "1000")))
+
+def counters_col() -> Collection:
+    return get_db()["counters"]
+
+class BlockIdAllocator:
+    def __init__(self, name: str, source: str, field: str, block_size: int = ID_BLOCK_SIZE):
+        self.name, self.source, self.field, self.block_size = name, source, field, block_size
+        self._lock = threading.Lock()
+        self._pid = None
+        self._next = self._end = 0  # current block is [_next, _end)
+
+    def _seed(self) -> None:
+        # first use in this process: make sure the counter is past ids written before it existed
+        top = get_db()[self.source].find_one({}, sort=[(self.field, -1)], projection={self.field: 1})
+        counters_col().update_one({"_id": self.name}, {"$max": {"seq": (top or {}).get(self.field, 0)}}, upsert=True)
+
+    def _reserve(self, count: int) -> None:
+        doc = counters_col().find_one_and_update(
+            {"_id": self.name}, {"$inc": {"seq": count}}, upsert=True, return_document=ReturnDocument.AFTER
+        )
+        self._end = doc["seq"] + 1
+        self._next = self._end - count
+
+    def next_ids(self, n: int = 1) -> List[int]:
+        out: List[int] = []
+        with self._lock:
+            if self._pid != os.getpid():
+                # never share a block with a forked parent/sibling
+                self._seed()
+                self._pid, self._next, self._end = os.getpid(), 0, 0
+            while len(out) < n:
+                if self._next >= self._end:
+                    self._reserve(max(self.block_size, n - len(out)))
+                take = min(n - len(out), self._end - self._next)
+                out.extend(range(self._next, self._next + take))
+                self._next += take
+        return out
+
+    def next_id(self) -> int:
+        return self.next_ids(1)[0]
+
+class AsyncBlockIdAllocator(BlockIdAllocator):
+    # same block scheme over Motor; ids never overlap with a sync allocator on the same counter
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._alock = None
+
+    async def _aseed(self) -> None:
+        db = get_async_db()
+        top = await db[self.source].find_one({}, sort=[(self.field, -1)], projection={self.field: 1})
+        await db["counters"].update_one({"_id": self.name}, {"$max": {"seq": (top or {}).get(self.field, 0)}}, upsert=True)
+
+    async def _areserve(self, count: int) -> None:
+        doc = await get_async_db()["counters"].find_one_and_update(
+            {"_id": self.name}, {"$inc": {"seq": count}}, upsert=True, return_document=ReturnDocument.AFTER
+        )
+        self._end = doc["seq"] + 1
+        self._next = self._end - count
+
+    async def next_ids(self, n: int = 1) -> List[int]:
+        if self._alock is None:
+            self._alock = asyncio.Lock()
+        out: List[int] = []
+        async with self._alock:
+            if self._pid != os.getpid():
+                await self._aseed()
+                self._pid, self._next, self._end = os.getpid(), 0, 0
+            while len(out) < n:
+                if self._next >= self._end:
+                    await self._areserve(max(self.block_size, n - len(out)))
+                take = min(n - len(out), self._end - self._next)
+                out.extend(range(self._next, self._next + take))
+                self._next += take
+        return out
+
+    async def next_id(self) -> int:
+        return (await self.next_ids(1))[0]
+
+note_ids = BlockIdAllocator("notes", "notes", "uniqueID")
+async_note_ids = AsyncBlockIdAllocator("notes", "notes", "uniqueID")
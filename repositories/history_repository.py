@@ -0,0 +1,117 @@
+import os
+from datetime import datetime
+from typing import Dict, Any, List, Iterable, Set, Tuple
+from pymongo import UpdateOne
+from pymongo.collection import Collection
+from databases.mongodb_connect import get_db
+
+# revisions live outside the note document in fixed-size buckets keyed by (uniqueID, bucket_seq);
+# a revision's bucket is rev // HISTORY_BUCKET_SIZE, so appends never need to look the bucket up
+HISTORY_BUCKET_SIZE = max(1, int(os.getenv("HISTORY_BUCKET_SIZE", "50")))
+
+def history_col() -> Collection:
+    return get_db()["note_history"]
+
+def bucket_seq(rev: int) -> int:
+    return rev // HISTORY_BUCKET_SIZE
+
+def _append_ops(unique_id: int, entry: Dict[str, Any]) -> tuple:
+    # last_at (the newest archived_at in the bucket) lets point-in-time reads skip older buckets
+    rev = entry["rev"]
+    newest = {"last_rev": rev, "last_at": entry["archived_at"]} if entry.get("archived_at") else {"last_rev": rev}
+    return (
+        {"uniqueID": unique_id, "bucket_seq": bucket_seq(rev)},
+        {"$push": {"revisions": entry}, "$min": {"first_rev": rev}, "$max": newest},
+    )
+
+def append_revision(unique_id: int, entry: Dict[str, Any]) -> None:
+    flt, upd = _append_ops(unique_id, entry)
+    history_col().update_one(flt, upd, upsert=True)
+
+def _append_many_ops(items: List[Tuple[int, Dict[str, Any]]]) -> List[UpdateOne]:
+    # ordered, so several revisions of one note land in their bucket oldest first
+    return [UpdateOne(*_append_ops(unique_id, entry), upsert=True) for unique_id, entry in items]
+
+def append_revisions(items: List[Tuple[int, Dict[str, Any]]]) -> None:
+    if items:
+        history_col().bulk_write(_append_many_ops(items), ordered=True)
+
+def _flatten(buckets: Iterable[Dict[str, Any]]) -> Dict[int, List[Dict[str, Any]]]:
+    # buckets arrive newest first and hold their revisions oldest first
+    out: Dict[int, List[Dict[str, Any]]] = {}
+    for b in buckets:
+        out.setdefault(b["uniqueID"], []).extend(sorted(b.get("revisions", []), key=lambda e: e["rev"], reverse=True))
+    return out
+
+def get_history(unique_id: int) -> List[Dict[str, Any]]:
+    cur = history_col().find({"uniqueID": unique_id}).sort("bucket_seq", -1)
+    return _flatten(cur).get(unique_id, [])
+
+def _since_query(unique_id: int, rev: int) -> Dict[str, Any]:
+    # buckets holding rev and everything newer
+    return {"uniqueID": unique_id, "bucket_seq": {"$gte": bucket_seq(rev)}}
+
+def get_history_since(unique_id: int, rev: int) -> List[Dict[str, Any]]:
+    cur = history_col().find(_since_query(unique_id, rev)).sort("bucket_seq", -1)
+    return _flatten(cur).get(unique_id, [])
+
+def get_histories(unique_ids: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+    if not unique_ids:
+        return {}
+    cur = history_col().find({"uniqueID": {"$in": unique_ids}}).sort([("uniqueID", 1), ("bucket_seq", -1)])
+    return _flatten(cur)
+
+def _after_query(unique_ids: List[int], as_of: datetime) -> Dict[str, Any]:
+    # buckets holding anything archived after as_of; buckets from before last_at existed always match
+    return {"uniqueID": {"$in": unique_ids}, "$or": [{"last_at": {"$gt": as_of}}, {"last_at": {"$exists": False}}]}
+
+def get_histories_after(unique_ids: List[int], as_of: datetime) -> Dict[int, List[Dict[str, Any]]]:
+    if not unique_ids:
+        return {}
+    cur = history_col().find(_after_query(unique_ids, as_of)).sort([("uniqueID", 1), ("bucket_seq", -1)])
+    return _flatten(cur)
+
+def delete_history(unique_id: int) -> None:
+    history_col().delete_many({"uniqueID": unique_id})
+
+def delete_histories(unique_ids: List[int]) -> None:
+    if unique_ids:
+        history_col().delete_many({"uniqueID": {"$in": unique_ids}})
+
+def get_buckets(unique_ids: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+    # the bucket documents themselves, newest first, for rewrite_buckets
+    out: Dict[int, List[Dict[str, Any]]] = {}
+    for b in history_col().find({"uniqueID": {"$in": unique_ids}}).sort([("uniqueID", 1), ("bucket_seq", -1)]):
+        out.setdefault(b["uniqueID"], []).append(b)
+    return out
+
+def bucket_heads(revs: List[int]) -> Set[int]:
+    # the newest rev of each bucket; stored in full, a bucket no longer depends on the one above it
+    heads: Dict[int, int] = {}
+    for rev in revs:
+        heads[bucket_seq(rev)] = max(rev, heads.get(bucket_seq(rev), rev))
+    return set(heads.values())
+
+def rewrite_buckets(buckets: List[Dict[str, Any]], entries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # replaces each bucket read earlier with its share of `entries` (a note's whole re-encoded chain,
+    # bucket heads in full), or removes it when nothing is left. Each bucket is a compare-and-set on
+    # last_rev (moved by appends) and gen (moved by rewrites); a bucket that changed meanwhile keeps
+    # its old entries, which stay valid because the bucket below starts from a keyframe.
+    # Returns the buckets that were rewritten.
+    share: Dict[int, List[Dict[str, Any]]] = {}
+    for e in entries:
+        share.setdefault(bucket_seq(e["rev"]), []).append(e)
+    done = []
+    for b in buckets:
+        flt = {"_id": b["_id"], "last_rev": b.get("last_rev"), "gen": b.get("gen")}
+        revs = share.get(b["bucket_seq"], [])
+        if revs:
+            upd = {"$set": {"revisions": revs[::-1], "first_rev": revs[-1]["rev"], "last_rev": revs[0]["rev"]}, "$inc": {"gen": 1}}
+            if revs[0].get("archived_at"):
+                upd["$set"]["last_at"] = revs[0]["archived_at"]
+            hit = history_col().update_one(flt, upd).matched_count
+        else:
+            hit = history_col().delete_one(flt).deleted_count
+        if hit:
+            done.append(b)
+    return done
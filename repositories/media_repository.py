@@ -0,0 +1,53 @@
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Iterable
+from pymongo import UpdateOne
+from pymongo.collection import Collection
+from databases.mongodb_connect import get_db
+from utils_media import blob_refs, hold_until
+
+# reference counts for content-addressed uploads (MEDIA_STORAGE=cas), one document per sha256:
+# {_id: digest, url, refs, hold_until}; a blob is dropped when the last note pointing at it is
+# deleted, unless an upload of the same bytes still holds it
+
+def blobs_col() -> Collection:
+    return get_db()["media_blobs"]
+
+def _ref_ops(refs: Dict[str, tuple], sign: int) -> List[UpdateOne]:
+    return [
+        UpdateOne({"_id": digest}, {"$inc": {"refs": sign * n}, "$setOnInsert": {"url": url}}, upsert=sign > 0)
+        for digest, (url, n) in refs.items()
+    ]
+
+def _dead_filter(digest: str) -> Dict[str, Any]:
+    return {"_id": digest, "refs": {"$lte": 0}, "hold_until": {"$not": {"$gt": datetime.now(timezone.utc)}}}
+
+def hold_blob(digest: str, url: str) -> None:
+    blobs_col().update_one({"_id": digest}, {"$max": {"hold_until": hold_until()}, "$setOnInsert": {"url": url, "refs": 0}}, upsert=True)
+
+def blob_in_use(digest: str) -> bool:
+    return blobs_col().count_documents({"_id": digest}, limit=1) > 0
+
+def purge_blobs() -> List[str]:
+    # blobs a delete released while an upload still held them, now that the hold has run out
+    released = []
+    while (dead := blobs_col().find_one_and_delete({"refs": {"$lte": 0}, "hold_until": {"$lte": datetime.now(timezone.utc)}})):
+        released.append(dead["url"])
+    return released
+
+def ref_media(media: Iterable[Dict[str, Any]]) -> None:
+    ops = _ref_ops(blob_refs(media), 1)
+    if ops:
+        blobs_col().bulk_write(ops, ordered=False)
+
+def deref_media(media: Iterable[Dict[str, Any]]) -> List[str]:
+    # returns the urls of blobs nothing points at anymore
+    refs = blob_refs(media)
+    if not refs:
+        return []
+    blobs_col().bulk_write(_ref_ops(refs, -1), ordered=False)
+    released = []
+    for digest in refs:
+        dead = blobs_col().find_one_and_delete(_dead_filter(digest))
+        if dead:
+            released.append(dead["url"])
+    return released
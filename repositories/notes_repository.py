@@ -1,49 +1,458 @@
+import uuid
 from datetime import timezone, datetime
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, Iterator
+from pymongo import ReturnDocument, InsertOne, UpdateOne, DeleteOne
 from pymongo.collection import Collection
 from databases.mongodb_connect import get_db
-from utils_b64 import b64e, b64d
+from utils_codec import encode, decode, decode_many
+from utils_history import encode_revision, materialize, reconstruct, number_revisions, version_at, utc
+from utils_versions import note_key, cached_version, store_version, make_version, forget_versions
+from utils_pagination import page_bounds
+from utils_search import search_terms
+from utils_batch import batch_result, NOT_FOUND, NOT_ALLOWED, CONFLICT, STALE
+from utils_export import EXPORT_CHUNK, import_history
+from utils_retention import RETENTION_TIERS, TOMBSTONES, compact_entries, entry_bytes, new_report
+from repositories.history_repository import bucket_seq, append_revision, append_revisions, get_history, get_history_since, get_histories, delete_history, delete_histories, get_buckets, bucket_heads, rewrite_buckets, get_histories_after
+from repositories.counters_repository import note_ids
+from repositories.users_repository import bump_notes_version
+from repositories.media_repository import ref_media, deref_media
+from repositories.search_repository import index_note, unindex_note, index_changes, search_note_ids
+
+# the legacy embedded history array is only read when history is asked for
+_NO_HISTORY = {"note_history": 0, "batch_tags": 0}
+
+# a batch update also pushes a random tag onto the note, atomically with its rev compare-and-set,
+# keeping the last _BATCH_TAGS; they are only read back when a bulk reports fewer matches than
+# updates, to tell which ones landed
+_BATCH_TAGS = 16
 
 def _col() -> Collection:
     return get_db()["notes"]
 
+def _tombstones() -> Collection:
+    return get_db()["note_tombstones"]
+
 def _serialize(doc: Dict[str, Any]) -> Dict[str, Any]:
     d = dict(doc); d.pop("_id", None); return d
 
-def _next_unique_id() -> int:
-    top = _col().find_one({}, sort=[("uniqueID", -1)], projection={"uniqueID": 1})
-    return (top["uniqueID"] + 1) if top and "uniqueID" in top else 1
-
-def _decode_note(doc: Dict[str, Any]) -> Dict[str, Any]:
+def _decode_note(doc: Dict[str, Any], history: List[Dict[str, Any]] | None = None, texts: tuple | None = None) -> Dict[str, Any]:
+    # texts: (title, description) already decoded by _decode_notes
     doc = dict(doc)
-    doc["note_title"] = b64d(doc.get("note_title"))
-    doc["note_description"] = b64d(doc.get("note_description"))
-    doc["note_history"] = [
-        {
-            "note_title": b64d(h.get("note_title","")),
-            "note_description": b64d(h.get("note_description","")),
-            "archived_at": h.get("archived_at")
-        }
-        for h in doc.get("note_history", [])
-    ]
+    uid = doc.get("uniqueID")
+    doc["note_title"], doc["note_description"] = texts or (decode(doc.get("note_title"), uid), decode(doc.get("note_description"), uid))
+    if history is None:
+        doc["note_history"] = []
+    else:
+        # bucketed revisions are always newer than anything still embedded from before the move
+        entries = history + doc.get("note_history", [])
+        doc["note_history"] = materialize(doc["note_title"], doc["note_description"], entries, doc.get("rev"))
     doc["media"] = doc.get("media", [])
     return doc
 
-# === public: only two functions ===
+def _decode_notes(docs: List[Dict[str, Any]], histories: Dict[int, List[Dict[str, Any]]] | None = None) -> List[Dict[str, Any]]:
+    texts = decode_many((v for d in docs for v in (d.get("note_title"), d.get("note_description"))), (d["uniqueID"] for d in docs for _ in range(2)))
+    return [
+        _decode_note(_serialize(d), None if histories is None else histories.get(d["uniqueID"], []), (texts[2 * i], texts[2 * i + 1]))
+        for i, d in enumerate(docs)
+    ]
 
-def add_note(owner_email: str, note_title: str, note_description: str, media: List[Dict[str, Any]] | None = None) -> Dict[str, Any]:
-    doc = {
-        "uniqueID": _next_unique_id(),
-        "note_title": b64e(note_title),
-        "note_description": b64e(note_description),
+def _new_doc(unique_id: int, owner_email: str, note_title: str, note_description: str, media: List[Dict[str, Any]] | None) -> Dict[str, Any]:
+    return {
+        "uniqueID": unique_id,
+        "note_title": encode(note_title),
+        "note_description": encode(note_description),
         "note_created": datetime.now(timezone.utc),
         "owner_key": owner_email,
-        "note_history": [],
         "media": media or [],
+        "rev": 0,
     }
+
+def _edit_ops(current: Dict[str, Any], rev: int, note_title: str, note_description: str) -> tuple:
+    # compare-and-set on rev so the delta is always taken against the version actually replaced
+    uid = current["uniqueID"]
+    entry = encode_revision(rev, decode(current.get("note_title"), uid), decode(current.get("note_description"), uid), note_title, note_description)
+    entry["archived_at"] = datetime.now(timezone.utc)
+    flt = {"uniqueID": uid, "rev": current.get("rev")}
+    upd = {"$set": {"note_title": encode(note_title), "note_description": encode(note_description), "rev": rev + 1}}
+    return entry, flt, upd
+
+def _legacy_history(doc: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return (doc or {}).get("note_history", [])
+
+def _version_from(current: Dict[str, Any], cur_rev: int, rev: int, bucketed: List[Dict[str, Any]], legacy: Optional[List[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+    # bucketed: entries from rev's bucket upwards; legacy: the embedded array, when it was needed
+    uid = current["uniqueID"]
+    title, description = decode(current.get("note_title"), uid), decode(current.get("note_description"), uid)
+    if rev == cur_rev:
+        return make_version(rev, title, description)
+    # an edit that lands between reading the note and its buckets must not be applied to it
+    entries = [e for e in bucketed if e["rev"] < cur_rev] + (legacy or [])
+    found = reconstruct(title, description, entries, rev, cur_rev)
+    return make_version(rev, *found) if found else None
+
+def _needs_legacy(current: Dict[str, Any], cur_rev: int, rev: int, bucketed: List[Dict[str, Any]]) -> bool:
+    return rev != cur_rev and rev not in number_revisions([e for e in bucketed if e["rev"] < cur_rev], cur_rev)
+
+def _targets(ops: List[Dict[str, Any]]) -> List[int]:
+    return list({op["uniqueID"] for op in ops if op["op"] != "create"})
+
+def _plan_batch(owner_email: str, ops: List[Dict[str, Any]], docs: Dict[int, Dict[str, Any]], legacy_revs: Dict[int, int], new_ids: List[int]) -> Dict[str, Any]:
+    # ops run in order against the state the batch itself produces, so consecutive updates of a
+    # note chain their compare-and-sets and anything after a delete of that note is a 404
+    plan: Dict[str, Any] = {"owner": owner_email, "writes": [], "results": [], "creates": [], "updates": [], "deletes": [], "buried": []}
+    state: Dict[int, Optional[Dict[str, Any]]] = {}
+    ids = iter(new_ids)
+    for i, op in enumerate(ops):
+        kind, uid = op["op"], op.get("uniqueID")
+        if kind == "create":
+            doc = _new_doc(next(ids), owner_email, op["note_title"], op["note_description"], op.get("media"))
+            plan["writes"].append(InsertOne(doc))
+            plan["creates"].append((doc, op))
+            plan["results"].append(batch_result(i, kind, 201, doc["uniqueID"], 0))
+            continue
+        cur = state[uid] if uid in state else docs.get(uid)
+        rev = None if cur is None else cur.get("rev")
+        if cur is not None and rev is None:
+            rev = legacy_revs.get(uid, 0)
+        if cur is None:
+            plan["results"].append(batch_result(i, kind, 404, uid, detail=NOT_FOUND))
+        elif cur.get("owner_key") != owner_email:
+            plan["results"].append(batch_result(i, kind, 403, uid, detail=NOT_ALLOWED))
+        elif op.get("rev") is not None and op["rev"] != rev:
+            plan["results"].append(batch_result(i, kind, 412, uid, rev, detail=STALE))
+        elif kind == "delete":
+            # a compare-and-set like updates, so the tombstone holds exactly the version deleted
+            state[uid] = None
+            plan["writes"].append(DeleteOne({"uniqueID": uid, "rev": cur.get("rev")}))
+            plan["deletes"].append((uid, cur.get("media", [])))
+            plan["buried"].append(cur)
+            plan["results"].append(batch_result(i, kind, 204, uid))
+        else:
+            entry, flt, upd = _edit_ops(cur, rev, op["note_title"], op["note_description"])
+            tag = uuid.uuid4().hex
+            upd["$push"] = {"batch_tags": {"$each": [tag], "$slice": -_BATCH_TAGS}}
+            plan["writes"].append(UpdateOne(flt, upd))
+            state[uid] = dict(cur, **upd["$set"])
+            plan["updates"].append({"index": i, "uniqueID": uid, "tag": tag, "entry": entry, "op": op})
+            plan["results"].append(batch_result(i, kind, 200, uid, rev + 1))
+    return plan
+
+def _missed_deletes(plan: Dict[str, Any], survivors: List[int]) -> None:
+    # deletes whose compare-and-set missed (the note was edited meanwhile) become 409s
+    alive = set(survivors)
+    for i, r in enumerate(plan["results"]):
+        if r["op"] == "delete" and r["status"] == 204 and r["uniqueID"] in alive:
+            plan["results"][i] = batch_result(i, "delete", 409, r["uniqueID"], detail=CONFLICT)
+    plan["deletes"] = [d for d in plan["deletes"] if d[0] not in alive]
+    plan["buried"] = [d for d in plan["buried"] if d["uniqueID"] not in alive]
+
+def _tombstone_ops(docs: List[Dict[str, Any]]) -> List[UpdateOne]:
+    # upserts keyed by uniqueID (ids are never reused here): a second delete of the same version
+    # finds the tombstone there already. The note's history buckets stay until the tombstone is purged.
+    now = datetime.now(timezone.utc)
+    return [
+        UpdateOne({"uniqueID": d["uniqueID"]}, {"$setOnInsert": {
+            "uniqueID": d["uniqueID"], "owner_key": d.get("owner_key"), "note_title": d.get("note_title"), "note_description": d.get("note_description"),
+            "note_created": d.get("note_created"), "rev": d.get("rev"), "deleted_at": now,
+        }}, upsert=True)
+        for d in docs
+    ]
+
+def _landed(plan: Dict[str, Any], tags: Optional[Dict[int, List[str]]]) -> List[Dict[str, Any]]:
+    # the updates whose compare-and-set matched; tags is None when all of them did. Within a note
+    # each update needs the one before it, so the newest tag still on the document ends the chain.
+    if tags is None:
+        return plan["updates"]
+    deleted = {uid for uid, _ in plan["deletes"]}
+    chains: Dict[int, List[Dict[str, Any]]] = {}
+    for u in plan["updates"]:
+        chains.setdefault(u["uniqueID"], []).append(u)
+    landed: List[Dict[str, Any]] = []
+    for uid, chain in chains.items():
+        if uid in deleted:
+            continue  # the batch deleted it afterwards; its history goes with it either way
+        on_doc = tags.get(uid, [])
+        last = max((j for j, u in enumerate(chain) if u["tag"] in on_doc), default=-1)
+        landed.extend(chain[:last + 1])
+        for u in chain[last + 1:]:
+            plan["results"][u["index"]] = batch_result(u["index"], "update", 409, uid, detail=CONFLICT)
+    return landed
+
+def _followups(plan: Dict[str, Any], landed: List[Dict[str, Any]]) -> tuple:
+    # (history appends, search index changes, media to reference, deleted ids) for the side collections
+    deleted = [uid for uid, _ in plan["deletes"]]
+    gone = set(deleted)
+    history = [(u["uniqueID"], u["entry"]) for u in landed if u["uniqueID"] not in gone]
+    index: Dict[int, Optional[tuple]] = {}
+    for doc, op in plan["creates"]:
+        index[doc["uniqueID"]] = (plan["owner"], op["note_title"], op["note_description"])
+    for u in landed:
+        if u["uniqueID"] not in gone:
+            index[u["uniqueID"]] = (plan["owner"], u["op"]["note_title"], u["op"]["note_description"])
+    index.update((uid, None) for uid in deleted)
+    media = [m for doc, _ in plan["creates"] for m in doc["media"]]
+    return history, index, media, deleted
+
+def _batch_media(plan: Dict[str, Any], deleted_count: int) -> List[Dict[str, Any]]:
+    # media whose references the batch's deletes release; if a note was already deleted by someone
+    # else we can't tell which one, and leave every blob referenced rather than free one in use
+    return [m for _, media in plan["deletes"] for m in media] if deleted_count == len(plan["deletes"]) else []
+
+def _import_docs(owner_email: str, items: List[Dict[str, Any]], ids: List[int]) -> tuple:
+    # (note documents, history appends oldest first, search index changes) for one import batch
+    docs, history, index = [], [], {}
+    for uid, item in zip(ids, items):
+        title, description = item["note_title"], item["note_description"]
+        rev, entries = import_history(title, description, item.get("note_history") or [])
+        doc = _new_doc(uid, owner_email, title, description, item.get("media"))
+        doc["rev"] = rev
+        if item.get("note_created"):
+            doc["note_created"] = item["note_created"]
+        docs.append(doc)
+        history.extend((uid, e) for e in reversed(entries))
+        index[uid] = (owner_email, title, description)
+    return docs, history, index
+
+def _page_query(owner_email: str, after: Optional[int], before: Optional[int]) -> tuple:
+    # keyset scan on the (owner_key, uniqueID) index; callers fetch one extra row to detect more pages
+    query: Dict[str, Any] = {"owner_key": owner_email}
+    bounds: Dict[str, int] = {}
+    if after is not None:
+        bounds["$gt"] = after
+    if before is not None:
+        bounds["$lt"] = before
+    if bounds:
+        query["uniqueID"] = bounds
+    return query, (-1 if before is not None else 1)
+
+def _as_of_queries(owner_email: str, as_of: datetime, after: Optional[int], before: Optional[int]) -> tuple:
+    # (notes query, tombstones query, sort direction): notes created by as_of, and tombstones of
+    # notes created by then and deleted after it
+    query, direction = _page_query(owner_email, after, before)
+    live = dict(query, note_created={"$lte": as_of})
+    return live, dict(live, deleted_at={"$gt": as_of}), direction
+
+def _as_of_rows(live: List[Dict[str, Any]], dead: List[Dict[str, Any]], limit: Optional[int], after: Optional[int], before: Optional[int]) -> tuple:
+    rows = sorted(live + dead, key=lambda d: d["uniqueID"], reverse=before is not None)
+    return page_bounds(rows[:limit + 1] if limit is not None else rows, limit, after, before, key=lambda d: d["uniqueID"])
+
+def _as_of_items(rows: List[Dict[str, Any]], histories: Dict[int, List[Dict[str, Any]]], as_of: datetime) -> List[Dict[str, Any]]:
+    # live notes carry today's media; tombstones have none (their blobs were released)
+    texts = decode_many((v for d in rows for v in (d.get("note_title"), d.get("note_description"))), (d["uniqueID"] for d in rows for _ in range(2)))
+    items = []
+    for i, d in enumerate(rows):
+        rev, title, description = version_at(texts[2 * i], texts[2 * i + 1], histories.get(d["uniqueID"], []), d.get("rev"), as_of)
+        items.append({"uniqueID": d["uniqueID"], "note_title": title, "note_description": description, "note_created": d.get("note_created"),
+                      "rev": rev, "owner_key": d.get("owner_key"), "note_history": [], "media": d.get("media", []), "deleted_at": d.get("deleted_at")})
+    return items
+
+# === public ===
+
+def add_note(owner_email: str, note_title: str, note_description: str, media: List[Dict[str, Any]] | None = None) -> Dict[str, Any]:
+    doc = _new_doc(note_ids.next_id(), owner_email, note_title, note_description, media)
     _col().insert_one(doc)
+    ref_media(doc["media"])
+    index_note(doc["uniqueID"], owner_email, note_title, note_description)
+    bump_notes_version(owner_email)
     return _decode_note(_serialize(doc))
 
+def find_note(unique_id: int) -> Optional[Dict[str, Any]]:
+    return _col().find_one({"uniqueID": unique_id}, projection=_NO_HISTORY)
+
+def get_note(current: Dict[str, Any], with_history: bool = False) -> Dict[str, Any]:
+    if not with_history:
+        return _decode_note(_serialize(current))
+    doc = _col().find_one({"uniqueID": current["uniqueID"]}, projection={"batch_tags": 0}) or current
+    return _decode_note(_serialize(doc), get_history(current["uniqueID"]))
+
+def edit_note(current: Dict[str, Any], note_title: str, note_description: str) -> Optional[Dict[str, Any]]:
+    # None means someone else edited the note first
+    rev = current.get("rev")
+    if rev is None:
+        # not moved to buckets yet: numbering continues after the embedded array
+        legacy = _col().find_one({"uniqueID": current["uniqueID"]}, projection={"note_history": 1}) or {}
+        rev = len(legacy.get("note_history", []))
+    entry, flt, upd = _edit_ops(current, rev, note_title, note_description)
+    updated = _col().find_one_and_update(flt, upd, return_document=ReturnDocument.AFTER)
+    if updated is None:
+        return None
+    append_revision(current["uniqueID"], entry)
+    index_note(current["uniqueID"], current["owner_key"], note_title, note_description)
+    bump_notes_version(current["owner_key"])
+    return _decode_note(_serialize(updated), get_history(current["uniqueID"]))
+
+def get_version(current: Dict[str, Any], rev: int) -> Optional[Dict[str, Any]]:
+    # None when the note never had that revision
+    cur_rev, legacy = current.get("rev"), None
+    if cur_rev is None:
+        legacy = _legacy_history(_col().find_one({"uniqueID": current["uniqueID"]}, projection={"note_history": 1}))
+        cur_rev = len(legacy)
+    if rev < 0 or rev > cur_rev:
+        return None
+    key = note_key(current["uniqueID"], current.get("note_created"), current.get("history_gen"))
+    hit = cached_version(key, rev)
+    if hit is not None:
+        return hit
+    bucketed = get_history_since(current["uniqueID"], rev) if rev != cur_rev else []
+    if legacy is None and _needs_legacy(current, cur_rev, rev, bucketed):
+        legacy = _legacy_history(_col().find_one({"uniqueID": current["uniqueID"]}, projection={"note_history": 1}))
+    found = _version_from(current, cur_rev, rev, bucketed, legacy)
+    return store_version(key, found) if found else None
+
+def delete_note(unique_id: int) -> List[str]:
+    # returns the urls of media blobs that lost their last reference
+    doc = _col().find_one_and_delete({"uniqueID": unique_id}, projection=_NO_HISTORY if TOMBSTONES else {"media": 1, "owner_key": 1})
+    if not TOMBSTONES:
+        delete_history(unique_id)
+    elif doc:
+        _tombstones().bulk_write(_tombstone_ops([doc]))
+    unindex_note(unique_id)
+    if not doc:
+        return []
+    bump_notes_version(doc["owner_key"])
+    return deref_media(doc.get("media", []))
+
+def apply_batch(owner_email: str, ops: List[Dict[str, Any]]) -> Dict[str, Any]:
+    # every note write is one ordered bulk_write; history buckets, search index and media refs
+    # follow with one bulk each. Returns {"results": per-op results, "released": blob urls}
+    ids = _targets(ops)
+    docs = {d["uniqueID"]: d for d in _col().find({"uniqueID": {"$in": ids}}, projection=_NO_HISTORY)} if ids else {}
+    legacy = [uid for uid, d in docs.items() if d.get("rev") is None]
+    legacy_revs = {d["uniqueID"]: len(_legacy_history(d)) for d in _col().find({"uniqueID": {"$in": legacy}}, projection={"uniqueID": 1, "note_history": 1})} if legacy else {}
+    creates = sum(op["op"] == "create" for op in ops)
+    plan = _plan_batch(owner_email, ops, docs, legacy_revs, note_ids.next_ids(creates) if creates else [])
+    if not plan["writes"]:
+        return {"results": plan["results"], "released": []}
+    res = _col().bulk_write(plan["writes"], ordered=True)
+    if res.deleted_count < len(plan["deletes"]):
+        _missed_deletes(plan, [d["uniqueID"] for d in _col().find({"uniqueID": {"$in": [uid for uid, _ in plan["deletes"]]}}, projection={"uniqueID": 1})])
+    tags = None
+    if res.matched_count < len(plan["updates"]):
+        touched = list({u["uniqueID"] for u in plan["updates"]})
+        tags = {d["uniqueID"]: d.get("batch_tags", []) for d in _col().find({"uniqueID": {"$in": touched}}, projection={"uniqueID": 1, "batch_tags": 1})}
+    history, index, media, deleted = _followups(plan, _landed(plan, tags))
+    append_revisions(history)
+    if not TOMBSTONES:
+        delete_histories(deleted)
+    elif plan["buried"]:
+        _tombstones().bulk_write(_tombstone_ops(plan["buried"]))
+    index_changes(index)
+    ref_media(media)
+    bump_notes_version(owner_email)
+    return {"results": plan["results"], "released": deref_media(_batch_media(plan, res.deleted_count))}
+
+def get_notes_page(owner_email: str, limit: Optional[int] = None, after: Optional[int] = None, before: Optional[int] = None, with_history: bool = False) -> Dict[str, Any]:
+    query, direction = _page_query(owner_email, after, before)
+    cur = _col().find(query, projection=None if with_history else _NO_HISTORY).sort("uniqueID", direction)
+    if limit is not None:
+        cur = cur.limit(limit + 1)
+    docs, next_id, prev_id = page_bounds(list(cur), limit, after, before, key=lambda d: d["uniqueID"])
+    histories = get_histories([d["uniqueID"] for d in docs]) if with_history else None
+    return {"items": _decode_notes(docs, histories), "next_id": next_id, "prev_id": prev_id}
+
+def get_notes_as_of(owner_email: str, as_of: datetime, limit: Optional[int] = None, after: Optional[int] = None, before: Optional[int] = None) -> Dict[str, Any]:
+    # the owner's notes as they were at as_of, paged like get_notes_page. One bucket query per page
+    # on (uniqueID, last_at) reads only buckets touched after as_of, so a note costs the edits made
+    # since, not its whole history. History still embedded from before buckets is not consulted.
+    as_of = utc(as_of)
+    live_q, dead_q, direction = _as_of_queries(owner_email, as_of, after, before)
+    live, dead = _col().find(live_q, projection=_NO_HISTORY).sort("uniqueID", direction), _tombstones().find(dead_q).sort("uniqueID", direction)
+    if limit is not None:
+        live, dead = live.limit(limit + 1), dead.limit(limit + 1)
+    rows, next_id, prev_id = _as_of_rows(list(live), list(dead), limit, after, before)
+    histories = get_histories_after([d["uniqueID"] for d in rows], as_of)
+    return {"items": _as_of_items(rows, histories, as_of), "next_id": next_id, "prev_id": prev_id}
+
+def purge_tombstones(cutoff: float) -> int:
+    # tombstones of notes deleted before cutoff (epoch seconds), with the history they kept alive;
+    # their owners' as_of lists change, so each owner's notes_version moves too
+    dead = list(_tombstones().find({"deleted_at": {"$lt": datetime.fromtimestamp(cutoff, timezone.utc)}}, projection={"uniqueID": 1, "owner_key": 1}))
+    if dead:
+        ids = [d["uniqueID"] for d in dead]
+        delete_histories(ids)
+        _tombstones().delete_many({"uniqueID": {"$in": ids}})
+        for owner in {d.get("owner_key") for d in dead}:
+            bump_notes_version(owner)
+    return len(dead)
+
+def _export_chunk(docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return _decode_notes(docs, get_histories([d["uniqueID"] for d in docs]))
+
+def iter_export(owner_email: str) -> Iterator[List[Dict[str, Any]]]:
+    # one server-side cursor over the owner's notes, decoded EXPORT_CHUNK at a time with one
+    # history query per chunk; embedded legacy history comes along in the documents
+    cur = _col().find({"owner_key": owner_email}, projection={"batch_tags": 0}, batch_size=EXPORT_CHUNK).sort("uniqueID", 1)
+    chunk: List[Dict[str, Any]] = []
+    for doc in cur:
+        chunk.append(doc)
+        if len(chunk) == EXPORT_CHUNK:
+            yield _export_chunk(chunk)
+            chunk = []
+    if chunk:
+        yield _export_chunk(chunk)
+
+def import_notes(owner_email: str, items: List[Dict[str, Any]]) -> int:
+    docs, history, index = _import_docs(owner_email, items, note_ids.next_ids(len(items)))
+    _col().insert_many(docs)
+    append_revisions(history)
+    index_changes(index)
+    ref_media([m for d in docs for m in d["media"]])
+    bump_notes_version(owner_email)
+    return len(docs)
+
+def _ranked(docs: List[Dict[str, Any]], ids: List[int]) -> List[Dict[str, Any]]:
+    by_id = {d["uniqueID"]: d for d in docs}
+    return [by_id[i] for i in ids if i in by_id]
+
+def search_notes(owner_email: str, q: str, limit: int, offset: int = 0) -> Dict[str, Any]:
+    terms = search_terms(q)
+    if not terms:
+        return {"items": [], "next_offset": None}
+    ids = search_note_ids(owner_email, terms, limit + 1, offset)
+    more, ids = len(ids) > limit, ids[:limit]
+    docs = _ranked(list(_col().find({"uniqueID": {"$in": ids}}, projection=_NO_HISTORY)), ids) if ids else []
+    return {"items": _decode_notes(docs), "next_offset": offset + limit if more else None}
+
 def get_all_notes(owner_email: str) -> List[Dict[str, Any]]:
-    docs = list(_col().find({"owner_key": owner_email}).sort("uniqueID", 1))
-    return [_decode_note(_serialize(d)) for d in docs]
+    return get_notes_page(owner_email)["items"]
+
+def compact_history(after: int, limit: int, now: float, dry_run: bool = False, tiers=RETENTION_TIERS) -> Optional[tuple]:
+    # applies the retention policy to the next `limit` notes above uniqueID `after`; see
+    # rewrite_buckets for how a rewrite races with edits. Notes still holding an embedded history
+    # array are skipped until MigrateHistoryToBuckets_mongo has moved it.
+    # Returns (last uniqueID, report) or None when no notes are left.
+    docs = list(_col().find({"uniqueID": {"$gt": after}}, {"batch_tags": 0, "media": 0}).sort("uniqueID", 1).limit(limit))
+    if not docs:
+        return None
+    buckets = get_buckets([d["uniqueID"] for d in docs])
+    texts = decode_many((v for d in docs for v in (d.get("note_title"), d.get("note_description"))), (d["uniqueID"] for d in docs for _ in range(2)))
+    report = new_report()
+    report["notes"] = len(docs)
+    for i, d in enumerate(docs):
+        bs = buckets.get(d["uniqueID"])
+        if not bs or d.get("note_history"):
+            continue
+        old = [e for b in bs for e in sorted(b.get("revisions", []), key=lambda e: e["rev"], reverse=True)]
+        plan = compact_entries(texts[2 * i], texts[2 * i + 1], old, d.get("rev"), now, tiers, heads=bucket_heads)
+        if plan is None:
+            continue
+        entries, dropped = plan
+        if dry_run:
+            done, kept = bs, entries
+        else:
+            done = rewrite_buckets(bs, entries)
+            if len(done) < len(bs):
+                report["conflicts"] += 1
+            if not done:
+                continue
+            # after the rewrite: a reader that saw the old history_gen keeps that key, not this one
+            _col().update_one({"uniqueID": d["uniqueID"]}, {"$inc": {"history_gen": 1}})
+            bump_notes_version(d.get("owner_key"))
+            forget_versions(note_key(d["uniqueID"], d.get("note_created"), d.get("history_gen")), dropped)
+            seqs = {b["bucket_seq"] for b in done}
+            kept = [e for e in entries if bucket_seq(e["rev"]) in seqs]
+        before = [e for b in done for e in b.get("revisions", [])]
+        report["compacted"] += 1
+        report["revisions"] += len(before) - len(kept)
+        report["bytes"] += entry_bytes(before) - entry_bytes(kept)
+    return docs[-1]["uniqueID"], report
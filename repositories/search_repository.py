@@ -0,0 +1,40 @@
+from typing import Dict, Any, List, Optional
+from pymongo import DeleteOne, ReplaceOne
+from pymongo.collection import Collection
+from databases.mongodb_connect import get_db
+from utils_search import mongo_text_query
+
+# note_search is a side collection with the decoded text of every note, {_id: uniqueID, owner_key,
+# note_title, note_description}, under a text index (see get_db). notes_repository keeps it in
+# step on add/edit/delete; Scripts/RebuildSearchIndex_mongo.py fills it from existing notes.
+
+def search_col() -> Collection:
+    return get_db()["note_search"]
+
+def _index_doc(unique_id: int, owner_email: str, note_title: str, note_description: str) -> Dict[str, Any]:
+    return {"_id": unique_id, "owner_key": owner_email, "note_title": note_title, "note_description": note_description}
+
+def _search_args(owner_email: str, terms: List[str]) -> tuple:
+    score = {"score": {"$meta": "textScore"}}
+    return {"owner_key": owner_email, "$text": {"$search": mongo_text_query(terms)}}, score, [("score", {"$meta": "textScore"}), ("_id", -1)]
+
+def index_note(unique_id: int, owner_email: str, note_title: str, note_description: str) -> None:
+    search_col().replace_one({"_id": unique_id}, _index_doc(unique_id, owner_email, note_title, note_description), upsert=True)
+
+def unindex_note(unique_id: int) -> None:
+    search_col().delete_one({"_id": unique_id})
+
+def _change_ops(changes: Dict[int, Optional[tuple]]) -> List[Any]:
+    # uniqueID -> (owner_email, title, description) to (re)index, or None to drop
+    return [
+        DeleteOne({"_id": uid}) if c is None else ReplaceOne({"_id": uid}, _index_doc(uid, *c), upsert=True)
+        for uid, c in changes.items()
+    ]
+
+def index_changes(changes: Dict[int, Optional[tuple]]) -> None:
+    if changes:
+        search_col().bulk_write(_change_ops(changes), ordered=False)
+
+def search_note_ids(owner_email: str, terms: List[str], limit: int, offset: int) -> List[int]:
+    flt, projection, sort = _search_args(owner_email, terms)
+    return [d["_id"] for d in search_col().find(flt, projection).sort(sort).skip(offset).limit(limit)]
@@ -0,0 +1,53 @@
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Iterable
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from models.sql_models import MediaBlob
+from utils_media import blob_refs, hold_until
+
+# reference counts for content-addressed uploads; ref_media and deref_media run inside the caller's
+# transaction. hold_blob commits on its own: an upload holds its blob before the file goes in place
+
+def hold_blob(db: Session, digest: str, url: str) -> None:
+    until = hold_until()
+    for _ in range(2):  # a concurrent upload of the same bytes may insert the row first
+        if not db.query(MediaBlob).filter(MediaBlob.digest == digest).update({MediaBlob.hold_until: until}, synchronize_session=False):
+            db.add(MediaBlob(digest=digest, url=url, refs=0, hold_until=until))
+        try:
+            db.commit()
+            return
+        except IntegrityError:
+            db.rollback()
+    raise RuntimeError(f"could not hold media blob {digest}")
+
+def blob_in_use(db: Session, digest: str) -> bool:
+    return db.query(MediaBlob.digest).filter(MediaBlob.digest == digest).first() is not None
+
+def purge_blobs(db: Session) -> List[str]:
+    # blobs a delete released while an upload still held them, now that the hold has run out
+    dead = db.query(MediaBlob).filter(MediaBlob.refs <= 0, MediaBlob.hold_until <= datetime.now(timezone.utc)).all()
+    for b in dead:
+        db.delete(b)
+    db.commit()
+    return [b.url for b in dead]
+
+def ref_media(db: Session, media: Iterable[Dict[str, Any]]) -> None:
+    for digest, (url, n) in blob_refs(media).items():
+        hit = db.query(MediaBlob).filter(MediaBlob.digest == digest).update({MediaBlob.refs: MediaBlob.refs + n}, synchronize_session=False)
+        if not hit:
+            db.add(MediaBlob(digest=digest, url=url, refs=n))
+
+def deref_media(db: Session, media: Iterable[Dict[str, Any]]) -> List[str]:
+    # returns the urls of blobs nothing points at anymore; their files go once the caller commits
+    refs = blob_refs(media)
+    if not refs:
+        return []
+    for digest, (_, n) in refs.items():
+        db.query(MediaBlob).filter(MediaBlob.digest == digest).update({MediaBlob.refs: MediaBlob.refs - n}, synchronize_session=False)
+    now = datetime.now(timezone.utc)
+    dead = db.query(MediaBlob).filter(MediaBlob.digest.in_(list(refs)), MediaBlob.refs <= 0,
+                                      or_(MediaBlob.hold_until.is_(None), MediaBlob.hold_until <= now)).all()
+    for b in dead:
+        db.delete(b)
+    return [b.url for b in dead]
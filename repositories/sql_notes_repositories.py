@@ -1,56 +1,377 @@
-from typing import Dict, Any, List
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional, Iterable, Iterator
+from sqlalchemy import or_, select, update, Select
 from sqlalchemy.orm import Session
-from models.sql_models import Note, User, NoteMedia as SQLNoteMedia
-from utils_b64 import b64e, b64d
+from sqlalchemy.orm.attributes import set_committed_value
+from models.sql_models import Note, NoteHistory, NoteTombstone, NoteMedia as SQLNoteMedia
+from repositories.sql_users_repository import find_user_identity, bump_notes_version
+from repositories.sql_media_repository import ref_media, deref_media
+from repositories.sql_search_repository import index_note, index_notes, unindex_note, unindex_notes, search_note_ids
+from utils_codec import encode, decode, decode_many
+from utils_pagination import page_bounds
+from utils_history import encode_revision, materialize, reconstruct, number_revisions, version_at, utc
+from utils_versions import note_key, cached_version, store_version, make_version, forget_versions
+from utils_search import search_terms
+from utils_batch import batch_result, NOT_FOUND, NOT_ALLOWED, STALE
+from utils_export import EXPORT_CHUNK, import_history
+from utils_retention import RETENTION_TIERS, TOMBSTONES, compact_entries, entry_bytes, new_report
 
-def add_note(db: Session, owner_email: str, note_title: str, note_description: str, media: List[Dict[str, Any]] | None = None) -> Dict[str, Any]:
-    owner = db.query(User).filter(User.email == owner_email).first()
+def _media_dict(m: SQLNoteMedia) -> Dict[str, Any]:
+    return {"url": m.url, "mime_type": m.mime_type, "size_bytes": m.size_bytes, "original_name": m.original_name}
+
+def _history_entry(h: NoteHistory) -> Dict[str, Any]:
+    return {"rev": h.rev, "kind": h.kind, "note_title": h.note_title, "note_description": h.note_description, "archived_at": h.archived_at}
+
+def _note_dict(n: Note, owner_email: str, media: List[Dict[str, Any]], history: List[Dict[str, Any]], texts: tuple | None = None) -> Dict[str, Any]:
+    title, description = texts or (decode(n.note_title, n.id), decode(n.note_description, n.id))
+    return {
+        "uniqueID": n.id,
+        "note_title": title,
+        "note_description": description,
+        "note_created": n.note_created,
+        "rev": n.rev,
+        "owner_key": owner_email,
+        "note_history": materialize(title, description, history, n.rev) if history else [],
+        "media": media,
+    }
+
+def hydrate_notes(db: Session, notes: Iterable[Note], owner_email: str, with_history: bool = False) -> List[Dict[str, Any]]:
+    # one IN (...) query for media (and one for history) per page instead of one per note
+    notes = list(notes)
+    ids = [n.id for n in notes]
+    media: Dict[int, List[Dict[str, Any]]] = defaultdict(list)
+    history: Dict[int, List[Dict[str, Any]]] = defaultdict(list)
+    if ids:
+        for m in db.query(SQLNoteMedia).filter(SQLNoteMedia.note_id.in_(ids)).order_by(SQLNoteMedia.id.asc()):
+            media[m.note_id].append(_media_dict(m))
+        if with_history:
+            rows = db.query(NoteHistory).filter(NoteHistory.note_id.in_(ids)).order_by(NoteHistory.id.desc())
+            for h in rows:
+                history[h.note_id].append(_history_entry(h))
+    texts = decode_many((v for n in notes for v in (n.note_title, n.note_description)), (n.id for n in notes for _ in range(2)))
+    return [_note_dict(n, owner_email, media[n.id], history[n.id], (texts[2 * i], texts[2 * i + 1])) for i, n in enumerate(notes)]
+
+def add_note(db: Session, owner_id: int, owner_email: str, note_title: str, note_description: str, media: List[Dict[str, Any]] | None = None) -> Dict[str, Any]:
     note = Note(
-        note_title=b64e(note_title),
-        note_description=b64e(note_description),
-        owner_id=owner.id
+        note_title=encode(note_title),
+        note_description=encode(note_description),
+        owner_id=owner_id
     )
     db.add(note); db.flush()
-    for m in (media or []):
-        db.add(SQLNoteMedia(
+    rows = [
+        SQLNoteMedia(
             note_id=note.id,
             url=m["url"],
             mime_type=m["mime_type"],
             size_bytes=m["size_bytes"],
             original_name=m["original_name"],
-        ))
-    db.commit(); db.refresh(note)
-
-    out_media = [
-        {"url": m.url, "mime_type": m.mime_type, "size_bytes": m.size_bytes, "original_name": m.original_name}
-        for m in db.query(SQLNoteMedia).filter(SQLNoteMedia.note_id == note.id).all()
+        )
+        for m in (media or [])
     ]
+    db.add_all(rows)
+    ref_media(db, media)
+    index_note(db, note.id, owner_id, note_title, note_description)
+    bump_notes_version(db, owner_id)
+    # everything the response needs is already in memory, so no refresh/re-query after commit
+    out = _note_dict(note, owner_email, [_media_dict(m) for m in rows], [])
+    db.commit()
+    return out
 
-    return {
-        "uniqueID": note.id,
-        "note_title": b64d(note.note_title),
-        "note_description": b64d(note.note_description),
-        "note_created": note.note_created,
-        "owner_key": owner_email,
-        "note_history": [],
-        "media": out_media,
-    }
+def find_note(db: Session, unique_id: int) -> Optional[Note]:
+    return db.query(Note).filter(Note.id == unique_id).first()
 
-def get_all_notes(db: Session, owner_email: str) -> List[Dict[str, Any]]:
-    owner = db.query(User).filter(User.email == owner_email).first()
+def get_note(db: Session, note: Note, owner_email: str, with_history: bool = False) -> Dict[str, Any]:
+    return hydrate_notes(db, [note], owner_email, with_history)[0]
+
+def _bury(db: Session, notes: List[Note]) -> None:
+    # tombstones for notes about to be deleted, in the caller's transaction
+    if not TOMBSTONES or not notes:
+        return
+    history: Dict[int, List[Dict[str, Any]]] = defaultdict(list)
+    for h in db.query(NoteHistory).filter(NoteHistory.note_id.in_([n.id for n in notes])).order_by(NoteHistory.id.desc()):
+        history[h.note_id].append(dict(_history_entry(h), archived_at=utc(h.archived_at).isoformat()))
+    db.add_all([NoteTombstone(note_id=n.id, owner_id=n.owner_id, note_title=n.note_title, note_description=n.note_description,
+                              note_created=n.note_created, rev=n.rev, note_history=history[n.id]) for n in notes])
+
+def delete_note(db: Session, note: Note) -> List[str]:
+    # returns the urls of media blobs that lost their last reference
+    media = [{"url": url} for (url,) in db.query(SQLNoteMedia.url).filter(SQLNoteMedia.note_id == note.id)]
+    released = deref_media(db, media)
+    _bury(db, [note])
+    unindex_note(db, note.id)
+    bump_notes_version(db, note.owner_id)
+    db.delete(note); db.commit()
+    return released
+
+def edit_note(db: Session, note: Note, owner_email: str, note_title: str, note_description: str) -> Optional[Dict[str, Any]]:
+    # compare-and-set on rev, as on Mongo: None means someone else edited the note since it was read.
+    # The history row archives the version being replaced as a reverse delta (or keyframe).
+    rev, title, description = note.rev, encode(note_title), encode(note_description)
+    entry = encode_revision(rev, decode(note.note_title, note.id), decode(note.note_description, note.id), note_title, note_description)
+    hit = (
+        db.query(Note)
+        .filter(Note.id == note.id, Note.rev == rev)
+        .update({Note.note_title: title, Note.note_description: description, Note.rev: rev + 1}, synchronize_session=False)
+    )
+    if not hit:
+        db.rollback()
+        return None
+    db.add(NoteHistory(note_id=note.id, **entry))
+    index_note(db, note.id, note.owner_id, note_title, note_description)
+    bump_notes_version(db, note.owner_id)
+    db.commit()
+    # the UPDATE bypassed the identity map; record the new state without another round trip
+    for attr, value in (("note_title", title), ("note_description", description), ("rev", rev + 1)):
+        set_committed_value(note, attr, value)
+    return hydrate_notes(db, [note], owner_email, with_history=True)[0]
+
+def apply_batch(db: Session, owner_id: int, ops: List[Dict[str, Any]]) -> Dict[str, Any]:
+    # one transaction: one IN (...) read of the targeted notes, one flush for new notes, history rows
+    # and updated notes, then bulk media / delete / search-index statements and a single commit.
+    # ops run in order, so an update after a delete of the same note in the batch is a 404.
+    # returns {"results": per-op results, "released": urls of media blobs that lost their last reference}
+    ids = {op["uniqueID"] for op in ops if op["op"] != "create"}
+    # FOR UPDATE where the database has row locks; SQLite already serializes writers
+    notes = {n.id: n for n in db.query(Note).filter(Note.id.in_(ids)).with_for_update()} if ids else {}
+    results: List[Optional[Dict[str, Any]]] = []
+    created: List[tuple] = []
+    history: List[NoteHistory] = []
+    deleted: List[Note] = []
+    indexed: Dict[int, tuple] = {}
+    for i, op in enumerate(ops):
+        kind = op["op"]
+        if kind == "create":
+            n = Note(note_title=encode(op["note_title"]), note_description=encode(op["note_description"]), owner_id=owner_id)
+            created.append((i, n, op))
+            results.append(None)  # filled in once the insert has assigned an id
+            continue
+        n = notes.get(op["uniqueID"])
+        if n is None:
+            results.append(batch_result(i, kind, 404, op["uniqueID"], detail=NOT_FOUND))
+        elif n.owner_id != owner_id:
+            results.append(batch_result(i, kind, 403, n.id, detail=NOT_ALLOWED))
+        elif op.get("rev") is not None and op["rev"] != n.rev:
+            results.append(batch_result(i, kind, 412, n.id, n.rev, detail=STALE))
+        elif kind == "delete":
+            del notes[n.id]
+            indexed.pop(n.id, None)
+            deleted.append(n)
+            results.append(batch_result(i, kind, 204, n.id))
+        else:
+            title, description = op["note_title"], op["note_description"]
+            entry = encode_revision(n.rev, decode(n.note_title, n.id), decode(n.note_description, n.id), title, description)
+            history.append(NoteHistory(note_id=n.id, **entry))
+            n.note_title, n.note_description, n.rev = encode(title), encode(description), n.rev + 1
+            indexed[n.id] = (n.id, owner_id, title, description)
+            results.append(batch_result(i, kind, 200, n.id, n.rev))
+    db.add_all([n for _, n, _ in created])
+    db.add_all(history)
+    db.flush()
+    media = []
+    for i, n, op in created:
+        results[i] = batch_result(i, "create", 201, n.id, 0)
+        indexed[n.id] = (n.id, owner_id, op["note_title"], op["note_description"])
+        media.extend(SQLNoteMedia(note_id=n.id, **m) for m in op.get("media") or [])
+    db.add_all(media)
+    ref_media(db, [_media_dict(m) for m in media])
+    released: List[str] = []
+    if deleted:
+        _bury(db, deleted)
+        deleted_ids = [n.id for n in deleted]
+        gone = [{"url": url} for (url,) in db.query(SQLNoteMedia.url).filter(SQLNoteMedia.note_id.in_(deleted_ids))]
+        released = deref_media(db, gone)
+        for model in (SQLNoteMedia, NoteHistory):
+            db.query(model).filter(model.note_id.in_(deleted_ids)).delete(synchronize_session=False)
+        db.query(Note).filter(Note.id.in_(deleted_ids)).delete(synchronize_session=False)
+        unindex_notes(db, deleted_ids)
+    index_notes(db, list(indexed.values()))
+    if created or history or deleted:
+        bump_notes_version(db, owner_id)
+    db.commit()
+    return {"results": results, "released": released}
+
+def get_version(db: Session, note: Note, rev: int) -> Optional[Dict[str, Any]]:
+    # None when the note never had that revision
+    if rev < 0 or rev > note.rev:
+        return None
+    key = note_key(note.id, note.note_created, note.history_gen)
+    hit = cached_version(key, rev)
+    if hit is not None:
+        return hit
+    title, description = decode(note.note_title, note.id), decode(note.note_description, note.id)
+    if rev == note.rev:
+        return store_version(key, make_version(rev, title, description))
+    # only rows at or above the target are needed: reconstruction walks down from the newest
+    rows = (
+        db.query(NoteHistory)
+        .filter(NoteHistory.note_id == note.id, or_(NoteHistory.rev >= rev, NoteHistory.rev.is_(None)))
+        .order_by(NoteHistory.id.desc())
+    )
+    found = reconstruct(title, description, [_history_entry(h) for h in rows], rev, note.rev)
+    return store_version(key, make_version(rev, *found)) if found else None
+
+def get_notes_page(db: Session, owner_email: str, limit: Optional[int] = None, after: Optional[int] = None, before: Optional[int] = None, with_history: bool = False) -> Dict[str, Any]:
+    owner = find_user_identity(db, owner_email)
     if not owner:
-        return []
-    notes = db.query(Note).filter(Note.owner_id == owner.id).order_by(Note.id.asc()).all()
-    out: List[Dict[str, Any]] = []
+        return {"items": [], "next_id": None, "prev_id": None}
+    # keyset range on ix_notes_owner_id_id; one extra row tells us whether another page exists
+    q = db.query(Note).filter(Note.owner_id == owner["id"])
+    if after is not None:
+        q = q.filter(Note.id > after)
+    if before is not None:
+        q = q.filter(Note.id < before)
+    q = q.order_by(Note.id.desc() if before is not None else Note.id.asc())
+    if limit is not None:
+        q = q.limit(limit + 1)
+    notes, next_id, prev_id = page_bounds(q.all(), limit, after, before, key=lambda n: n.id)
+    return {"items": hydrate_notes(db, notes, owner_email, with_history), "next_id": next_id, "prev_id": prev_id}
+
+def _keyset(q, col, after: Optional[int], before: Optional[int], limit: Optional[int]):
+    if after is not None:
+        q = q.filter(col > after)
+    if before is not None:
+        q = q.filter(col < before)
+    q = q.order_by(col.desc() if before is not None else col.asc())
+    return q.limit(limit + 1) if limit is not None else q
+
+def _as_of_dict(uid: int, owner_email: str, created: datetime, state: tuple, media: List[Dict[str, Any]], deleted_at: Optional[datetime] = None) -> Dict[str, Any]:
+    rev, title, description = state
+    return {"uniqueID": uid, "note_title": title, "note_description": description, "note_created": created, "rev": rev,
+            "owner_key": owner_email, "note_history": [], "media": media, "deleted_at": deleted_at}
+
+def get_notes_as_of(db: Session, owner_email: str, as_of: datetime, limit: Optional[int] = None, after: Optional[int] = None, before: Optional[int] = None) -> Dict[str, Any]:
+    # the owner's notes as they were at as_of, paged like get_notes_page: notes created by then,
+    # plus tombstones of notes deleted after it. Per page, one query for the rows archived after
+    # as_of (ix_note_history_note_id_archived_at), so a note costs the edits made since, not its
+    # whole history. Media is today's; deleted notes come without any.
+    owner = find_user_identity(db, owner_email)
+    if not owner:
+        return {"items": [], "next_id": None, "prev_id": None}
+    as_of = utc(as_of)
+    live = _keyset(db.query(Note).filter(Note.owner_id == owner["id"], Note.note_created <= as_of), Note.id, after, before, limit).all()
+    dead = _keyset(
+        db.query(NoteTombstone).filter(NoteTombstone.owner_id == owner["id"], NoteTombstone.note_created <= as_of, NoteTombstone.deleted_at > as_of),
+        NoteTombstone.note_id, after, before, limit,
+    ).all()
+    key = lambda r: r.id if isinstance(r, Note) else r.note_id
+    rows = sorted(live + dead, key=key, reverse=before is not None)
+    rows, next_id, prev_id = page_bounds(rows[:limit + 1] if limit is not None else rows, limit, after, before, key=key)
+    ids = [r.id for r in rows if isinstance(r, Note)]
+    history: Dict[int, List[Dict[str, Any]]] = defaultdict(list)
+    media: Dict[int, List[Dict[str, Any]]] = defaultdict(list)
+    if ids:
+        q = db.query(NoteHistory).filter(NoteHistory.note_id.in_(ids), NoteHistory.archived_at > as_of).order_by(NoteHistory.id.desc())
+        for h in q:
+            history[h.note_id].append(_history_entry(h))
+        for m in db.query(SQLNoteMedia).filter(SQLNoteMedia.note_id.in_(ids)).order_by(SQLNoteMedia.id.asc()):
+            media[m.note_id].append(_media_dict(m))
+    texts = decode_many((v for r in rows for v in (r.note_title, r.note_description)), (key(r) for r in rows for _ in range(2)))
+    items = []
+    for i, r in enumerate(rows):
+        title, description = texts[2 * i], texts[2 * i + 1]
+        if isinstance(r, Note):
+            items.append(_as_of_dict(r.id, owner_email, r.note_created, version_at(title, description, history[r.id], r.rev, as_of), media[r.id]))
+        else:
+            entries = [dict(e, archived_at=datetime.fromisoformat(e["archived_at"])) for e in r.note_history]
+            items.append(_as_of_dict(r.note_id, owner_email, r.note_created, version_at(title, description, entries, r.rev, as_of), [], r.deleted_at))
+    return {"items": items, "next_id": next_id, "prev_id": prev_id}
+
+def purge_tombstones(db: Session, cutoff: float) -> int:
+    # tombstones of notes deleted before cutoff (epoch seconds); their owners' as_of lists change,
+    # so each owner's notes_version moves in the same transaction
+    expired = NoteTombstone.deleted_at < datetime.fromtimestamp(cutoff, timezone.utc)
+    owners = [o for (o,) in db.query(NoteTombstone.owner_id).filter(expired).distinct()]
+    n = db.query(NoteTombstone).filter(expired).delete(synchronize_session=False)
+    for owner_id in owners:
+        bump_notes_version(db, owner_id)
+    db.commit()
+    return n
+
+def get_all_notes(db: Session, owner_email: str) -> List[Dict[str, Any]]:
+    return get_notes_page(db, owner_email)["items"]
+
+def export_query(owner_id: int) -> Select:
+    # streamed EXPORT_CHUNK rows at a time (a server-side cursor where the driver has one)
+    return select(Note).where(Note.owner_id == owner_id).order_by(Note.id.asc()).execution_options(yield_per=EXPORT_CHUNK)
+
+def export_chunk(db: Session, notes: List[Note], owner_email: str) -> List[Dict[str, Any]]:
+    return hydrate_notes(db, notes, owner_email, with_history=True)
+
+def iter_export(db: Session, owner_id: int, owner_email: str) -> Iterator[List[Dict[str, Any]]]:
+    # the session's identity map only holds loaded notes weakly, so finished chunks are freed
+    for notes in db.execute(export_query(owner_id)).scalars().partitions():
+        yield export_chunk(db, notes, owner_email)
+
+def import_notes(db: Session, owner_id: int, items: List[Dict[str, Any]]) -> int:
+    # one transaction per batch: the notes, then their history (oldest first), media and index rows
+    notes, chains = [], []
+    for item in items:
+        rev, entries = import_history(item["note_title"], item["note_description"], item.get("note_history") or [])
+        n = Note(note_title=encode(item["note_title"]), note_description=encode(item["note_description"]), owner_id=owner_id, rev=rev)
+        if item.get("note_created"):
+            n.note_created = item["note_created"]
+        notes.append(n)
+        chains.append(entries)
+    db.add_all(notes); db.flush()
+    db.add_all([NoteHistory(note_id=n.id, **e) for n, entries in zip(notes, chains) for e in reversed(entries)])
+    media = [SQLNoteMedia(note_id=n.id, **m) for n, item in zip(notes, items) for m in item.get("media") or []]
+    db.add_all(media)
+    ref_media(db, [_media_dict(m) for m in media])
+    index_notes(db, [(n.id, owner_id, item["note_title"], item["note_description"]) for n, item in zip(notes, items)])
+    bump_notes_version(db, owner_id)
+    db.commit()
+    return len(notes)
+
+def search_notes(db: Session, owner_email: str, q: str, limit: int, offset: int = 0) -> Dict[str, Any]:
+    owner = find_user_identity(db, owner_email)
+    terms = search_terms(q)
+    if not owner or not terms:
+        return {"items": [], "next_offset": None}
+    ids = search_note_ids(db, owner["id"], terms, limit + 1, offset)
+    more, ids = len(ids) > limit, ids[:limit]
+    by_id = {n.id: n for n in db.query(Note).filter(Note.id.in_(ids))} if ids else {}
+    notes = [by_id[i] for i in ids if i in by_id]
+    return {"items": hydrate_notes(db, notes, owner_email), "next_offset": offset + limit if more else None}
+
+def compact_history(db: Session, after: int, limit: int, now: float, dry_run: bool = False, tiers=RETENTION_TIERS) -> Optional[tuple]:
+    # applies the retention policy to the next `limit` notes above id `after`: one read for the notes
+    # and one for their history, then a short transaction per compacted note. Kept rows are rewritten
+    # in place, so id order stays rev order; a row already gone (note deleted, another compactor)
+    # rolls that note back. An edit landing meanwhile is harmless: its row rebuilds the version the
+    # rewritten chain starts from. Returns (last id, report) or None when no notes are left.
+    notes = db.query(Note).filter(Note.id > after).order_by(Note.id).limit(limit).all()
+    if not notes:
+        return None
+    rows: Dict[int, List[NoteHistory]] = defaultdict(list)
+    for h in db.query(NoteHistory).filter(NoteHistory.note_id.in_([n.id for n in notes])).order_by(NoteHistory.id.desc()):
+        rows[h.note_id].append(h)
+    report = new_report()
+    report["notes"] = len(notes)
+    plans = []
     for n in notes:
-        medias = db.query(SQLNoteMedia).filter(SQLNoteMedia.note_id == n.id).all()
-        out.append({
-            "uniqueID": n.id,
-            "note_title": b64d(n.note_title),
-            "note_description": b64d(n.note_description),
-            "note_created": n.note_created,
-            "owner_key": owner_email,
-            "note_history": [],
-            "media": [{"url": m.url, "mime_type": m.mime_type, "size_bytes": m.size_bytes, "original_name": m.original_name} for m in medias],
-        })
-    return out
+        old = [_history_entry(h) for h in rows[n.id]]
+        plan = compact_entries(decode(n.note_title, n.id), decode(n.note_description, n.id), old, n.rev, now, tiers) if old else None
+        if plan is not None:
+            row_ids = dict(zip(number_revisions(old, n.rev), (h.id for h in rows[n.id])))
+            plans.append((n.id, n.owner_id, note_key(n.id, n.note_created, n.history_gen), row_ids, entry_bytes(old), *plan))
+    last = notes[-1].id
+    # end the read transaction first: on SQLite in WAL a write cannot start from a stale snapshot
+    db.rollback()
+    for note_id, owner_id, key, row_ids, old_bytes, entries, dropped in plans:
+        if not dry_run:
+            gone = [row_ids[r] for r in dropped]
+            if db.query(NoteHistory).filter(NoteHistory.id.in_(gone)).delete(synchronize_session=False) != len(gone):
+                db.rollback()
+                report["conflicts"] += 1
+                continue
+            db.execute(update(NoteHistory), [{"id": row_ids[e["rev"]], "rev": e["rev"], "kind": e["kind"], "note_title": e["note_title"],
+                                              "note_description": e["note_description"]} for e in entries])
+            db.execute(update(Note).where(Note.id == note_id).values(history_gen=Note.history_gen + 1))
+            bump_notes_version(db, owner_id)
+            db.commit()
+            forget_versions(key, dropped)
+        report["compacted"] += 1
+        report["revisions"] += len(dropped)
+        report["bytes"] += old_bytes - entry_bytes(entries)
+    return last, report
@@ -0,0 +1,40 @@
+from typing import List, Tuple
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from utils_search import fts5_query, TITLE_WEIGHT
+
+# notes_fts (FTS5, created by upgrade_schema) keeps the decoded text of every note under
+# rowid = notes.id and is written in the same transaction as the note itself. Other databases
+# have no index: writes skip it and search reports itself unavailable.
+
+def search_supported(db: Session) -> bool:
+    return db.get_bind().dialect.name == "sqlite"
+
+def index_note(db: Session, note_id: int, owner_id: int, note_title: str, note_description: str) -> None:
+    index_notes(db, [(note_id, owner_id, note_title, note_description)])
+
+def index_notes(db: Session, rows: List[Tuple[int, int, str, str]]) -> None:
+    # rows of (note_id, owner_id, title, description), written as one executemany
+    if rows and search_supported(db):
+        db.execute(
+            text("INSERT OR REPLACE INTO notes_fts(rowid, note_title, note_description, owner_id) VALUES (:id, :t, :d, :o)"),
+            [{"id": i, "t": t, "d": d, "o": o} for i, o, t, d in rows],
+        )
+
+def unindex_note(db: Session, note_id: int) -> None:
+    unindex_notes(db, [note_id])
+
+def unindex_notes(db: Session, note_ids: List[int]) -> None:
+    if note_ids and search_supported(db):
+        db.execute(text("DELETE FROM notes_fts WHERE rowid = :id"), [{"id": i} for i in note_ids])
+
+def search_note_ids(db: Session, owner_id: int, terms: List[str], limit: int, offset: int) -> List[int]:
+    # best bm25 first (FTS5 scores are negative); ties keep the newest note first
+    rows = db.execute(
+        text(
+            "SELECT rowid FROM notes_fts WHERE notes_fts MATCH :q AND owner_id = :o "
+            "ORDER BY bm25(notes_fts, :tw, 1.0), rowid DESC LIMIT :n OFFSET :off"
+        ),
+        {"q": fts5_query(terms), "o": owner_id, "tw": TITLE_WEIGHT, "n": limit, "off": offset},
+    )
+    return [r[0] for r in rows]
@@ -1,13 +1,34 @@
 from typing import Optional
 from sqlalchemy.orm import Session
 from models.sql_models import User
+from repositories import user_cache
 
 def find_user_by_email(db: Session, email: str) -> Optional[User]:
     return db.query(User).filter(User.email == email).first()
 
+def find_user_identity(db: Session, email: str) -> Optional[dict]:
+    ident = user_cache.get_identity(email)
+    if ident is None:
+        row = db.query(User.id).filter(User.email == email).first()
+        ident = user_cache.put_identity(email, row.id) if row else None
+    return ident
+
+def get_notes_version(db: Session, email: str) -> Optional[int]:
+    row = db.query(User.notes_version).filter(User.email == email).first()
+    return row.notes_version if row else None
+
+def bump_notes_version(db: Session, owner_id: int) -> None:
+    # part of the caller's transaction, so the version moves exactly when the notes do
+    db.query(User).filter(User.id == owner_id).update({User.notes_version: User.notes_version + 1}, synchronize_session=False)
+
 def create_user(db: Session, email: str, hashed_password: str) -> User:
     u = User(email=email, hashed_password=hashed_password)
     db.add(u)
     db.commit()
     db.refresh(u)
+    user_cache.invalidate(email)
     return u
+
+def update_password_hash(db: Session, user: User, hashed_password: str) -> None:
+    user.hashed_password = hashed_password
+    db.commit()
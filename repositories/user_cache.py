@@ -0,0 +1,24 @@
+import os
+from typing import Any, Dict, Optional
+from utils_cache import LRUCache
+
+# email -> {"id", "email"} for existing users; lets write paths resolve the owner without a query.
+# misses are not cached, and create_user drops the key so a fresh registration is seen at once
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300"))
+
+_identities = LRUCache(USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+def get_identity(email: str) -> Optional[Dict[str, Any]]:
+    return _identities.get(email)
+
+def put_identity(email: str, user_id: Any) -> Dict[str, Any]:
+    ident = {"id": user_id, "email": email}
+    _identities.set(email, ident)
+    return ident
+
+def invalidate(email: str) -> None:
+    _identities.pop(email)
+
+def user_cache_stats() -> Dict[str, int]:
+    return _identities.stats()
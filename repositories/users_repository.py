@@ -1,5 +1,6 @@
 from typing import Optional
 from databases.mongodb_connect import get_db
+from repositories import user_cache
 
 def users_col():
     return get_db()["users"]
@@ -7,8 +8,28 @@ def users_col():
 def find_user_by_email(email: str) -> Optional[dict]:
     return users_col().find_one({"email": email})
 
+def find_user_identity(email: str) -> Optional[dict]:
+    ident = user_cache.get_identity(email)
+    if ident is None:
+        u = users_col().find_one({"email": email}, projection={"_id": 1})
+        ident = user_cache.put_identity(email, str(u["_id"])) if u else None
+    return ident
+
+def get_notes_version(email: str) -> Optional[int]:
+    u = users_col().find_one({"email": email}, projection={"notes_version": 1})
+    return u.get("notes_version", 0) if u else None
+
+def bump_notes_version(email: str) -> None:
+    # called after the note write itself: a reader that saw the old version may refetch once for
+    # nothing, but can never keep a stale page under the new version
+    users_col().update_one({"email": email}, {"$inc": {"notes_version": 1}})
+
 def create_user(email: str, hashed_password: str) -> dict:
     doc = {"email": email, "hashed_password": hashed_password}
     users_col().insert_one(doc)
+    user_cache.invalidate(email)
     doc.pop("_id", None)
     return doc
+
+def update_password_hash(email: str, hashed_password: str) -> None:
+    users_col().update_one({"email": email}, {"$set": {"hashed_password": hashed_password}})
@@ -0,0 +1,28 @@
+import os, sys, tempfile
+
+# app.py picks its backend and paths from the environment at import time, so the test settings
+# go in before any test module imports it: SQL on a throwaway SQLite file, blocking driver, cheap bcrypt
+_tmp = tempfile.mkdtemp(prefix="notes-tests-")
+os.environ.update(DB_BACKEND="sql", DB_ASYNC="0", SQLALCHEMY_DATABASE_URL=f"sqlite:///{_tmp}/notes.db",
+                  UPLOAD_DIR=os.path.join(_tmp, "uploads"), BCRYPT_ROUNDS="4", HASH_POOL_SIZE="0", STARTUP_WARM="0")
+os.makedirs(os.environ["UPLOAD_DIR"], exist_ok=True)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app as notes_app
+
+@pytest.fixture
+def client():
+    with TestClient(notes_app.app) as c:
+        yield c
+
+@pytest.fixture
+def login(client):
+    # login(email) registers the user (once) and returns its bearer header
+    def login(email):
+        client.post("/auth/register", json={"email": email, "password": "secret1"})
+        token = client.post("/auth/login", data={"username": email, "password": "secret1"}).json()["access_token"]
+        return {"Authorization": f"Bearer {token}"}
+    return login
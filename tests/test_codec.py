@@ -0,0 +1,79 @@
+import base64
+import pytest
+
+import utils_codec
+from utils_codec import encode, decode, is_encoded, recode, CodecError
+
+LONG = "a fairly repetitive note body " * 20
+
+def _b64(text):
+    return base64.b64encode(text.encode("utf-8")).decode("ascii")
+
+@pytest.mark.parametrize("stored, text", [
+    (encode("short"), "short"),
+    (encode(LONG, "zlib"), LONG),
+    (encode(LONG, "lzma"), LONG),
+])
+def test_encoded_values_decode_and_are_left_alone(stored, text):
+    assert decode(stored) == text
+    assert is_encoded(stored)
+    assert recode(stored) is None
+
+def test_tagged_formats():
+    assert encode("short").startswith("p:")
+    assert encode(LONG, "zlib").startswith("z:")
+    assert encode(LONG, "lzma").startswith("x:")
+    assert encode(LONG, "plain") == "p:" + LONG
+
+@pytest.mark.parametrize("raw", ["hello world", "héllo", "x:y", "z:abc", "q:zz"])
+def test_raw_text_is_encoded_whole(raw):
+    # raw text from before Base64, including text that merely looks tagged
+    assert not is_encoded(raw)
+    with pytest.raises(CodecError):
+        decode(raw)
+    assert decode(recode(raw)) == raw
+
+def test_legacy_base64_is_reencoded():
+    assert decode(_b64("légacy")) == "légacy" and is_encoded(_b64("légacy"))
+    assert decode(recode(_b64("légacy"), legacy=True)) == "légacy"
+    assert utils_codec.codec_of(recode(_b64("légacy"))) == "p"
+
+def test_legacy_run_keeps_plain_looking_raw_text():
+    assert recode("p:raw") is None  # after the deploy "p:raw" is a stored value, so it is trusted
+    assert decode(recode("p:raw", legacy=True)) == "p:raw"
+
+def test_sql_migration_fixes_raw_rows(monkeypatch, tmp_path):
+    import Scripts.migration as migration
+    from Scripts.MigrateTextCodec_sql import NotesTextCodec
+    from databases.sql_connect import Base, SessionLocal, engine
+    from models.sql_models import Note, User
+    monkeypatch.setattr(migration, "MIGRATION_STATE_DIR", str(tmp_path))
+    Base.metadata.create_all(engine)
+    with SessionLocal() as db:
+        owner = User(email="codec@example.com", hashed_password="x")
+        db.add(owner)
+        db.flush()
+        notes = [Note(owner_id=owner.id, note_title=t, note_description=d)
+                 for t, d in (("x:y", _b64("b64 body")), ("plain raw", encode("kept")))]
+        db.add_all(notes)
+        db.commit()
+        ids = [n.id for n in notes]
+    migration.run(NotesTextCodec, [])
+    with SessionLocal() as db:
+        rows = [db.get(Note, i) for i in ids]
+        assert [(decode(n.note_title), decode(n.note_description)) for n in rows] == [("x:y", "b64 body"), ("plain raw", "kept")]
+
+def test_undecodable_note_is_a_defined_500(client, login):
+    from databases.sql_connect import SessionLocal
+    from models.sql_models import Note
+    h = login("corrupt@example.com")
+    uid = client.post("/notes", json={"note_title": "t", "note_description": "d"}, headers=h).json()["uniqueID"]
+    with SessionLocal() as db:
+        db.get(Note, uid).note_title = "z:not zlib"
+        db.commit()
+    for path in ("/notes", f"/notes/{uid}"):
+        r = client.get(path, headers=h)
+        assert r.status_code == 500 and r.json() == {"detail": "Stored note text cannot be decoded", "note_id": uid}
+    with SessionLocal() as db:
+        db.get(Note, uid).note_title = encode("t")
+        db.commit()
@@ -0,0 +1,83 @@
+import time, asyncio
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+import motor.motor_asyncio
+import databases.mongodb_connect as mc
+from repositories import notes_repository, async_notes_repository
+from repositories.counters_repository import BlockIdAllocator, AsyncBlockIdAllocator
+
+SEEDED_MAX = 5000
+CALLS = 400
+
+@pytest.fixture
+def mongo(monkeypatch):
+    # one mongomock store behind both the pymongo and the Motor client, with ids written before
+    # the counter existed, as on a database that predates the allocator
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(mc, "MongoClient", lambda uri, **_: client)
+    monkeypatch.setattr(motor.motor_asyncio, "AsyncIOMotorClient", lambda uri, **_: mongomock_motor.AsyncMongoMockClient(mock_mongo_client=client))
+    mc.close_clients()
+    client[mc.DB_NAME]["notes"].insert_many([{"uniqueID": i} for i in (1, 17, SEEDED_MAX)])
+    yield client[mc.DB_NAME]
+    mc.close_clients()
+
+class SlowAllocator(BlockIdAllocator):
+    # a reservation takes a round trip on a real server; mongomock answers at once, which hides races
+    def _reserve(self, count):
+        time.sleep(0.001)
+        super()._reserve(count)
+
+class SlowAsyncAllocator(AsyncBlockIdAllocator):
+    async def _areserve(self, count):
+        await asyncio.sleep(0.001)
+        await super()._areserve(count)
+
+def _check(ids):
+    # unique, past the seeded ids, and dense: one allocator never drops a reserved block
+    assert len(ids) == CALLS
+    assert len(set(ids)) == CALLS
+    assert min(ids) > SEEDED_MAX
+    assert sorted(ids) == list(range(SEEDED_MAX + 1, SEEDED_MAX + CALLS + 1))
+
+def test_parallel_next_id_is_unique(mongo):
+    ids = SlowAllocator("notes", "notes", "uniqueID", block_size=7)
+    with ThreadPoolExecutor(max_workers=32) as pool:
+        _check(list(pool.map(lambda _: ids.next_id(), range(CALLS))))
+
+def test_parallel_async_next_id_is_unique(mongo):
+    ids = SlowAsyncAllocator("notes", "notes", "uniqueID", block_size=7)
+
+    async def run():
+        return await asyncio.gather(*(ids.next_id() for _ in range(CALLS)))
+    _check(asyncio.run(run()))
+
+def test_parallel_add_note(mongo, monkeypatch):
+    monkeypatch.setattr(notes_repository, "note_ids", SlowAllocator("notes", "notes", "uniqueID", block_size=7))
+    with ThreadPoolExecutor(max_workers=32) as pool:
+        notes = list(pool.map(lambda i: notes_repository.add_note("a@example.com", f"t{i}", f"d{i}"), range(CALLS)))
+    _check([n["uniqueID"] for n in notes])
+    assert mongo["notes"].count_documents({"owner_key": "a@example.com"}) == CALLS
+
+def test_parallel_async_add_note(mongo, monkeypatch):
+    monkeypatch.setattr(async_notes_repository, "async_note_ids", SlowAsyncAllocator("notes", "notes", "uniqueID", block_size=7))
+
+    async def run():
+        return await asyncio.gather(*(async_notes_repository.add_note("a@example.com", f"t{i}", f"d{i}") for i in range(CALLS)))
+    _check([n["uniqueID"] for n in asyncio.run(run())])
+
+def test_block_hand_off_between_allocators(mongo):
+    # two processes sharing the counter: each reserves whole blocks, and a block once handed out is never reused
+    a = BlockIdAllocator("notes", "notes", "uniqueID", block_size=5)
+    b = BlockIdAllocator("notes", "notes", "uniqueID", block_size=5)
+    first_a = a.next_ids(3)
+    first_b = b.next_ids(5)
+    rest_a = a.next_ids(4)  # 2 left in a's block, then a fresh one past b's
+    assert first_a == [SEEDED_MAX + 1, SEEDED_MAX + 2, SEEDED_MAX + 3]
+    assert first_b == list(range(SEEDED_MAX + 6, SEEDED_MAX + 11))
+    assert rest_a == [SEEDED_MAX + 4, SEEDED_MAX + 5, SEEDED_MAX + 11, SEEDED_MAX + 12]
+    c = AsyncBlockIdAllocator("notes", "notes", "uniqueID", block_size=5)
+    assert asyncio.run(c.next_ids(2)) == [SEEDED_MAX + 16, SEEDED_MAX + 17]
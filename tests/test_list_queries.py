@@ -0,0 +1,42 @@
+import pytest
+from sqlalchemy import event
+
+from databases.sql_connect import engine
+
+MEDIA = [{"url": f"/uploads/images/{i}.png", "mime_type": "image/png", "size_bytes": 10, "original_name": f"{i}.png"} for i in range(2)]
+
+def _add_notes(client, headers, n):
+    for i in range(n):
+        r = client.post("/notes", json={"note_title": f"t{i}", "note_description": f"d{i}", "media": MEDIA}, headers=headers)
+        assert r.status_code == 200
+        client.put(f"/notes/{r.json()['uniqueID']}", json={"note_title": f"t{i}", "note_description": "edited"}, headers=headers)
+
+def _list_statements(client, headers, params):
+    statements = []
+
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        r = client.get("/notes", params=params, headers=headers)
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+    assert r.status_code == 200
+    return r.json(), statements
+
+@pytest.mark.parametrize("include_history", [False, True])
+def test_list_query_count_does_not_grow_with_notes(client, login, include_history):
+    headers = login(f"queries-{include_history}@example.com")
+    params = {"limit": 100, "include_history": include_history}
+    _add_notes(client, headers, 3)
+    _list_statements(client, headers, params)  # warm the token and user caches
+    small, few = _list_statements(client, headers, params)
+    _add_notes(client, headers, 27)
+    large, many = _list_statements(client, headers, params)
+
+    assert len(small) == 3 and len(large) == 30
+    assert all(len(n["media"]) == len(MEDIA) for n in large)
+    if include_history:
+        assert all(len(n["note_history"]) == 1 for n in large)
+    assert len(many) == len(few), many
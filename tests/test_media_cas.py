@@ -0,0 +1,103 @@
+import os, asyncio
+import pytest
+
+import app as notes_app
+import utils_media
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"cas-race" * 64
+
+@pytest.fixture
+def client(client, login, monkeypatch):
+    # the shared client, signed in, with content-addressed storage
+    monkeypatch.setattr(utils_media, "MEDIA_STORAGE", "cas")
+    client.headers.update(login("cas@example.com"))
+    return client
+
+def _upload(client):
+    r = client.post("/media/upload", files=[("files", ("a.png", PNG, "image/png"))])
+    assert r.status_code == 200 and not r.json()["errors"]
+    return r.json()["saved"][0]
+
+def _note(client, media):
+    return client.post("/notes", json={"note_title": "t", "note_description": "d", "media": [media]}).json()["uniqueID"]
+
+def test_upload_holds_blob_against_delete_of_last_note(client, monkeypatch):
+    # note 1 holds the only reference, and its own upload hold has run out
+    monkeypatch.setattr(utils_media, "MEDIA_UPLOAD_HOLD", -1)
+    first = _note(client, _upload(client))
+    monkeypatch.setattr(utils_media, "MEDIA_UPLOAD_HOLD", 3600)
+    # the same bytes are uploaded again; the last note using them goes before the new note attaches the url
+    media = _upload(client)
+    assert client.delete(f"/notes/{first}").status_code == 204
+    assert client.get(media["url"]).status_code == 200
+    second = _note(client, media)
+    assert client.get(media["url"]).content == PNG
+    # once no note and no live hold point at the blob, deleting the last note removes the file
+    monkeypatch.setattr(utils_media, "MEDIA_UPLOAD_HOLD", -1)
+    _upload(client)
+    assert client.delete(f"/notes/{second}").status_code == 204
+    assert client.get(media["url"]).status_code == 404
+
+def test_sweep_removes_blob_once_its_hold_runs_out(client, monkeypatch):
+    # the last note goes while its own upload still holds the blob, so the file stays until the sweep
+    media = _upload(client)
+    assert client.delete(f"/notes/{_note(client, media)}").status_code == 204
+    assert notes_app.sweep_step() == 0
+    assert client.get(media["url"]).status_code == 200
+    # let the hold run out
+    monkeypatch.setattr(utils_media, "MEDIA_UPLOAD_HOLD", -1)
+    if notes_app.DB_BACKEND == "sql":
+        from databases.sql_connect import SessionLocal
+        from models.sql_models import MediaBlob
+        with SessionLocal() as db:
+            db.query(MediaBlob).update({MediaBlob.hold_until: utils_media.hold_until()})
+            db.commit()
+    else:
+        from repositories.media_repository import blobs_col
+        blobs_col().update_many({}, {"$set": {"hold_until": utils_media.hold_until()}})
+    assert notes_app.sweep_step() == 1
+    assert client.get(media["url"]).status_code == 404
+
+def test_remove_blobs_puts_back_a_blob_held_meanwhile(tmp_path):
+    url = "/uploads/images/" + "a" * 64 + ".png"
+    path = tmp_path / "images" / ("a" * 64 + ".png")
+    path.parent.mkdir()
+
+    async def held(digest):
+        return True
+
+    async def unused(digest):
+        return False
+
+    path.write_bytes(PNG)
+    asyncio.run(utils_media.remove_blobs(str(tmp_path), [url], held))
+    assert path.read_bytes() == PNG
+    asyncio.run(utils_media.remove_blobs(str(tmp_path), [url], unused))
+    assert not path.exists()
+    assert os.listdir(path.parent) == []  # nothing left behind under a hidden name
+
+def test_mongo_deref_keeps_held_blob(monkeypatch):
+    mongomock = pytest.importorskip("mongomock")
+    import databases.mongodb_connect as mc
+    from repositories import media_repository as repo
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(mc, "MongoClient", lambda uri, **_: client)
+    monkeypatch.setattr(mongomock.collection.Collection, "bulk_write", _replay)
+    mc.close_clients()
+    try:
+        media = [{"url": "/uploads/images/" + "b" * 64 + ".png"}]
+        repo.ref_media(media)
+        repo.hold_blob("b" * 64, media[0]["url"])
+        assert repo.deref_media(media) == []
+        assert repo.blob_in_use("b" * 64)
+        repo.blobs_col().update_one({"_id": "b" * 64}, {"$unset": {"hold_until": ""}})
+        repo.ref_media(media)
+        assert repo.deref_media(media) == [media[0]["url"]]
+        assert not repo.blob_in_use("b" * 64)
+    finally:
+        mc.close_clients()
+
+def _replay(self, ops, ordered=True, **_):
+    # mongomock's bulk_write rejects the UpdateOne of current pymongo releases
+    for op in ops:
+        self.update_one(op._filter, op._doc, upsert=bool(op._upsert))
@@ -0,0 +1,16 @@
+import time
+from datetime import datetime, timezone
+
+import app as notes_app
+
+def test_purge_revalidates_cached_as_of_list(client, login):
+    h = login("purge@example.com")
+    uid = client.post("/notes", json={"note_title": "t", "note_description": "d"}, headers=h).json()["uniqueID"]
+    as_of = {"as_of": datetime.now(timezone.utc).isoformat()}
+    assert client.delete(f"/notes/{uid}", headers=h).status_code == 204
+    r = client.get("/notes", params=as_of, headers=h)
+    assert [n["uniqueID"] for n in r.json()] == [uid]
+    # the purge drops the tombstone, so the list cached under the old ETag is stale
+    assert notes_app.purge_step(time.time() + 1) >= 1
+    r2 = client.get("/notes", params=as_of, headers={**h, "If-None-Match": r.headers["etag"]})
+    assert r2.status_code == 200 and r2.json() == []
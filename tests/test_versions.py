@@ -0,0 +1,19 @@
+import time
+
+from databases.sql_connect import SessionLocal
+from repositories import sql_notes_repositories
+from utils_retention import parse_retention
+
+def test_version_cache_drops_revisions_compacted_elsewhere(client, login, monkeypatch):
+    h = login("versions@example.com")
+    uid = client.post("/notes", json={"note_title": "t", "note_description": "v0"}, headers=h).json()["uniqueID"]
+    for i in range(1, 4):
+        client.put(f"/notes/{uid}", json={"note_title": "t", "note_description": f"v{i}"}, headers=h)
+    assert client.get(f"/notes/{uid}/versions/1", headers=h).json()["note_description"] == "v1"
+    # compact as another process would: this process's cache is not told which revisions went
+    monkeypatch.setattr(sql_notes_repositories, "forget_versions", lambda key, revs: None)
+    with SessionLocal() as db:
+        _, report = sql_notes_repositories.compact_history(db, uid - 1, 1, time.time(), tiers=parse_retention("*=none"))
+    assert report["revisions"] == 3
+    assert client.get(f"/notes/{uid}/versions/1", headers=h).status_code == 404
+    assert client.get(f"/notes/{uid}/versions/3", headers=h).json()["note_description"] == "v3"
@@ -1,8 +1,25 @@
+import os, asyncio, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
 from passlib.context import CryptContext
 from datetime import datetime, timedelta, timezone
 from jose import jwt
+from utils_metrics import phase
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# bcrypt runs in worker processes so it never holds this worker's GIL; 0 falls back to the threadpool
+HASH_POOL_SIZE = int(os.getenv("HASH_POOL_SIZE", str(min(4, os.cpu_count() or 1))))
+# hashes running + waiting in this worker before new ones are refused with HashPoolBusy (-> 503)
+HASH_QUEUE_LIMIT = int(os.getenv("HASH_QUEUE_LIMIT", "64"))
+
+# raising BCRYPT_ROUNDS later is picked up by verify_and_update() on each user's next login
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+class HashPoolBusy(Exception):
+    pass
+
+_pool: Optional[ProcessPoolExecutor] = None
+_inflight = 0
 
 def hash_password(password: str) -> str:
     return pwd_context.hash(password)
@@ -10,6 +27,53 @@ def hash_password(password: str) -> str:
 def verify_password(plain: str, hashed: str) -> bool:
     return pwd_context.verify(plain, hashed)
 
+def verify_and_update(plain: str, hashed: str) -> Tuple[bool, Optional[str]]:
+    # (ok, new_hash); new_hash is set when the stored hash uses outdated settings
+    return pwd_context.verify_and_update(plain, hashed)
+
+def _get_pool() -> Optional[ProcessPoolExecutor]:
+    global _pool
+    if _pool is None and HASH_POOL_SIZE > 0:
+        # never fork: by first use the event loop, the threadpool and database clients have threads
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        _pool = ProcessPoolExecutor(max_workers=HASH_POOL_SIZE, mp_context=multiprocessing.get_context(method))
+    return _pool
+
+def shutdown_hash_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+def _load_backend() -> int:
+    # passlib picks and loads the bcrypt backend on the first hash; a process does it once
+    pwd_context.handler().get_backend()
+    return os.getpid()
+
+async def warm_hash_pool() -> None:
+    # loads bcrypt here and starts every hash worker, so the first logins don't pay for either
+    _load_backend()
+    if _get_pool() is not None:
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(_pool, _load_backend) for _ in range(HASH_POOL_SIZE)))
+
+async def _run_hash(fn, *args):
+    global _inflight
+    if _inflight >= HASH_QUEUE_LIMIT:
+        raise HashPoolBusy()
+    _inflight += 1
+    try:
+        with phase("hash"):  # includes waiting for a free worker
+            return await asyncio.get_running_loop().run_in_executor(_get_pool(), fn, *args)
+    finally:
+        _inflight -= 1
+
+async def hash_password_async(password: str) -> str:
+    return await _run_hash(hash_password, password)
+
+async def verify_and_update_async(plain: str, hashed: str) -> Tuple[bool, Optional[str]]:
+    return await _run_hash(verify_and_update, plain, hashed)
+
 def utcnow():
     return datetime.now(timezone.utc)
 
@@ -0,0 +1,12 @@
+import os
+from typing import Any, Dict, Optional
+
+# POST /notes/batch applies a client's queued creates/updates/deletes in one request; each op gets
+# the status its single-note endpoint would have returned, and one failing op never stops the rest
+BATCH_MAX_OPS = int(os.getenv("BATCH_MAX_OPS", "500"))
+
+NOT_FOUND, NOT_ALLOWED, CONFLICT = "Note not found", "Not allowed", "Note was modified concurrently, retry"
+STALE = "Note has changed since that rev"  # an op's rev didn't match, like a failed If-Match
+
+def batch_result(index: int, op: str, status: int, unique_id: Optional[int] = None, rev: Optional[int] = None, detail: Optional[str] = None) -> Dict[str, Any]:
+    return {"index": index, "op": op, "status": status, "uniqueID": unique_id, "rev": rev, "detail": detail}
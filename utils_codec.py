@@ -0,0 +1,110 @@
+import os, zlib, lzma, base64, itertools
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from utils_metrics import timed
+
+# stored note text is "<tag>:<payload>"; values without a tag are the original Base64 encoding.
+# ":" is not in the Base64 alphabet, so the two can never be confused. Raw text from before Base64
+# can look tagged ("a:b"), so the migration helpers below decode a value before trusting its tag.
+#   p  plain UTF-8 text
+#   z  zlib, then Base64 (the columns are text)
+#   x  lzma (raw xz stream), then Base64
+# text shorter than CODEC_COMPRESS_MIN bytes is stored plain; longer text is compressed with
+# CODEC_COMPRESSOR and kept only if that is actually smaller
+CODEC_COMPRESS_MIN = int(os.getenv("CODEC_COMPRESS_MIN", "256"))
+CODEC_COMPRESSOR = os.getenv("CODEC_COMPRESSOR", "zlib").lower()  # zlib | lzma | plain
+
+TAG_PLAIN, TAG_ZLIB, TAG_LZMA = "p", "z", "x"
+# notes are small, so a 64 KiB dictionary compresses as well as the 8 MiB default and sets up faster
+_LZMA_FILTERS = [{"id": lzma.FILTER_LZMA2, "preset": 6, "dict_size": 1 << 16}]
+
+class CodecError(ValueError):
+    # note_id names the note the value belongs to, when the caller knows it
+    def __init__(self, message: str, note_id: Any = None):
+        super().__init__(message if note_id is None else f"note {note_id}: {message}")
+        self.note_id = note_id
+
+def _b64(raw: bytes) -> str:
+    return base64.b64encode(raw).decode("ascii")
+
+def _unb64(payload: str) -> bytes:
+    return base64.b64decode(payload.encode("ascii"), validate=True)
+
+def _legacy(stored: str) -> str:
+    # a value from before the codec: Base64 if it decodes as such, raw text otherwise
+    try:
+        return _unb64(stored).decode("utf-8")
+    except ValueError:
+        return stored
+
+_COMPRESS: Dict[str, Callable[[bytes], bytes]] = {
+    TAG_ZLIB: lambda raw: zlib.compress(raw, 6),
+    TAG_LZMA: lambda raw: lzma.compress(raw, format=lzma.FORMAT_RAW, filters=_LZMA_FILTERS),
+}
+_DECODE: Dict[str, Callable[[str], str]] = {
+    TAG_PLAIN: lambda payload: payload,
+    TAG_ZLIB: lambda payload: zlib.decompress(_unb64(payload)).decode("utf-8"),
+    TAG_LZMA: lambda payload: lzma.decompress(_unb64(payload), format=lzma.FORMAT_RAW, filters=_LZMA_FILTERS).decode("utf-8"),
+}
+_COMPRESSOR_TAGS = {"zlib": TAG_ZLIB, "lzma": TAG_LZMA}
+
+@timed("codec.encode")
+def encode(txt: Optional[str], compressor: Optional[str] = None) -> str:
+    if not txt:
+        return TAG_PLAIN + ":"
+    plain = TAG_PLAIN + ":" + txt
+    tag = _COMPRESSOR_TAGS.get(compressor or CODEC_COMPRESSOR)
+    raw = txt.encode("utf-8")
+    if tag is None or len(raw) < CODEC_COMPRESS_MIN:
+        return plain
+    packed = tag + ":" + _b64(_COMPRESS[tag](raw))
+    return packed if len(packed) < len(plain) else plain
+
+def codec_of(stored: Optional[str]) -> str:
+    if stored and len(stored) > 1 and stored[1] == ":":
+        return stored[0]
+    return "b64"
+
+def _decode(stored: Optional[str], note_id: Any = None) -> str:
+    if not stored:
+        return ""
+    tag = codec_of(stored)
+    try:
+        if tag == "b64":
+            return _unb64(stored).decode("utf-8")
+        fn = _DECODE.get(tag)
+        if fn is None:
+            raise CodecError(f"unknown codec tag {tag!r}", note_id)
+        return fn(stored[2:])
+    except (ValueError, zlib.error, lzma.LZMAError) as e:  # includes binascii.Error and UnicodeError
+        raise CodecError(f"corrupt {tag} value: {e}", note_id) from e
+
+decode = timed("codec.decode")(_decode)
+
+@timed("codec.decode_many")
+def decode_many(values: Iterable[Optional[str]], note_ids: Optional[Iterable[Any]] = None) -> List[str]:
+    # list responses decode every title/description of a page; repeated values are decoded once.
+    # note_ids, one per value, names the note in the CodecError of a value that does not decode
+    values = list(values)
+    seen: Dict[Optional[str], str] = {}
+    for v, note_id in zip(values, itertools.repeat(None) if note_ids is None else note_ids):
+        if v not in seen:
+            seen[v] = _decode(v, note_id)
+    return [seen[v] for v in values]
+
+def is_encoded(stored: Optional[str]) -> bool:
+    # for migrations: True when decode() accepts the value as it is
+    try:
+        _decode(stored)
+        return True
+    except CodecError:
+        return False
+
+def recode(stored: Optional[str], legacy: bool = False) -> Optional[str]:
+    # for migrations: the tagged form of a legacy Base64 or never-encoded raw value, None if the value
+    # already decodes as tagged. A tag whose payload does not decode is raw text and gets encoded.
+    # legacy=True is for a database the codec has never written to: "p:..." is raw text there too.
+    if not stored:
+        return None
+    if not legacy and codec_of(stored) != "b64" and is_encoded(stored):
+        return None
+    return encode(_legacy(stored))
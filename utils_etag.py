@@ -0,0 +1,32 @@
+import hashlib
+from datetime import datetime
+from typing import Any, Optional
+
+# validators for conditional requests. A note's ETag changes with its rev (and with its creation
+# time, so a recycled id never matches); a list's ETag changes with the owner's notes_version,
+# which every note write bumps, and with the query that shaped the page. The owner is part of the
+# digest: two users at the same notes_version must never share a tag.
+
+def _digest(*parts: Any) -> str:
+    return hashlib.blake2s("|".join(map(str, parts)).encode("utf-8"), digest_size=6).hexdigest()
+
+def note_etag(unique_id: int, rev: Optional[int], created: Optional[datetime]) -> str:
+    return f'"{rev or 0}-{_digest(unique_id, created)}"'
+
+def list_etag(owner: Any, notes_version: Optional[int], *query: Any) -> str:
+    return f'"c{notes_version or 0}-{_digest(owner, *query)}"'
+
+def _tags(header: str):
+    return [t.strip() for t in header.split(",") if t.strip()]
+
+def none_match(header: Optional[str], etag: str) -> bool:
+    # If-None-Match uses the weak comparison: True means the client's copy is current (answer 304)
+    if not header:
+        return False
+    return any(t == "*" or t.removeprefix("W/") == etag for t in _tags(header))
+
+def if_match(header: Optional[str], etag: str) -> bool:
+    # If-Match uses the strong comparison; no header means no precondition
+    if header is None:
+        return True
+    return any(t == "*" or t == etag for t in _tags(header))
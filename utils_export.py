@@ -0,0 +1,70 @@
+import os, json, zlib
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Tuple
+from utils_history import encode_chain
+
+# GET /notes/export streams one JSON object per note (NDJSON), read from the database EXPORT_CHUNK
+# notes at a time, so memory stays flat however many notes a user has. POST /notes/import reads
+# the same format back and writes it IMPORT_BATCH notes at a time.
+EXPORT_CHUNK = max(1, int(os.getenv("EXPORT_CHUNK", "200")))
+IMPORT_BATCH = max(1, int(os.getenv("IMPORT_BATCH", "200")))
+IMPORT_MAX_LINE = int(os.getenv("IMPORT_MAX_LINE", str(8 << 20)))  # bytes; a longer line stops the import
+IMPORT_MAX_ERRORS = 100  # rejected lines reported back; the rest are only counted
+
+_EXPORT_FIELDS = ("uniqueID", "note_title", "note_description", "note_created", "rev", "note_history", "media")
+_INFLATE_STEP = 1 << 20  # bytes of decompressed output per step, so a gzip bomb can't balloon
+
+def _json_default(v: Any) -> Any:
+    if isinstance(v, datetime):
+        return v.isoformat()
+    raise TypeError(f"{type(v).__name__} is not JSON serializable")
+
+def export_line(note: Dict[str, Any]) -> bytes:
+    out = {k: note.get(k) for k in _EXPORT_FIELDS}
+    return (json.dumps(out, default=_json_default, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+
+async def ndjson_stream(chunks: AsyncIterator[List[Dict[str, Any]]], gzip: bool = False) -> AsyncIterator[bytes]:
+    z = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None
+    async for notes in chunks:
+        data = b"".join(export_line(n) for n in notes)
+        if z:
+            data = z.compress(data)
+        if data:
+            yield data
+    if z:
+        yield z.flush()
+
+def _inflate(z, data: bytes):
+    out = z.decompress(data, _INFLATE_STEP)
+    while out:
+        yield out
+        out = z.decompress(z.unconsumed_tail, _INFLATE_STEP) if z.unconsumed_tail else b""
+
+async def read_ndjson(chunks: AsyncIterator[bytes], gzip: bool = False) -> AsyncIterator[Tuple[int, bytes]]:
+    # (line number, line) for every non-blank line; ValueError for an over-long line, zlib.error for bad gzip
+    z = zlib.decompressobj(31) if gzip else None
+    buf = bytearray()
+    line_no = 0
+    async for data in chunks:
+        for piece in (_inflate(z, data) if z else (data,)):
+            buf += piece
+            start = 0
+            while (end := buf.find(b"\n", start)) >= 0:
+                line_no += 1
+                if end > start and buf[start:end].strip():
+                    yield line_no, bytes(buf[start:end])
+                start = end + 1
+            del buf[:start]
+            if len(buf) > IMPORT_MAX_LINE:
+                raise ValueError(f"line {line_no + 1} is longer than {IMPORT_MAX_LINE} bytes")
+    if z and not z.eof:
+        raise zlib.error("truncated gzip stream")
+    if buf.strip():
+        yield line_no + 1, bytes(buf)
+
+def import_history(title: str, description: str, history: List[Dict[str, Any]]) -> Tuple[int, List[Dict[str, Any]]]:
+    # exported history is materialized and newest first; it becomes revisions 0..n-1 of the
+    # imported note (current rev n) and is re-encoded as deltas like any other history
+    n = len(history)
+    versions = [dict(v, rev=n - 1 - i) for i, v in enumerate(history)]
+    return n, encode_chain(title, description, versions)
@@ -0,0 +1,147 @@
+import os, re, json
+from datetime import datetime, timezone
+from difflib import SequenceMatcher
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
+from utils_codec import encode, decode
+
+# every Nth archived revision is stored in full; anything else is a reverse delta against the next
+# newer version, so rebuilding any revision applies at most N - 1 deltas
+HISTORY_KEYFRAME_INTERVAL = max(1, int(os.getenv("HISTORY_KEYFRAME_INTERVAL", "10")))
+
+KIND_FULL = "full"
+KIND_DELTA = "delta"
+
+Delta = List[Union[str, List[int]]]
+
+_TOKEN = re.compile(r"\s+|[^\s]+")
+
+def _tokens(txt: str) -> List[str]:
+    return _TOKEN.findall(txt or "")
+
+def make_delta(src: str, dst: str) -> Delta:
+    # ops are either [start, length] (copy from src) or a literal string to insert
+    src_toks, dst_toks = _tokens(src), _tokens(dst)
+    offsets = [0]
+    for t in src_toks:
+        offsets.append(offsets[-1] + len(t))
+    ops: Delta = []
+    sm = SequenceMatcher(None, src_toks, dst_toks, autojunk=False)
+    for tag, i1, i2, j1, j2 in sm.get_opcodes():
+        if tag == "equal":
+            start, length = offsets[i1], offsets[i2] - offsets[i1]
+            if ops and isinstance(ops[-1], list) and sum(ops[-1]) == start:
+                ops[-1][1] += length
+            else:
+                ops.append([start, length])
+        elif tag in ("replace", "insert"):
+            txt = "".join(dst_toks[j1:j2])
+            if ops and isinstance(ops[-1], str):
+                ops[-1] += txt
+            else:
+                ops.append(txt)
+    return ops
+
+def apply_delta(src: str, delta: Delta) -> str:
+    return "".join(src[op[0]:op[0] + op[1]] if isinstance(op, list) else op for op in delta)
+
+def _pack(delta: Delta) -> str:
+    return encode(json.dumps(delta, separators=(",", ":"), ensure_ascii=False))
+
+def _unpack(stored: str) -> Delta:
+    return json.loads(decode(stored))
+
+def is_keyframe(rev: int) -> bool:
+    return rev % HISTORY_KEYFRAME_INTERVAL == 0
+
+def encode_revision(rev: int, title: str, description: str, next_title: str, next_description: str, keyframe: Optional[bool] = None) -> Dict[str, Any]:
+    # title/description are the archived (plain) version, next_* the version that replaced it
+    if keyframe is None:
+        keyframe = is_keyframe(rev)
+    full = {"rev": rev, "kind": KIND_FULL, "note_title": encode(title), "note_description": encode(description)}
+    if keyframe:
+        return full
+    delta = {
+        "rev": rev,
+        "kind": KIND_DELTA,
+        "note_title": _pack(make_delta(next_title, title)),
+        "note_description": _pack(make_delta(next_description, description)),
+    }
+    # tiny or rewritten notes can produce deltas bigger than the text itself
+    if len(delta["note_title"]) + len(delta["note_description"]) >= len(full["note_title"]) + len(full["note_description"]):
+        return full
+    return delta
+
+def _kind(entry: Dict[str, Any]) -> str:
+    # snapshot-style history written before deltas existed has no kind and is a full copy
+    return entry.get("kind") or KIND_FULL
+
+def number_revisions(entries: List[Dict[str, Any]], current_rev: Optional[int]) -> List[int]:
+    nxt = len(entries) if current_rev is None else current_rev
+    out = []
+    for e in entries:
+        r = e.get("rev")
+        nxt = (nxt - 1) if r is None else r
+        out.append(nxt)
+    return out
+
+def _step(entry: Dict[str, Any], title: str, description: str) -> Tuple[str, str]:
+    if _kind(entry) == KIND_DELTA:
+        return apply_delta(title, _unpack(entry.get("note_title", ""))), apply_delta(description, _unpack(entry.get("note_description", "")))
+    return decode(entry.get("note_title", "")), decode(entry.get("note_description", ""))
+
+def materialize(title: str, description: str, entries: List[Dict[str, Any]], current_rev: Optional[int] = None) -> List[Dict[str, Any]]:
+    # entries are newest first; title/description are the current (decoded) note contents
+    out = []
+    for entry, rev in zip(entries, number_revisions(entries, current_rev)):
+        title, description = _step(entry, title, description)
+        out.append({"rev": rev, "note_title": title, "note_description": description, "archived_at": entry.get("archived_at")})
+    return out
+
+def reconstruct(title: str, description: str, entries: List[Dict[str, Any]], rev: int, current_rev: Optional[int] = None) -> Optional[Tuple[str, str]]:
+    revs = number_revisions(entries, current_rev)
+    if rev not in revs:
+        return None
+    target = revs.index(rev)
+    start = 0
+    for i in range(target, -1, -1):
+        if _kind(entries[i]) == KIND_FULL:
+            start = i
+            break
+    for entry in entries[start:target + 1]:
+        title, description = _step(entry, title, description)
+    return title, description
+
+def encode_chain(title: str, description: str, versions: List[Dict[str, Any]], full_revs: Optional[Set[int]] = None) -> List[Dict[str, Any]]:
+    # re-encode a materialized, newest-first history; keyframes sit every N entries from the newest
+    # and at every rev in full_revs
+    out = []
+    next_title, next_description = title, description
+    for i, v in enumerate(versions):
+        keyframe = i % HISTORY_KEYFRAME_INTERVAL == 0 or (full_revs is not None and v["rev"] in full_revs)
+        entry = encode_revision(v["rev"], v["note_title"], v["note_description"], next_title, next_description, keyframe=keyframe)
+        entry["archived_at"] = v.get("archived_at")
+        out.append(entry)
+        next_title, next_description = v["note_title"], v["note_description"]
+    return out
+
+def utc(value: Optional[datetime]) -> Optional[datetime]:
+    # SQLite and pymongo hand back naive UTC datetimes; compare everything as aware UTC
+    if value is None:
+        return None
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+def version_at(title: str, description: str, entries: List[Dict[str, Any]], current_rev: Optional[int], as_of: datetime) -> Tuple[int, str, str]:
+    # (rev, title, description) of the version that was current at as_of. archived_at is when a
+    # version was replaced, so that is the oldest one archived after as_of, or the current one.
+    # entries are newest first and only those archived after as_of are needed (any older ones are
+    # ignored). A revision dropped by compaction resolves to the next newer one that was kept.
+    newer: List[Dict[str, Any]] = []
+    for e in entries:
+        at = utc(e.get("archived_at"))
+        if at is None or at <= as_of:
+            break
+        newer.append(e)
+    revs = number_revisions(newer, current_rev)
+    if not newer:
+        return current_rev or 0, title, description
+    return (revs[-1], *reconstruct(title, description, newer, revs[-1], current_rev))
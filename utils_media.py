@@ -1,12 +1,37 @@
-import os, uuid, pathlib
-from typing import Tuple, Optional, Dict
+import os, re, uuid, hashlib, pathlib, asyncio
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Tuple, Optional, Dict, List, Any, Iterable
 from fastapi import UploadFile
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import StaticFiles, NotModifiedResponse
+from starlette.types import Scope
+from utils_metrics import timed
 
 ALLOWED_MIME = {
     "image/jpeg", "image/png", "image/gif", "image/webp",
     "video/mp4", "video/webm", "video/quicktime",
 }
 MAX_BYTES = 5 * 1024 * 1024  # 5MB
+CHUNK_BYTES = 1024 * 1024  # 1MB chunks
+UPLOAD_CONCURRENCY = max(1, int(os.getenv("UPLOAD_CONCURRENCY", "4")))  # files ingested at once per request
+# "uuid": a fresh file per upload; "cas": one file per distinct content, named by its sha256 and
+# reference-counted per attaching note in the active backend (media_blobs)
+MEDIA_STORAGE = os.getenv("MEDIA_STORAGE", "uuid").lower()
+MEDIA_CACHE_MAX_AGE = int(os.getenv("MEDIA_CACHE_MAX_AGE", str(365 * 24 * 3600)))  # seconds
+# cas: seconds an upload keeps its blob alive with no note attached, so a concurrent delete of
+# the last note using the same bytes cannot remove the file before the new note attaches it
+MEDIA_UPLOAD_HOLD = int(os.getenv("MEDIA_UPLOAD_HOLD", "3600"))
+
+# cas names come from the mime type so the same bytes always land on the same path
+_MIME_EXT = {
+    "image/jpeg": ".jpg", "image/png": ".png", "image/gif": ".gif", "image/webp": ".webp",
+    "video/mp4": ".mp4", "video/webm": ".webm", "video/quicktime": ".mov",
+}
+_BLOB_URL = re.compile(r"^/uploads/(images|videos)/([0-9a-f]{64})(\.[a-z0-9]+)?$")
 
 def ensure_dir(path: str) -> None:
     pathlib.Path(path).mkdir(parents=True, exist_ok=True)
@@ -18,34 +43,127 @@ def safe_ext(filename: str) -> str:
     ext = pathlib.Path(filename).suffix.lower()
     return ext if ext in {".jpg",".jpeg",".png",".gif",".webp",".mp4",".webm",".mov"} else ""
 
-async def save_upload(base_dir: str, file: UploadFile) -> Tuple[Optional[Dict], Optional[str]]:
+def _discard(path: str) -> None:
+    try: os.remove(path)
+    except OSError: pass
+
+@timed("media.write")
+def _write(out, digest, chunk: bytes) -> None:
+    if digest is not None:
+        digest.update(chunk)
+    out.write(chunk)
+
+@timed("media.publish")
+def _publish(tmp_path: str, abs_path: str) -> None:
+    # cas: always renamed into place, even over identical content: the blob is held by now, and
+    # this puts back a file that a delete removed after this upload's digest was computed
+    os.replace(tmp_path, abs_path)
+
+def hold_until() -> datetime:
+    return datetime.now(timezone.utc) + timedelta(seconds=MEDIA_UPLOAD_HOLD)
+
+def blob_digest(url: str) -> Optional[str]:
+    m = _BLOB_URL.match(url or "")
+    return m.group(2) if m else None
+
+def blob_refs(media: Iterable[Dict[str, Any]]) -> Dict[str, Tuple[str, int]]:
+    # digest -> (url, references) for the content-addressed entries of a note's media list
+    urls = {}
+    counts: Counter = Counter()
+    for m in media or []:
+        d = blob_digest(m.get("url"))
+        if d:
+            urls[d] = m["url"]; counts[d] += 1
+    return {d: (urls[d], n) for d, n in counts.items()}
+
+def _blob_path(base_dir: str, m: re.Match) -> str:
+    return os.path.join(base_dir, m.group(1), m.group(2) + (m.group(3) or ""))
+
+def _stash(path: str) -> Optional[str]:
+    # moved aside under a hidden name (never served) until the blob is known to be unused
+    gone = os.path.join(os.path.dirname(path), f".{uuid.uuid4().hex}.gone")
+    try:
+        os.replace(path, gone)
+    except OSError:
+        return None
+    return gone
+
+def remove_blob_files(base_dir: str, urls: List[str], in_use: Callable[[str], bool]) -> int:
+    # the blocking twin of remove_blobs, for the compactor thread; returns how many files went
+    removed = 0
+    for url in urls:
+        m = _BLOB_URL.match(url)
+        gone = _stash(_blob_path(base_dir, m)) if m else None
+        if gone is None:
+            continue
+        if in_use(m.group(2)):
+            os.replace(gone, _blob_path(base_dir, m))
+        else:
+            _discard(gone)
+            removed += 1
+    return removed
+
+BlobInUse = Callable[[str], Awaitable[bool]]
+BlobHold = Callable[[str, str], Awaitable[None]]
+
+async def remove_blobs(base_dir: str, urls: List[str], in_use: Optional[BlobInUse] = None) -> None:
+    # urls whose last reference went away (returned by the repositories' delete_note). An upload
+    # of the same bytes may hold the blob again meanwhile: in_use(digest) is asked after the file
+    # is moved aside, and a held blob gets its file back
+    for url in urls:
+        m = _BLOB_URL.match(url)
+        if not m:
+            continue
+        path = _blob_path(base_dir, m)
+        gone = await run_in_threadpool(_stash, path)
+        if gone is None:
+            continue
+        if in_use is not None and await in_use(m.group(2)):
+            await run_in_threadpool(os.replace, gone, path)
+        else:
+            await run_in_threadpool(_discard, gone)
+
+async def save_upload(base_dir: str, file: UploadFile, hold: Optional[BlobHold] = None) -> Tuple[Optional[Dict], Optional[str]]:
+    # cas: hold(digest, url) marks the blob in use before the file is put in place
     mime = (file.content_type or "").lower()
     if mime not in ALLOWED_MIME:
         return None, f"unsupported content-type: {mime}"
 
-    ext = safe_ext(file.filename or "")
+    cas = MEDIA_STORAGE == "cas"
     sub = guess_subdir(mime)
-    ensure_dir(os.path.join(base_dir, sub))
-    fname = f"{uuid.uuid4().hex}{ext or ''}"
-    abs_path = os.path.join(base_dir, sub, fname)
+    # written under a temp name and renamed into place, so /uploads never serves a partial file
+    tmp_path = os.path.join(base_dir, sub, f".{uuid.uuid4().hex}.part")
+    digest = hashlib.sha256() if cas else None
 
+    # every filesystem call goes through the threadpool; the event loop only awaits
     total = 0
     try:
-        with open(abs_path, "wb") as out:
+        await run_in_threadpool(ensure_dir, os.path.join(base_dir, sub))
+        out = await run_in_threadpool(open, tmp_path, "wb")
+        try:
             while True:
-                chunk = await file.read(1024 * 1024)  # 1MB chunks
+                chunk = await file.read(CHUNK_BYTES)
                 if not chunk:
                     break
                 total += len(chunk)
                 if total > MAX_BYTES:
-                    out.close()
-                    try: os.remove(abs_path)
-                    except: pass
-                    return None, "file too large (>5MB)"
-                out.write(chunk)
+                    break
+                await run_in_threadpool(_write, out, digest, chunk)
+        finally:
+            await run_in_threadpool(out.close)
+        if total > MAX_BYTES:
+            await run_in_threadpool(_discard, tmp_path)
+            return None, "file too large (>5MB)"
+        if cas:
+            fname = digest.hexdigest() + _MIME_EXT[mime]
+            if hold is not None:
+                await hold(digest.hexdigest(), f"/uploads/{sub}/{fname}")
+            await run_in_threadpool(_publish, tmp_path, os.path.join(base_dir, sub, fname))
+        else:
+            fname = f"{uuid.uuid4().hex}{safe_ext(file.filename or '')}"
+            await run_in_threadpool(os.replace, tmp_path, os.path.join(base_dir, sub, fname))
     except Exception as e:
-        try: os.remove(abs_path)
-        except: pass
+        await run_in_threadpool(_discard, tmp_path)
         return None, f"write error: {e}"
 
     rel_url = f"/uploads/{sub}/{fname}"
@@ -56,3 +174,35 @@ async def save_upload(base_dir: str, file: UploadFile) -> Tuple[Optional[Dict],
         "original_name": file.filename or fname,
     }
     return meta, None
+
+async def save_uploads(base_dir: str, files: List[UploadFile], concurrency: int = UPLOAD_CONCURRENCY,
+                       hold: Optional[BlobHold] = None) -> List[Tuple[Optional[Dict], Optional[str]]]:
+    # results keep the order of `files`
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(f: UploadFile):
+        async with sem:
+            return await save_upload(base_dir, f, hold)
+
+    return list(await asyncio.gather(*(one(f) for f in files)))
+
+class MediaFiles(StaticFiles):
+    # upload names are never reused for different bytes (uuid4, or the sha256 of the content), so
+    # the name is a strong ETag and responses may be cached for good. Range/206, If-Range and
+    # http.response.pathsend (zero-copy where the server supports it) come from FileResponse.
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        # .part files are uploads still being written
+        if any(part.startswith(".") for part in pathlib.PurePath(path).parts):
+            raise HTTPException(status_code=404)
+        return await super().get_response(path, scope)
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope, status_code: int = 200) -> Response:
+        headers = {
+            "etag": f'"{pathlib.PurePath(full_path).stem}"',
+            "cache-control": f"public, max-age={MEDIA_CACHE_MAX_AGE}, immutable",
+        }
+        response = FileResponse(full_path, status_code=status_code, stat_result=stat_result, headers=headers)
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
@@ -0,0 +1,136 @@
+import os, time, bisect, threading, functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+# process-local latency histograms, served as Prometheus text on GET /metrics. A phase (repository
+# call, codec, bcrypt, media write) is timed wherever it runs; while a request is in flight its
+# phases also go to a context-local list, which SERVER_TIMING=1 turns into a Server-Timing header.
+# Context variables follow the request into the threadpool and into AsyncSession.run_sync.
+# Phases nest: a repository call includes the codec work done inside it.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1").lower() in ("1", "true", "yes")
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0").lower() in ("1", "true", "yes")
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _label(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class Histogram:
+    # cumulative buckets are built at render time; observe() only bumps one bucket, the sum and the count
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...], buckets: Tuple[float, ...] = BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float, *values: str) -> None:
+        i = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            s = self._series.get(values)
+            if s is None:
+                s = self._series[values] = [0] * (len(self.buckets) + 1) + [0.0]
+            s[i] += 1
+            s[-1] += seconds
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = {k: list(v) for k, v in self._series.items()}
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for values, s in sorted(series.items()):
+            labels = "".join(f'{k}="{_label(v)}",' for k, v in zip(self.labels, values))
+            total = 0
+            for le, n in zip(self.buckets + (float("inf"),), s[:-1]):
+                total += n
+                out.append(f'{self.name}_bucket{{{labels}le="{"+Inf" if le == float("inf") else le}"}} {total}')
+            out.append(f"{self.name}_sum{{{labels.rstrip(',')}}} {s[-1]:.6f}")
+            out.append(f"{self.name}_count{{{labels.rstrip(',')}}} {total}")
+        return out
+
+PHASES = Histogram("notes_phase_seconds", "Time spent in one phase of a request (db.*, codec.*, hash, media.*, model).", ("phase",))
+REQUESTS = Histogram("notes_http_request_seconds", "HTTP request latency by route template.", ("method", "route", "status"))
+
+_timings: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("notes_timings", default=None)
+
+def record(name: str, seconds: float) -> None:
+    PHASES.observe(seconds, name)
+    timings = _timings.get()
+    if timings is not None:
+        timings.append((name, seconds))  # list.append is atomic, so threadpool phases can add concurrently
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    if not METRICS_ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+def timed(name: str) -> Callable[[Callable], Callable]:
+    # for hot synchronous functions; with metrics off the function is returned unwrapped
+    def wrap(fn: Callable) -> Callable:
+        if not METRICS_ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record(name, time.perf_counter() - start)
+        return inner
+    return wrap
+
+def server_timing(timings: List[Tuple[str, float]], total: float) -> str:
+    # repeated phases (one codec call per note) are summed into one entry
+    durs: Dict[str, float] = {}
+    for name, seconds in list(timings):
+        durs[name] = durs.get(name, 0.0) + seconds
+    durs["total"] = total
+    return ", ".join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in durs.items())
+
+class MetricsMiddleware:
+    # plain ASGI rather than BaseHTTPMiddleware, so streamed responses pass through untouched
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            return await self.app(scope, receive, send)
+        timings: List[Tuple[str, float]] = []
+        token = _timings.set(timings)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_timed(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if SERVER_TIMING:
+                    # phases still to come (the body of a streamed response) are not in the header
+                    header = server_timing(timings, time.perf_counter() - start).encode("latin-1")
+                    message = {**message, "headers": [*message.get("headers", []), (b"server-timing", header)]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            _timings.reset(token)
+            # the route template keeps the label set bounded; unrouted paths share one series
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            REQUESTS.observe(time.perf_counter() - start, scope["method"], route, str(status))
+
+def render_metrics(caches: Dict[str, Dict[str, int]]) -> str:
+    out = PHASES.render() + REQUESTS.render()
+    for metric, key, kind, help in (
+        ("notes_cache_size", "size", "gauge", "Entries held by an in-process cache."),
+        ("notes_cache_maxsize", "maxsize", "gauge", "Capacity of an in-process cache."),
+        ("notes_cache_hits_total", "hits", "counter", "Cache lookups that found an entry."),
+        ("notes_cache_misses_total", "misses", "counter", "Cache lookups that found nothing."),
+        ("notes_cache_evictions_total", "evictions", "counter", "Entries dropped to stay within maxsize."),
+    ):
+        out += [f"# HELP {metric} {help}", f"# TYPE {metric} {kind}"]
+        out += [f'{metric}{{cache="{_label(name)}"}} {stats.get(key, 0)}' for name, stats in caches.items()]
+    return "\n".join(out) + "\n"
@@ -0,0 +1,37 @@
+import base64, json
+from typing import Optional
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+def encode_cursor(unique_id: Optional[int]) -> Optional[str]:
+    if unique_id is None:
+        return None
+    raw = json.dumps({"id": unique_id}, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: Optional[str]) -> Optional[int]:
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        value = json.loads(raw)["id"]
+    except Exception as e:
+        raise ValueError("invalid cursor") from e
+    if not isinstance(value, int):
+        raise ValueError("invalid cursor")
+    return value
+
+def page_bounds(rows: list, limit: Optional[int], after: Optional[int], before: Optional[int], key) -> tuple:
+    # rows were fetched with limit + 1 in scan order; trim, restore ascending order and work out cursors
+    has_more = limit is not None and len(rows) > limit
+    if has_more:
+        rows = rows[:limit]
+    if before is not None:
+        rows = list(reversed(rows))
+        prev_id = key(rows[0]) if rows and has_more else None
+        next_id = key(rows[-1]) if rows else None
+    else:
+        next_id = key(rows[-1]) if rows and has_more else None
+        prev_id = key(rows[0]) if rows and after is not None else None
+    return rows, next_id, prev_id
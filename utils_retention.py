@@ -0,0 +1,138 @@
+import os, re, math, time, logging, threading
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from utils_history import materialize, encode_chain, utc
+
+# which archived revisions survive history compaction. HISTORY_RETENTION is a comma-separated list
+# of <age>=<spacing> tiers, youngest first: a revision archived within <age> keeps one revision per
+# <spacing> slot (the newest in it); "all" keeps every one, "none" drops them. "*" as the last age
+# covers everything older. Revisions older than every tier, or with no archived_at, are kept.
+# The current version of a note is never touched.
+HISTORY_RETENTION = os.getenv("HISTORY_RETENTION", "24h=all,7d=1h,*=1d")
+HISTORY_COMPACT_BATCH = int(os.getenv("HISTORY_COMPACT_BATCH", "100"))  # notes read per batch
+HISTORY_COMPACT_RATE = float(os.getenv("HISTORY_COMPACT_RATE", "200"))  # notes per second at most; 0 = unlimited
+# seconds between compaction passes run inside the app; 0 (the default) leaves it to the script
+HISTORY_COMPACT_INTERVAL = float(os.getenv("HISTORY_COMPACT_INTERVAL", "0"))
+# a deleted note leaves a tombstone (its last version and its history) so GET /notes?as_of= can
+# still show it at times it existed; compaction passes purge tombstones older than this.
+# "0" turns them off: a delete erases the history at once, as before.
+TOMBSTONE_RETENTION = os.getenv("TOMBSTONE_RETENTION", "30d")
+
+Tier = Tuple[float, Optional[float]]  # (max age, spacing); spacing None keeps all, 0 keeps none
+
+_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 7 * 86400}
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)([smhdw])")
+
+log = logging.getLogger("notes.compactor")
+
+def _seconds(txt: str) -> float:
+    m = _DURATION.fullmatch(txt.strip().lower())
+    if not m:
+        raise ValueError(f"Bad duration {txt!r} (use e.g. 30m, 24h, 7d, 2w)")
+    return float(m.group(1)) * _UNITS[m.group(2)]
+
+def parse_retention(spec: str) -> List[Tier]:
+    tiers: List[Tier] = []
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        age, _, spacing = part.partition("=")
+        spacing = spacing.strip().lower()
+        max_age = math.inf if age.strip() == "*" else _seconds(age)
+        tiers.append((max_age, None if spacing == "all" else 0.0 if spacing == "none" else _seconds(spacing)))
+    if [t[0] for t in tiers] != sorted(t[0] for t in tiers):
+        raise ValueError("HISTORY_RETENTION tiers must be listed youngest first")
+    return tiers
+
+RETENTION_TIERS = parse_retention(HISTORY_RETENTION)
+TOMBSTONE_SECONDS = 0.0 if TOMBSTONE_RETENTION.strip() in ("", "0") else _seconds(TOMBSTONE_RETENTION)
+TOMBSTONES = TOMBSTONE_SECONDS > 0
+
+def _timestamp(value: Any) -> Optional[float]:
+    return utc(value).timestamp() if isinstance(value, datetime) else None
+
+def revisions_to_keep(versions: List[Dict[str, Any]], now: float, tiers: List[Tier] = RETENTION_TIERS) -> Set[int]:
+    # versions are newest first, so the first revision seen in a slot is the one that stays
+    keep: Set[int] = set()
+    slots: Set[Tuple[int, int]] = set()
+    for v in versions:
+        ts = _timestamp(v.get("archived_at"))
+        tier = None if ts is None else next((i for i, (max_age, _) in enumerate(tiers) if now - ts <= max_age), None)
+        if tier is None or tiers[tier][1] is None:
+            keep.add(v["rev"])
+        elif tiers[tier][1] > 0:
+            slot = (tier, math.floor(ts / tiers[tier][1]))
+            if slot not in slots:
+                slots.add(slot)
+                keep.add(v["rev"])
+    return keep
+
+def compact_entries(title: str, description: str, entries: List[Dict[str, Any]], current_rev: Optional[int], now: float,
+                    tiers: List[Tier] = RETENTION_TIERS, heads: Optional[Callable[[List[int]], Set[int]]] = None) -> Optional[Tuple[List[Dict[str, Any]], List[int]]]:
+    # (the kept revisions re-encoded newest first, the dropped revs), or None when nothing goes.
+    # Dropped revisions leave gaps in the numbering; every entry carries its rev, so the rest keep
+    # theirs. heads(kept revs) names revisions that must be stored in full (Mongo bucket heads).
+    versions = materialize(title, description, entries, current_rev)
+    keep = revisions_to_keep(versions, now, tiers)
+    if len(keep) == len(versions):
+        return None
+    kept = [v for v in versions if v["rev"] in keep]
+    dropped = [v["rev"] for v in versions if v["rev"] not in keep]
+    return encode_chain(title, description, kept, heads([v["rev"] for v in kept]) if heads else None), dropped
+
+def entry_bytes(entries: List[Dict[str, Any]]) -> int:
+    # stored text only, the part compaction can reclaim
+    return sum(len(e.get("note_title") or "") + len(e.get("note_description") or "") for e in entries)
+
+def new_report() -> Dict[str, int]:
+    return {"notes": 0, "compacted": 0, "revisions": 0, "bytes": 0, "conflicts": 0, "tombstones": 0, "blobs": 0}
+
+def merge_report(total: Dict[str, int], part: Dict[str, int]) -> Dict[str, int]:
+    for k, v in part.items():
+        total[k] = total.get(k, 0) + v
+    return total
+
+Step = Callable[[int, int, float, bool], Optional[Tuple[int, Dict[str, int]]]]
+
+def compact_pass(step: Step, batch: int = HISTORY_COMPACT_BATCH, rate: float = HISTORY_COMPACT_RATE, dry_run: bool = False,
+                 stop: Optional[threading.Event] = None, purge: Optional[Callable[[float], int]] = None,
+                 sweep: Optional[Callable[[], int]] = None) -> Dict[str, int]:
+    # step(after, limit, now, dry_run) compacts the next `limit` notes with a key above `after` and
+    # returns (last key, report), or None past the last note. Between batches the pass sleeps
+    # enough to stay under `rate` notes per second, so foreground requests keep the database.
+    # purge(cutoff) drops the tombstones of notes deleted before cutoff and returns how many;
+    # sweep() removes the media blobs released while an upload held them and returns how many.
+    report = new_report()
+    after, now = 0, time.time()
+    if purge is not None and TOMBSTONES and not dry_run:
+        report["tombstones"] = purge(now - TOMBSTONE_SECONDS)
+    if sweep is not None and not dry_run:
+        report["blobs"] = sweep()
+    while stop is None or not stop.is_set():
+        started = time.perf_counter()
+        res = step(after, batch, now, dry_run)
+        if res is None:
+            break
+        after, part = res
+        merge_report(report, part)
+        if rate > 0:
+            pause = part["notes"] / rate - (time.perf_counter() - started)
+            if pause > 0 and (stop.wait(pause) if stop is not None else time.sleep(pause)):
+                break
+    return report
+
+def start_compactor(step: Step, purge: Optional[Callable[[float], int]] = None, sweep: Optional[Callable[[], int]] = None,
+                    interval: float = HISTORY_COMPACT_INTERVAL) -> threading.Event:
+    # a daemon thread running a pass every `interval` seconds; set the returned event to stop it.
+    # Each worker process runs its own, which is safe (every rewrite is a compare-and-set) but wasteful.
+    stop = threading.Event()
+
+    def loop():
+        while not stop.wait(interval):
+            try:
+                r = compact_pass(step, stop=stop, purge=purge, sweep=sweep)
+                log.info("history compaction: %(notes)d notes read, %(compacted)d compacted, %(revisions)d revisions and %(bytes)d bytes reclaimed, "
+                         "%(tombstones)d tombstones purged, %(blobs)d media blobs removed", r)
+            except Exception:
+                log.exception("history compaction pass failed")
+
+    threading.Thread(target=loop, name="history-compactor", daemon=True).start()
+    return stop
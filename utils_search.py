@@ -0,0 +1,22 @@
+import re
+from typing import List
+
+# GET /notes/search turns q into plain terms that must all match, so user input never reaches
+# the FTS5 / $text query syntax; the last term also matches as a prefix where the engine allows
+MAX_TERMS = 16
+TITLE_WEIGHT = 10.0  # a hit in the title ranks above the same hit in the description
+
+_TERM = re.compile(r"\w+", re.UNICODE)
+
+def search_terms(q: str) -> List[str]:
+    return _TERM.findall((q or "").lower())[:MAX_TERMS]
+
+def fts5_query(terms: List[str]) -> str:
+    quoted = [f'"{t}"' for t in terms]
+    if quoted:
+        quoted[-1] += "*"
+    return " ".join(quoted)
+
+def mongo_text_query(terms: List[str]) -> str:
+    # quoted terms make $text require every one of them instead of any
+    return " ".join(f'"{t}"' for t in terms)
@@ -0,0 +1,79 @@
+import os, difflib
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from utils_cache import LRUCache
+from utils_history import _tokens
+
+# an edit or restore only adds version n + 1, so reconstructed versions and diffs between them can
+# be cached until evicted. History compaction is the one thing that takes versions away, in any
+# process (Scripts.CompactHistory, another worker): it bumps the note's history_gen, which is part
+# of the key, so entries from before a compaction are never served after it. Keys also carry the
+# note's creation time so a deleted note's entries can never be served for a reused id.
+VERSION_CACHE_SIZE = int(os.getenv("VERSION_CACHE_SIZE", "2048"))
+DIFF_CACHE_SIZE = int(os.getenv("DIFF_CACHE_SIZE", "1024"))
+
+DIFF_MODES = ("unified", "words")
+
+_versions = LRUCache(VERSION_CACHE_SIZE)
+_diffs = LRUCache(DIFF_CACHE_SIZE)
+
+NoteKey = Tuple[int, str, int]
+
+def note_key(unique_id: int, created: Optional[datetime], history_gen: Optional[int] = 0) -> NoteKey:
+    return unique_id, str(created), history_gen or 0
+
+def cached_version(key: NoteKey, rev: int) -> Optional[Dict[str, Any]]:
+    return _versions.get((key, rev))
+
+def store_version(key: NoteKey, version: Dict[str, Any]) -> Dict[str, Any]:
+    _versions.set((key, version["rev"]), version)
+    return version
+
+def forget_versions(key: NoteKey, revs: List[int]) -> None:
+    # frees this process's entries at once; the history_gen in the key is what keeps other processes right
+    for rev in revs:
+        _versions.pop((key, rev))
+
+def make_version(rev: int, title: str, description: str) -> Dict[str, Any]:
+    return {"rev": rev, "note_title": title, "note_description": description}
+
+def unified_diff(a: str, b: str, a_rev: int, b_rev: int) -> str:
+    lines = difflib.unified_diff(a.splitlines(keepends=True), b.splitlines(keepends=True), fromfile=f"rev {a_rev}", tofile=f"rev {b_rev}")
+    return "".join(line if line.endswith("\n") else line + "\n" for line in lines)
+
+def word_diff(a: str, b: str) -> List[Dict[str, str]]:
+    # [{"op": "equal" | "delete" | "insert", "text": ...}]; a replace is a delete followed by an insert
+    a_toks, b_toks = _tokens(a), _tokens(b)
+    out: List[Dict[str, str]] = []
+
+    def emit(op: str, toks: List[str]) -> None:
+        if not toks:
+            return
+        if out and out[-1]["op"] == op:
+            out[-1]["text"] += "".join(toks)
+        else:
+            out.append({"op": op, "text": "".join(toks)})
+
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, a_toks, b_toks, autojunk=False).get_opcodes():
+        if tag == "equal":
+            emit("equal", a_toks[i1:i2])
+        else:
+            emit("delete", a_toks[i1:i2])
+            emit("insert", b_toks[j1:j2])
+    return out
+
+def diff_versions(key: NoteKey, a: Dict[str, Any], b: Dict[str, Any], mode: str) -> Dict[str, Any]:
+    ck = (key, a["rev"], b["rev"], mode)
+    hit = _diffs.get(ck)
+    if hit is not None:
+        return hit
+    if mode == "unified":
+        fields = {f: unified_diff(a[f], b[f], a["rev"], b["rev"]) for f in ("note_title", "note_description")}
+    else:
+        fields = {f: word_diff(a[f], b[f]) for f in ("note_title", "note_description")}
+    out = {"uniqueID": key[0], "from_rev": a["rev"], "to_rev": b["rev"], "mode": mode, **fields}
+    _diffs.set(ck, out)
+    return out
+
+def version_cache_stats() -> Dict[str, Dict[str, int]]:
+    return {"versions": _versions.stats(), "diffs": _diffs.stats()}